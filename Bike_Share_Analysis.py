@@ -202,6 +202,8 @@
    "metadata": {},
    "outputs": [],
    "source": [
+    "from bikeshare.schema import get_schema # raw file layout of each city\n",
+    "\n",
     "def duration_in_mins(datum, city):\n",
     "    \"\"\"\n",
     "    Takes as input a dictionary containing info about a single trip (datum) and\n",
@@ -217,10 +219,10 @@
     "    \"\"\"\n",
     "\n",
     "    # YOUR CODE HERE\n",
-    "    if city == 'NYC' or city == 'Chicago':\n",
-    "        duration = int(datum['tripduration'])/60\n",
-    "    else:\n",
-    "        duration = int(datum['Duration (ms)'])/(1000*60)\n",
+    "    # the duration column and its unit come from the city's schema, see\n",
+    "    # bikeshare/schema.py\n",
+    "    schema = get_schema(city)\n",
+    "    duration = int(datum[schema.duration_column])/schema.per_minute\n",
     "    \n",
     "    return duration\n",
     "    \"\"\"\"\n",
@@ -264,23 +266,12 @@
     "    Converting the starttime to return the month, hour and day of the week.\n",
     "    \"\"\"\n",
     "        \n",
-    "    if city =='NYC':\n",
-    "        startdate = datetime.strptime((datum['starttime']), '%m/%d/%Y %H:%M:%S') \n",
-    "        month = int(startdate.strftime(\"%m\"))\n",
-    "        hour = int(startdate.strftime(\"%H\"))\n",
-    "        day_of_week = startdate.strftime(\"%A\")\n",
-    "        \n",
-    "    elif city =='Chicago':\n",
-    "        startdate = datetime.strptime((datum['starttime']), '%m/%d/%Y %H:%M') \n",
-    "        month = int(startdate.strftime(\"%m\"))\n",
-    "        hour = int(startdate.strftime(\"%H\"))\n",
-    "        day_of_week = startdate.strftime(\"%A\")\n",
-    "        \n",
-    "    else:\n",
-    "        startdate = datetime.strptime((datum['Start date']), '%m/%d/%Y %H:%M') \n",
-    "        month = int(startdate.strftime(\"%m\"))\n",
-    "        hour = int(startdate.strftime(\"%H\"))\n",
-    "        day_of_week = startdate.strftime(\"%A\")\n",
+    "    # the start time column and format come from the city's schema\n",
+    "    schema = get_schema(city)\n",
+    "    startdate = datetime.strptime((datum[schema.start_column]), schema.time_format) \n",
+    "    month = int(startdate.strftime(\"%m\"))\n",
+    "    hour = int(startdate.strftime(\"%H\"))\n",
+    "    day_of_week = startdate.strftime(\"%A\")\n",
     "    \n",
     "    \n",
     "    return (month, hour, day_of_week)\n",
@@ -317,13 +308,9 @@
     "    \"\"\"\n",
     "    Converting the type of the system user to match with the data in all the cities.\n",
     "    \"\"\"\n",
-    "    if city == 'NYC' or city == 'Chicago':\n",
-    "        user_type = datum['usertype']\n",
-    "    else:\n",
-    "        if datum['Member Type'] == 'Registered':\n",
-    "            user_type = 'Subscriber'\n",
-    "        elif datum['Member Type'] == 'Casual':\n",
-    "            user_type = 'Customer'\n",
+    "    # Washington's schema maps 'Registered'/'Casual' onto 'Subscriber'/'Customer'\n",
+    "    schema = get_schema(city)\n",
+    "    user_type = schema.user_type(datum[schema.user_type_column])\n",
     "    \n",
     "    return user_type\n",
     "    \n",
@@ -369,10 +356,17 @@
     "        trip_writer.writeheader()\n",
     "        \n",
     "        ## TODO: set up csv DictReader object ##\n",
-    "        trip_reader = csv.DictReader(f_in)\n",
+    "        # a plain csv reader: the city's schema is compiled against the header\n",
+    "        # into positional extractors, so no dictionary is built per row. The\n",
+    "        # extractor decodes each start time once per row with the cached\n",
+    "        # StartTimeDecoder; see bikeshare/schema.py\n",
+    "        trip_reader = csv.reader(f_in)\n",
+    "        extract = get_schema(city).compile(next(trip_reader))\n",
     "\n",
     "        # collect data from and process each row\n",
     "        for row in trip_reader:\n",
+    "            if not row:\n",
+    "                continue\n",
     "            # set up a dictionary to hold the values for the cleaned and trimmed\n",
     "            # data point\n",
     "            new_point = {}\n",
@@ -381,15 +375,16 @@
     "            ## the original data dictionaries.                              ##\n",
     "            ## Note that the keys for the new_point dictionary should match ##\n",
     "            ## the column names set in the DictWriter object above.         ##\n",
-    "            new_point['duration'] = duration_in_mins(row,city)\n",
-    "            new_point['month']=  time_of_trip(row,city)[0]\n",
-    "            new_point['hour'] = time_of_trip(row,city)[1]\n",
-    "            new_point['day_of_week'] = time_of_trip(row,city)[2]\n",
-    "            new_point['user_type'] = type_of_user(row,city)\n",
+    "            duration, month, hour, day_of_week, user_type = extract(row)\n",
+    "            new_point['duration'] = duration\n",
+    "            new_point['month'] = month\n",
+    "            new_point['hour'] = hour\n",
+    "            new_point['day_of_week'] = day_of_week\n",
+    "            new_point['user_type'] = user_type\n",
     "\n",
     "            ## TODO: write the processed information to the output file.     ##\n",
     "            ## see https://docs.python.org/3/library/csv.html#writer-objects ##\n",
-    "            trip_writer.writerow(new_point)           "
+    "            trip_writer.writerow(new_point)"
    ]
   },
   {
@@ -438,8 +433,19 @@
     "Creating an output file from data in the input file.\n",
     "\"\"\"\n",
     "\n",
+    "# Set condense_workers to None to condense all cities in parallel on every\n",
+    "# CPU, or to a number of worker processes. The output is the same as the\n",
+    "# serial loop.\n",
+    "condense_workers = 1\n",
+    "\n",
+    "if condense_workers == 1:\n",
+    "    for city, filenames in city_info.items():\n",
+    "        condense_data(filenames['in_file'], filenames['out_file'], city)\n",
+    "else:\n",
+    "    from bikeshare.parallel import condense_cities\n",
+    "    condense_cities(city_info, workers=condense_workers)\n",
+    "\n",
     "for city, filenames in city_info.items():\n",
-    "    condense_data(filenames['in_file'], filenames['out_file'], city)\n",
     "    print_first_point(filenames['out_file'])"
    ]
   },
@@ -471,35 +477,10 @@
    "metadata": {},
    "outputs": [],
    "source": [
-    "def number_of_trips(filename):\n",
-    "    \"\"\"\n",
-    "    This function reads in a file with trip data and reports the number of\n",
-    "    trips made by subscribers, customers, and total overall.\n",
-    "    \"\"\"\n",
-    "    with open(filename, 'r') as f_in:\n",
-    "        # set up csv reader object\n",
-    "        reader = csv.DictReader(f_in)\n",
-    "        \n",
-    "        # initialize count variables\n",
-    "        n_subscribers = 0\n",
-    "        n_customers = 0\n",
-    "        \n",
-    "        # tally up ride types\n",
-    "        for row in reader:\n",
-    "            if row['user_type'] == 'Subscriber':\n",
-    "                n_subscribers += 1\n",
-    "            else:\n",
-    "                n_customers += 1\n",
-    "        \n",
-    "        # compute total number of rides\n",
-    "        n_total = n_subscribers + n_customers\n",
-    "        \n",
-    "        #compute the ratios for the different user types\n",
-    "        n_subs_ratio = '{0:.2%}'.format(n_subscribers/n_total)\n",
-    "        n_cust_ratio = '{0:.2%}'.format(n_customers/n_total)\n",
-    "        \n",
-    "        # return tallies as a tuple\n",
-    "        return(n_subscribers, n_customers, n_total, n_subs_ratio, n_cust_ratio)"
+    "# number_of_trips reads in a file with trip data and reports the number of\n",
+    "# trips made by subscribers, customers, and total overall. It lives in\n",
+    "# bikeshare/stats.py and accepts both the csv and the columnar summary files.\n",
+    "from bikeshare.stats import number_of_trips"
    ]
   },
   {
@@ -526,33 +507,40 @@
     "\n",
     "##data_file = './examples/BayArea-Y3-Summary.csv'\n",
     "\n",
+    "from bikeshare.cache import ResultCache\n",
+    "from bikeshare.stats import summarize_trips\n",
+    "\n",
+    "# Serve the summaries from a cache that is invalidated when a summary file\n",
+    "# changes, so rerunning the notebook does not rescan unchanged files.\n",
+    "summarize_trips = ResultCache('./data/.cache').cached(summarize_trips)\n",
+    "\n",
     "data_file1 = './data/Chicago-2016-Summary.csv'\n",
     "data_file2 = './data/NYC-2016-Summary.csv'\n",
     "data_file3 = './data/Washington-2016-Summary.csv'\n",
     "\n",
     "\n",
+    "# Summarizing each city in a single pass over its summary file.\n",
+    "summaries = {'Chicago': summarize_trips(data_file1),\n",
+    "             'NYC': summarize_trips(data_file2),\n",
+    "             'Washington': summarize_trips(data_file3)}\n",
+    "trip_counts = {city: summary.trip_counts() for city, summary in summaries.items()}\n",
+    "\n",
     "# Calculating the number of trips in the different cities.\n",
-    "num_trips = {'Chicago': number_of_trips(data_file1)[2],\n",
-    "           'NYC': number_of_trips(data_file2)[2], \n",
-    "           'Washington': number_of_trips(data_file3)[2]}\n",
+    "num_trips = {city: counts[2] for city, counts in trip_counts.items()}\n",
     "\n",
     "# Calculating the city with the maximum number of trips.\n",
     "max_num_trips = max(num_trips.keys(), key=(lambda x:num_trips[x]))\n",
     "\n",
     "\n",
     "# Calculating the subscriber ratio by city.\n",
-    "subs_ratio = {'Chicago': number_of_trips(data_file1)[3],\n",
-    "           'NYC': number_of_trips(data_file2)[3], \n",
-    "           'Washington': number_of_trips(data_file3)[3]}\n",
+    "subs_ratio = {city: counts[3] for city, counts in trip_counts.items()}\n",
     "\n",
     "# Calculating the city with the maximum subscriber ratio.\n",
     "max_subs_ratio = max(subs_ratio.keys(), key=(lambda x:subs_ratio[x]))\n",
     "\n",
     "\n",
     "# Calculating the customer ratio by city.\n",
-    "cust_ratio = {'Chicago': number_of_trips(data_file1)[4],\n",
-    "           'NYC': number_of_trips(data_file2)[4], \n",
-    "           'Washington': number_of_trips(data_file3)[4]}\n",
+    "cust_ratio = {city: counts[4] for city, counts in trip_counts.items()}\n",
     "\n",
     "\n",
     "# Calculating the city with the maximum customer ratio\n",
@@ -570,7 +558,7 @@
     "\n",
     "\n",
     "print('Customer ratio by City:{}' .format(cust_ratio))\n",
-    "print('City with the customer ratio is {} with {}'.format(max_cust_ratio, cust_ratio[max_cust_ratio]))\n"
+    "print('City with the customer ratio is {} with {}'.format(max_cust_ratio, cust_ratio[max_cust_ratio]))"
    ]
   },
   {
@@ -604,51 +592,10 @@
     "## TIP: For the Bay Area example, the average trip length is 14 minutes ##\n",
     "## and 3.5% of trips are longer than 30 minutes.                        ##\n",
     "\n",
-    "def travel_length(filename):\n",
-    "    \n",
-    "    \n",
-    "    with open(filename, 'r') as f_in:\n",
-    "        # set up csv reader object\n",
-    "        reader = csv.DictReader(f_in)\n",
-    "        \n",
-    "        short_trip = 0\n",
-    "        \n",
-    "        long_trip = 0  \n",
-    "        \n",
-    "        trip_length = 0\n",
-    "   \n",
-    "        for row in reader:\n",
-    "            \n",
-    "            # Calculating the total trip length\n",
-    "            trip_length += float(row['duration'])\n",
-    "            \n",
-    "            \"\"\" \n",
-    "            Based on duration criteria, long trip are greater than 30 minutes.\n",
-    "            \"\"\"\n",
-    "            if float(row['duration']) > 30:\n",
-    "                \n",
-    "                long_trip +=1\n",
-    "\n",
-    "            else:\n",
-    "                short_trip +=1\n",
-    "            \n",
-    "            # Calculating the total number of trip\n",
-    "            \n",
-    "            total_trip = short_trip + long_trip\n",
-    "            \n",
-    "            # Calculating the average number of trip\n",
-    "            \n",
-    "            average_trip = round((trip_length)/(total_trip),0)\n",
-    "            \n",
-    "            # Ratio of Short trips to the total number of trips\n",
-    "            short_trip_pct = '{0:.2%}'.format((short_trip)/(total_trip))\n",
-    "            \n",
-    "            # Ratio of Long trips to the total number of trips\n",
-    "            long_trip_pct =  '{0:.2%}'.format((long_trip)/(total_trip))\n",
-    "            \n",
-    "            \n",
-    "            # Return all the calculated values\n",
-    "        return (average_trip, short_trip_pct, long_trip_pct)"
+    "# travel_length returns the average trip length and the share of short and\n",
+    "# long trips. It lives in bikeshare/stats.py and accepts both the csv and the\n",
+    "# columnar summary files.\n",
+    "from bikeshare.stats import travel_length"
    ]
   },
   {
@@ -672,11 +619,12 @@
     "             'Washington': './data/Washington-2016-Summary.csv'}\n",
     "\n",
     "for city, file in data_file.items():\n",
-    "    average_trip, short_trip_pct, long_trip_pct = travel_length(file)\n",
+    "    # reuse the single-pass summaries from Question 4a\n",
+    "    average_trip, short_trip_pct, long_trip_pct = summaries[city].trip_lengths()\n",
     "    print('For {}, the average trip length is {} minutes and {} of trips are longer than 30 minutes'\n",
     "          .format(city,average_trip,long_trip_pct))\n",
     "    \n",
-    "    # Displaying all the values to the screen.\n"
+    "    # Displaying all the values to the screen."
    ]
   },
   {
@@ -705,33 +653,10 @@
     "## trip duration to be 54.6 minutes. Do the other cities have this     ##\n",
     "## level of difference?                                                ##\n",
     "\n",
-    "def rides_by_usertype(filename):\n",
-    "    with open(filename, 'r') as f_in:\n",
-    "        # set up csv reader object\n",
-    "        reader = csv.DictReader(f_in)\n",
-    "        \n",
-    "        n_subscribers = 0\n",
-    "        subs_trip_length = 0\n",
-    "        \n",
-    "        n_customers = 0\n",
-    "        cust_trip_length = 0\n",
-    "   \n",
-    "        for row in reader:\n",
-    "              \n",
-    "            # Calculating the trip length for the different user types.\n",
-    "            if row['user_type'] == 'Subscriber':\n",
-    "                n_subscribers += 1\n",
-    "                subs_trip_length += float(row['duration'])\n",
-    "            else:\n",
-    "                n_customers += 1\n",
-    "                cust_trip_length += float(row['duration'])\n",
-    "                \n",
-    "            # Calculating the average trip length for the different user types.    \n",
-    "        avg_sub_trip = round((subs_trip_length)/(n_subscribers),2)\n",
-    "        avg_cust_trip = round((cust_trip_length)/(n_customers),2)\n",
-    "                      \n",
-    "        return (avg_sub_trip, avg_cust_trip, n_subscribers, subs_trip_length, n_customers, cust_trip_length)\n",
-    "            # Returning all calculated values"
+    "# rides_by_usertype returns the average trip length of each user type. It\n",
+    "# lives in bikeshare/stats.py and accepts both the csv and the columnar\n",
+    "# summary files.\n",
+    "from bikeshare.stats import rides_by_usertype"
    ]
   },
   {
@@ -753,7 +678,7 @@
     "data_file = {'Washington': './data/Washington-2016-Summary.csv'}\n",
     "\n",
     "for city, file in data_file.items():\n",
-    "    avg_sub_trip, avg_cust_trip, n_subscribers, subs_trip_length, n_customers, cust_trip_length = rides_by_usertype(file)\n",
+    "    avg_sub_trip, avg_cust_trip, n_subscribers, subs_trip_length, n_customers, cust_trip_length = summaries[city].user_type_lengths()\n",
     "    \n",
     "    print('For {}, the average Subscriber trip duration is {} minutes and {} minutes the average Customer trip duration'\n",
     "          .format(city, avg_sub_trip, avg_cust_trip))\n",
@@ -782,7 +707,7 @@
     "             'NYC': './data/NYC-2016-Summary.csv'}\n",
     "\n",
     "for city, file in data_file.items():\n",
-    "    avg_sub_trip, avg_cust_trip, n_subscribers, subs_trip_length, n_customers, cust_trip_length = rides_by_usertype(file)\n",
+    "    avg_sub_trip, avg_cust_trip, n_subscribers, subs_trip_length, n_customers, cust_trip_length = summaries[city].user_type_lengths()\n",
     "    \n",
     "    print('For {}, the average Subscriber trip duration is {} minutes and {} minutes the average Customer trip duration'\n",
     "          .format(city, avg_sub_trip, avg_cust_trip))\n",
@@ -871,13 +796,17 @@
     "import matplotlib.pyplot as plt\n",
     "import numpy as np\n",
     "import pandas as pd\n",
+    "from bikeshare.columnar import load_summary_frame # csv, columnar or Parquet summary\n",
+    "from bikeshare.histogram import DurationHistogram # streaming histogram\n",
     "\n",
     "%matplotlib inline \n",
     "\n",
-    "dataframe = pd.read_csv('./data/Washington-2016-Summary.csv')\n",
-    "duration = dataframe['duration']\n",
+    "# Binning the durations while streaming through the summary file, instead of\n",
+    "# loading every trip into a DataFrame.\n",
     "num_bins = np.arange(0,200,5)\n",
-    "plt.hist(duration, num_bins, facecolor='#607c8e')\n",
+    "duration_hist = DurationHistogram(num_bins)\n",
+    "duration_hist.add_summary('./data/Washington-2016-Summary.csv')\n",
+    "duration_hist.plot(facecolor='#607c8e')\n",
     "plt.ylabel('Frequency')\n",
     "plt.xlabel('Duration (minutes)')\n",
     "plt.title('Frequency Distribution of Duration for Washington')\n",
@@ -934,14 +863,13 @@
     "\n",
     "%matplotlib inline \n",
     "\n",
-    "# Selecting the duration for the Subscriber user type\n",
-    "subs_duration = dataframe.query(\"user_type == 'Subscriber'\")\n",
-    "duration = subs_duration['duration']\n",
-    "\n",
-    "\n",
-    "#print(duration)\n",
+    "# Binning the durations of each user type in a single pass over the file.\n",
     "num_bins = np.arange(0, 75, 5)\n",
-    "plt.hist(duration, num_bins, facecolor='#56B4E9')\n",
+    "user_type_hist = DurationHistogram(num_bins, split_by='user_type')\n",
+    "user_type_hist.add_summary('./data/Washington-2016-Summary.csv')\n",
+    "\n",
+    "# Plotting the duration for the Subscriber user type\n",
+    "user_type_hist.plot('Subscriber', facecolor='#56B4E9')\n",
     "plt.ylabel('Frequency')\n",
     "plt.xlabel('Duration (minutes)')\n",
     "plt.title('Distribution of Duration for Subscribers in Washington')\n",
@@ -955,13 +883,8 @@
     "plt.show()\n",
     "\n",
     "\n",
-    "# Selecting the duration for the Customer user type\n",
-    "cust_duration = dataframe.query(\"user_type == 'Customer'\")\n",
-    "duration = cust_duration['duration']\n",
-    "\n",
-    "#print(duration)\n",
-    "num_bins = np.arange(0, 75, 5)\n",
-    "plt.hist(duration, num_bins, facecolor='#607C8E')\n",
+    "# Plotting the duration for the Customer user type\n",
+    "user_type_hist.plot('Customer', facecolor='#607C8E')\n",
     "plt.ylabel('Frequency')\n",
     "plt.xlabel('Duration (minutes)')\n",
     "plt.title('Distribution of Duration for Customers in Washington')\n",
@@ -1072,7 +995,9 @@
     }
    ],
    "source": [
-    "dataframe = pd.read_csv('./data/Washington-2016-Summary.csv')\n",
+    "# Loading only the columns this analysis uses\n",
+    "dataframe = load_summary_frame('./data/Washington-2016-Summary.csv',\n",
+    "                               columns=['duration', 'month', 'user_type'])\n",
     "\n",
     "# Calculating the number of rides by user type and month\n",
     "rides_count = dataframe.groupby(['user_type','month'])['duration'].count().reset_index()\n",
@@ -1197,7 +1122,9 @@
     }
    ],
    "source": [
-    "dataframe = pd.read_csv('./data/Washington-2016-Summary.csv')\n",
+    "# Loading only the columns this analysis uses\n",
+    "dataframe = load_summary_frame('./data/Washington-2016-Summary.csv',\n",
+    "                               columns=['duration', 'day_of_week', 'user_type'])\n",
     "\n",
     "# Calculating the number of rides by user type and day of week\n",
     "rides_count = dataframe.groupby(['user_type','day_of_week'])['duration'].count().reset_index()\n",
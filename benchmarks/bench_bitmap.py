@@ -0,0 +1,100 @@
+"""
+Benchmark of the bitmap index filters of bikeshare/bitmap.py.
+
+Condenses a synthetic NYC file of --rows trips into a summary, builds its
+BitmapIndex, and times filtered counts, row id sets and duration sums
+against a scan of the summary with the same filter. Every answer of the
+index is checked against the scan, duration sums included to the last bit,
+since both add the durations in row order.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_bitmap --rows 500000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_city_file
+from bikeshare.bitmap import BitmapIndex
+from bikeshare.cube import as_set
+from bikeshare.pipeline import read_trips
+from bikeshare.trips import condense_data
+
+
+# name and keyword filters of each timed query
+QUERIES = [
+    ('summer weekend mornings', {'user_type': 'Subscriber',
+                                 'day_of_week': ['Saturday', 'Sunday'],
+                                 'month': [6, 7, 8], 'hour': [7, 8]}),
+    ('one month', {'month': 3}),
+    ('customers at night', {'user_type': 'Customer', 'hour': [22, 23, 0, 1]}),
+    ('subscribers', {'user_type': 'Subscriber'}),
+]
+
+
+def best_time(func, repeat):
+    """
+    Returns the fastest of repeat timings of func() in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def scan(filename, filters):
+    """
+    Returns the row ids and the total duration of the trips of a summary
+    file matching the filters, in a single pass over the file.
+    """
+    wanted = [(name, as_set(values)) for name, values in filters.items()]
+    rows = []
+    total = 0
+    for row_id, trip in enumerate(read_trips(filename)):
+        if all(getattr(trip, name) in values for name, values in wanted):
+            rows.append(row_id)
+            total += trip.duration
+    return rows, total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=500000, help='synthetic trips')
+    parser.add_argument('--repeat', type=int, default=5, help='timings per query')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        summary_file = os.path.join(tmp_dir, 'NYC-2016-Summary.csv')
+        index_file = os.path.join(tmp_dir, 'NYC-2016-Summary.bidx')
+        condense_data(write_city_file('NYC', args.rows, tmp_dir), summary_file, 'NYC')
+
+        started = time.perf_counter()
+        BitmapIndex.build(summary_file, 'NYC').save(index_file)
+        print('built the index of {:,} trips in {:.2f} s, {:,} bytes'.format(
+            args.rows, time.perf_counter() - started, os.path.getsize(index_file)))
+        index = BitmapIndex.load(index_file)
+
+        for name, filters in QUERIES:
+            scan_seconds = best_time(lambda: scan(summary_file, filters), 1)
+            count = best_time(lambda: index.count(**filters), args.repeat)
+            row_ids = best_time(lambda: index.row_ids(**filters), args.repeat)
+            duration_sum = best_time(lambda: index.duration_sum(**filters), args.repeat)
+            print('{:<24} {:>8,} trips: count {:,.0f} us, row ids {:,.0f} us, '
+                  'duration sum {:,.0f} us, scan {:,.0f} ms'.format(
+                      name, index.count(**filters), count * 1e6, row_ids * 1e6,
+                      duration_sum * 1e6, scan_seconds * 1e3))
+
+            rows, total = scan(summary_file, filters)
+            assert index.count(**filters) == len(rows)
+            assert list(index.row_ids(**filters)) == rows
+            assert index.duration_sum(**filters) == total
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Benchmark of the live ingestion service of bikeshare/ingest.py.
+
+Starts the service on a free local port and posts synthetic raw trips of
+every city in csv batches from several client threads, while another
+thread keeps reading /stats. Reports the trips ingested per second and the
+latency of the stats requests, then checks the final counts and mean
+durations against `summarize_trips` on the condensed synthetic files.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ingest --rows 50000 --batch 1000 --clients 4
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.synthetic import SCHEMAS, generate_rows, write_city_file
+from bikeshare.ingest import IngestServer
+from bikeshare.stats import summarize_trips
+from bikeshare.trips import condense_data
+
+
+def start_server():
+    """
+    Runs an IngestServer on a free port in a background thread and returns
+    it with its event loop.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def start():
+        server = IngestServer(port=0)
+        await server.start()
+        return server
+
+    return (asyncio.run_coroutine_threadsafe(start(), loop).result(), loop)
+
+
+def post_batches(port, batches):
+    """
+    Posts (city, csv text) batches over one connection, retrying refused ones.
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    for city, text in batches:
+        while True:
+            connection.request('POST', '/trips/' + city, body=text.encode('utf-8'),
+                               headers={'Content-Type': 'text/csv'})
+            response = connection.getresponse()
+            response.read()
+            if response.status != 503:
+                break
+            time.sleep(float(response.getheader('Retry-After', 1)))
+        assert response.status == 202, response.status
+    connection.close()
+
+
+def poll_stats(port, stop, latencies):
+    """
+    Reads /stats until stop is set, recording the latency of each request.
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    while not stop.is_set():
+        started = time.perf_counter()
+        connection.request('GET', '/stats')
+        connection.getresponse().read()
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.005)
+    connection.close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=50000, help='synthetic trips per city')
+    parser.add_argument('--batch', type=int, default=1000, help='trips per posted batch')
+    parser.add_argument('--clients', type=int, default=4, help='posting threads')
+    args = parser.parse_args(argv)
+
+    batches = []
+    for city, schema in SCHEMAS.items():
+        header = ','.join(schema['header']) + '\n'
+        rows = list(generate_rows(city, args.rows))
+        for start in range(0, len(rows), args.batch):
+            batches.append((city, header + ''.join(rows[start:start + args.batch])))
+
+    server, loop = start_server()
+    stop = threading.Event()
+    latencies = []
+    poller = threading.Thread(target=poll_stats, args=(server.port, stop, latencies))
+    poller.start()
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=post_batches,
+                                args=(server.port, batches[number::args.clients]))
+               for number in range(args.clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    asyncio.run_coroutine_threadsafe(server.queue.join(), loop).result()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    poller.join()
+
+    connection = http.client.HTTPConnection('127.0.0.1', server.port)
+    connection.request('GET', '/stats')
+    stats = json.loads(connection.getresponse().read())['cities']
+    connection.close()
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+    n_trips = args.rows * len(SCHEMAS)
+    print('ingested {:,} trips in {:.2f} s: {:,.0f} trips/s'.format(
+        n_trips, elapsed, n_trips / elapsed))
+    print('stats latency over {} requests: p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'.format(
+        len(latencies), percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.99) * 1000, max(latencies) * 1000))
+
+    # the live aggregates must agree with the summary of the same trips
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for city in SCHEMAS:
+            out_file = os.path.join(tmp_dir, city + '-2016-Summary.csv')
+            condense_data(write_city_file(city, args.rows, tmp_dir), out_file, city)
+            summary = summarize_trips(out_file)
+            live = stats[city]
+            assert (live['n_subscribers'], live['n_customers'], live['long_trip']) == \
+                (summary.n_subscribers, summary.n_customers, summary.long_trip)
+            assert math.isclose(live['mean_trip_length'], summary.mean_trip_length)
+    print('live statistics match summarize_trips')
+
+
+if __name__ == '__main__':
+    main()
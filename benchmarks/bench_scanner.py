@@ -0,0 +1,83 @@
+"""
+Benchmark of reading the raw city files through the memory-mapped scanner.
+
+For synthetic raw files of each city, compares the time to read every row
+with csv.reader over the open text file against `RawScanner.reader`, once on
+the synthetic file, whose station names are sometimes quoted, and once on a
+copy without any quoted rows. Both readers must return the same rows.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_scanner --rows 300000
+"""
+
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import SCHEMAS, write_city_file
+from bikeshare.scanner import RawScanner
+
+
+def read_csv(filename):
+    with open(filename, 'r') as f_in:
+        return sum(1 for _ in csv.reader(f_in))
+
+
+def read_scanner(filename):
+    with RawScanner(filename) as scanner:
+        return sum(1 for _ in scanner.reader())
+
+
+CASES = [('csv.reader', read_csv),
+         ('scanner', read_scanner)]
+
+
+def write_unquoted(in_file, out_file):
+    """
+    Copies the raw file in_file to out_file leaving out the quoted rows.
+    """
+    with open(in_file, 'rb') as f_in, open(out_file, 'wb') as f_out:
+        f_out.writelines(line for line in f_in if b'"' not in line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=300000, help='synthetic trips per city')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per case, the fastest is reported')
+    args = parser.parse_args(argv)
+
+    print('{:<24}'.format('file') + ''.join('{:>14}'.format(name) for name, _ in CASES)
+          + '{:>10}'.format('speedup'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for city in SCHEMAS:
+            in_file = write_city_file(city, args.rows, tmp_dir)
+            unquoted = os.path.join(tmp_dir, 'unquoted.csv')
+            write_unquoted(in_file, unquoted)
+
+            for label, filename in ((city, in_file), (city + ' unquoted', unquoted)):
+                # the scanner is only worth measuring if it reads the same rows
+                with open(filename, 'r') as f_in, RawScanner(filename) as scanner:
+                    assert list(csv.reader(f_in)) == list(scanner.reader())
+
+                costs = []
+                for name, read in CASES:
+                    best = None
+                    for _ in range(args.repeat):
+                        started = time.perf_counter()
+                        n_rows = read(filename)
+                        elapsed = time.perf_counter() - started
+                        if best is None or elapsed < best:
+                            best = elapsed
+                    costs.append(best / n_rows * 1e9)
+
+                print('{:<24}'.format(label) + ''.join('{:>9,.0f} ns/r'.format(cost)
+                                                        for cost in costs)
+                      + '{:>9.1f}x'.format(costs[0] / costs[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark of the command line startup time of a stats-only invocation.
+
+Runs `python -m bikeshare stats` on a small summary file in fresh
+interpreters, reports the fastest wall-clock time against the 100ms target,
+and checks that numpy, pandas, matplotlib and pyarrow were not imported.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup --repeat 10
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# the heavy modules a stats-only invocation must not load
+HEAVY_MODULES = ('numpy', 'pandas', 'matplotlib', 'pyarrow')
+
+TARGET_SECONDS = 0.1
+
+# prints the heavy modules loaded after running the command line interface
+CHECK_IMPORTS = ('import sys\n'
+                 'from bikeshare.cli import main\n'
+                 'main(sys.argv[1:])\n'
+                 'print(",".join(m for m in {!r} if m in sys.modules), file=sys.stderr)\n'
+                 .format(HEAVY_MODULES))
+
+
+def write_summary(filename, n_rows=1000):
+    """
+    Writes a small csv summary file to run the statistics on.
+    """
+    with open(filename, 'w') as f_out:
+        f_out.write('duration,month,hour,day_of_week,user_type\n')
+        for i in range(n_rows):
+            f_out.write('{},{},{},Monday,{}\n'.format(
+                i % 97 + 0.5, i % 12 + 1, i % 24, 'Subscriber' if i % 3 else 'Customer'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='interpreter starts, the fastest is reported')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        summary = os.path.join(tmp_dir, 'Bench-2016-Summary.csv')
+        write_summary(summary)
+        command = [sys.executable, '-m', 'bikeshare', 'stats', summary]
+
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - started
+            if best is None or elapsed < best:
+                best = elapsed
+
+        # the bare interpreter start is the floor of any invocation
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        interpreter = time.perf_counter() - started
+
+        loaded = subprocess.run([sys.executable, '-c', CHECK_IMPORTS, 'stats', summary],
+                                check=True, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        heavy = loaded.stderr.strip()
+
+    print('stats startup: {:.1f} ms (target {:.0f} ms, bare interpreter {:.1f} ms)'.format(
+        best * 1000, TARGET_SECONDS * 1000, interpreter * 1000))
+    print('heavy modules imported: {}'.format(heavy or 'none'))
+    if best > TARGET_SECONDS or heavy:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Benchmark of the SQLite trip store of bikeshare/store.py.
+
+Condenses a synthetic NYC file of --rows trips into a summary, bulk loads
+it into a TripStore, and times the statistics and the month and weekday
+pivots of the store against the same answers computed from the summary
+file. Counts must match exactly; durations are summed by SQLite in its own
+order, so totals and means are compared with a relative tolerance.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_store --rows 500000
+"""
+
+import argparse
+import math
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_city_file
+from bikeshare.cube import TripCube
+from bikeshare.pipeline import read_trips
+from bikeshare.stats import summarize_trips
+from bikeshare.store import TripStore
+from bikeshare.trips import condense_data
+
+
+def best_time(func, repeat):
+    """
+    Returns the fastest of repeat timings of func() in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def summary_cube(filename):
+    """
+    Returns the TripCube of the trips of a summary file.
+    """
+    cube = TripCube()
+    for trip in read_trips(filename):
+        cube.add(*trip)
+    return cube
+
+
+def check_rollups(expected, actual):
+    """
+    Checks that two rollups have the same groups and counts, and totals that
+    agree to a relative tolerance.
+    """
+    assert sorted(expected) == sorted(actual)
+    for key, stats in expected.items():
+        assert stats.count == actual[key].count
+        assert math.isclose(stats.total, actual[key].total, rel_tol=1e-9)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=500000, help='synthetic trips')
+    parser.add_argument('--repeat', type=int, default=3, help='timings per query')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        summary_file = os.path.join(tmp_dir, 'NYC-2016-Summary.csv')
+        condense_data(write_city_file('NYC', args.rows, tmp_dir), summary_file, 'NYC')
+
+        with TripStore(os.path.join(tmp_dir, 'trips.db')) as store:
+            started = time.perf_counter()
+            store.load_summary(summary_file, 'NYC')
+            seconds = time.perf_counter() - started
+            print('loaded {:,} trips in {:.2f} s, {:,.0f} trips/s'.format(
+                args.rows, seconds, args.rows / seconds))
+
+            file_stats = best_time(lambda: summarize_trips(summary_file), args.repeat)
+            store_stats = best_time(lambda: store.summarize('NYC'), args.repeat)
+            print('stats: summary file {:,.0f} ms, store {:,.0f} ms'.format(
+                file_stats * 1e3, store_stats * 1e3))
+            expected = summarize_trips(summary_file)
+            actual = store.summarize('NYC')
+            assert expected.trip_counts() == actual.trip_counts()
+            assert expected.long_trip == actual.long_trip
+            assert math.isclose(expected.trip_length, actual.trip_length, rel_tol=1e-9)
+
+            file_pivots = best_time(lambda: summary_cube(summary_file), 1)
+            cube = summary_cube(summary_file)
+            for name, by, filters in [('month pivot', ('month', 'user_type'), {}),
+                                      ('weekday pivot', ('day_of_week', 'user_type'), {}),
+                                      ('weekday mornings', ('day_of_week',), {'hour': [7, 8, 9]})]:
+                seconds = best_time(lambda: store.rollup('NYC', *by, **filters), args.repeat)
+                print('{}: store {:,.1f} ms'.format(name, seconds * 1e3))
+                check_rollups(cube.rollup(*by, **filters), store.rollup('NYC', *by, **filters))
+            print('cube of the summary file for the pivots: {:,.0f} ms'.format(file_pivots * 1e3))
+
+
+if __name__ == '__main__':
+    main()
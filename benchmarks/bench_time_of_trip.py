@@ -0,0 +1,90 @@
+"""
+Benchmark of the start time decoding used by `condense_data`.
+
+Compares rows/sec of the reference `time_of_trip` (called three times per row
+the way the notebook's `condense_data` used to) against a single call of the
+cached `StartTimeDecoder`, on synthetic start times for each city.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_time_of_trip --rows 200000
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from bikeshare.schema import SCHEMAS
+from bikeshare.timeparse import StartTimeDecoder
+from bikeshare.trips import time_of_trip
+
+
+def make_rows(city, n_rows, seed=2016):
+    """
+    Returns a list of n_rows trip dictionaries holding only a random 2016
+    start time in the format used by the given city.
+    """
+    column, time_format = SCHEMAS[city].start_column, SCHEMAS[city].time_format
+    rng = random.Random(seed)
+    start = datetime(2016, 1, 1)
+    rows = []
+    for _ in range(n_rows):
+        when = start + timedelta(seconds=rng.randrange(366 * 24 * 3600))
+        # the raw files do not zero-pad the month and day
+        text = '{}/{}/{} {}'.format(when.month, when.day, when.year,
+                                    when.strftime(time_format.split(' ')[1]))
+        rows.append({column: text})
+    return rows
+
+
+def best_of(func, repeat):
+    """
+    Returns the fastest wall-clock time in seconds of `repeat` calls of func.
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=200000,
+                        help='synthetic rows per city')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per case, the fastest is reported')
+    args = parser.parse_args(argv)
+
+    print('{:<12}{:>16}{:>16}{:>10}'.format('city', 'time_of_trip x3',
+                                            'decoder', 'speedup'))
+    for city in SCHEMAS:
+        rows = make_rows(city, args.rows)
+        decoder = StartTimeDecoder(city)
+
+        # both paths must agree before their speed is worth comparing
+        for row in rows[:1000]:
+            assert decoder(row) == time_of_trip(row, city)
+
+        def reference():
+            for row in rows:
+                time_of_trip(row, city)[0]
+                time_of_trip(row, city)[1]
+                time_of_trip(row, city)[2]
+
+        def decoded():
+            for row in rows:
+                decoder(row)
+
+        reference_rate = args.rows / best_of(reference, args.repeat)
+        decoded_rate = args.rows / best_of(decoded, args.repeat)
+        print('{:<12}{:>12,.0f} r/s{:>12,.0f} r/s{:>9.1f}x'.format(
+            city, reference_rate, decoded_rate, decoded_rate / reference_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark of the sliding window metrics of bikeshare/window.py.
+
+Feeds a stream of synthetic trip events to a 15 minute and a one hour
+SlidingWindow, with event times moving forward at --rate events per second
+of event time and jittered out of order by up to twice the allowed
+lateness, so that some events arrive too late. Reports the cost of an
+update and of a window query, and the events per minute of wall-clock time
+this allows. The final windows are checked against a brute force count of
+the events that were accepted.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_window --events 2000000
+"""
+
+import argparse
+import random
+import time
+
+from bikeshare.window import DEFAULT_LATENESS_SECONDS, DEFAULT_WINDOWS, SlidingWindow
+
+
+USER_TYPES = ('Subscriber', 'Customer')
+
+
+def make_events(n_events, rate, lateness, seed=2016):
+    """
+    Returns a list of n_events (timestamp, duration, user_type) tuples.
+    """
+    rng = random.Random(seed)
+    start = 1451606400
+    events = []
+    for number in range(n_events):
+        jitter = rng.random() * 2 * lateness if rng.random() < 0.05 else 0
+        events.append((start + number / rate - jitter, rng.randrange(60, 3600) / 60,
+                       USER_TYPES[rng.random() < 0.2]))
+    return events
+
+
+def accepted_events(events, window):
+    """
+    Returns the events a window of the same length accepts: those at most
+    its lateness older than the latest event before them, whose bucket is
+    still in the window.
+    """
+    accepted = []
+    latest = None
+    for event in events:
+        timestamp = event[0]
+        if latest is not None and timestamp < latest - window.lateness_seconds:
+            continue
+        latest = timestamp if latest is None else max(latest, timestamp)
+        head = int(latest // window.bucket_seconds)
+        if int(timestamp // window.bucket_seconds) > head - window.n_buckets:
+            accepted.append(event)
+    return accepted
+
+
+def brute_force(window, accepted):
+    """
+    Returns the count and the total duration in milliseconds by user type of
+    the accepted events that lie in the current buckets of the window.
+    """
+    totals = {}
+    for timestamp, duration, user_type in accepted:
+        if int(timestamp // window.bucket_seconds) > window.head - window.n_buckets:
+            count, total = totals.get(user_type, (0, 0))
+            totals[user_type] = (count + 1, total + round(duration * 60000))
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--events', type=int, default=2000000, help='events to feed')
+    parser.add_argument('--rate', type=float, default=50.0,
+                        help='events per second of event time')
+    parser.add_argument('--queries', type=int, default=1000000, help='window queries to time')
+    args = parser.parse_args(argv)
+
+    events = make_events(args.events, args.rate, DEFAULT_LATENESS_SECONDS)
+    for seconds in DEFAULT_WINDOWS:
+        window = SlidingWindow(seconds)
+        add = window.add
+        started = time.perf_counter()
+        for timestamp, duration, user_type in events:
+            add(timestamp, duration, user_type)
+        update = (time.perf_counter() - started) / len(events)
+
+        count = window.count
+        mean_duration = window.mean_duration
+        started = time.perf_counter()
+        for _ in range(args.queries // 2):
+            count('Customer')
+            mean_duration('Customer')
+        query = (time.perf_counter() - started) / args.queries
+
+        print('{:>5} s window: {:,.0f} ns/update ({:,.1f}M events/min), {:,.0f} ns/query, '
+              '{:,} dropped'.format(seconds, update * 1e9, 60 / update / 1e6, query * 1e9,
+                                    window.dropped))
+
+        accepted = accepted_events(events, window)
+        expected = brute_force(window, accepted)
+        for user_type in USER_TYPES:
+            count, total = expected.get(user_type, (0, 0))
+            assert window.count(user_type) == count
+            assert window.type_durations.get(user_type, 0) == total
+        assert window.dropped == len(events) - len(accepted)
+
+
+if __name__ == '__main__':
+    main()
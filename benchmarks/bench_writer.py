@@ -0,0 +1,120 @@
+"""
+Benchmark of the writer side of `condense_data`.
+
+Starting from trips whose start time and user type are already decoded, it
+compares the cost per row of writing the condensed csv rows:
+
+- dictwriter: a new_point dictionary per trip written with DictWriter.writerow
+- writer: a tuple per trip written with a positional csv.writer.writerow
+- batched: `write_condensed_rows`' path, memoized duration formatting and
+  writerows batches written to a 1MiB output buffer
+
+All three must write the same bytes. Run from the repository root:
+
+    python -m benchmarks.bench_writer --rows 300000
+"""
+
+import argparse
+import csv
+import filecmp
+import io
+import os
+import tempfile
+import time
+from itertools import islice
+
+from benchmarks.synthetic import SCHEMAS, generate_rows
+from bikeshare.compression import WRITE_BUFFER_BYTES
+from bikeshare.schema import get_schema
+from bikeshare.timeparse import StartTimeDecoder
+from bikeshare.trips import (BATCH_ROWS, OUT_COLNAMES, BatchSink,
+                             DurationFormatter, duration_in_mins, type_of_user)
+
+
+def decoded_trips(city, n_rows):
+    """
+    Returns a list of (datum, month, hour, day_of_week, user_type) for
+    n_rows synthetic trips of the city, datum holding the raw trip.
+    """
+    header = ','.join(SCHEMAS[city]['header']) + '\n'
+    f_in = io.StringIO(header + ''.join(generate_rows(city, n_rows)))
+    start_time = StartTimeDecoder(city)
+    return [(datum,) + start_time(datum) + (type_of_user(datum, city),)
+            for datum in csv.DictReader(f_in)]
+
+
+def write_dictwriter(trips, out_file, city):
+    with open(out_file, 'w') as f_out:
+        trip_writer = csv.DictWriter(f_out, fieldnames = OUT_COLNAMES)
+        for datum, month, hour, day_of_week, user_type in trips:
+            new_point = {}
+            new_point['duration'] = duration_in_mins(datum, city)
+            new_point['month'] = month
+            new_point['hour'] = hour
+            new_point['day_of_week'] = day_of_week
+            new_point['user_type'] = user_type
+            trip_writer.writerow(new_point)
+
+
+def write_writer(trips, out_file, city):
+    with open(out_file, 'w') as f_out:
+        writerow = csv.writer(f_out).writerow
+        for datum, month, hour, day_of_week, user_type in trips:
+            writerow((duration_in_mins(datum, city), month, hour, day_of_week, user_type))
+
+
+def write_batched(trips, out_file, city):
+    schema = get_schema(city)
+    duration = DurationFormatter(schema.per_minute)
+    column = schema.duration_column
+    new_points = ((duration(datum[column]), month, hour, day_of_week, user_type)
+                  for datum, month, hour, day_of_week, user_type in trips)
+    with open(out_file, 'w', buffering=WRITE_BUFFER_BYTES) as f_out:
+        sink = BatchSink()
+        writerows = csv.writer(sink).writerows
+        while True:
+            writerows(islice(new_points, BATCH_ROWS))
+            if not sink.flush_to(f_out):
+                break
+
+
+CASES = [('dictwriter', write_dictwriter),
+         ('writer', write_writer),
+         ('batched', write_batched)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=300000, help='synthetic trips per city')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per case, the fastest is reported')
+    args = parser.parse_args(argv)
+
+    print('{:<12}'.format('city') + ''.join('{:>14}'.format(name) for name, _ in CASES)
+          + '{:>10}'.format('speedup'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for city in SCHEMAS:
+            trips = decoded_trips(city, args.rows)
+            costs = []
+            for name, write in CASES:
+                out_file = os.path.join(tmp_dir, name + '.csv')
+                best = None
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    write(trips, out_file, city)
+                    elapsed = time.perf_counter() - started
+                    if best is None or elapsed < best:
+                        best = elapsed
+                costs.append(best / len(trips) * 1e9)
+
+            # the fast paths are only worth measuring if they write the same bytes
+            reference = os.path.join(tmp_dir, CASES[0][0] + '.csv')
+            for name, _ in CASES[1:]:
+                assert filecmp.cmp(reference, os.path.join(tmp_dir, name + '.csv'), shallow=False)
+
+            print('{:<12}'.format(city) + ''.join('{:>9,.0f} ns/r'.format(cost) for cost in costs)
+                  + '{:>9.1f}x'.format(costs[0] / costs[-1]))
+
+
+if __name__ == '__main__':
+    main()
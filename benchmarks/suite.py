@@ -0,0 +1,328 @@
+"""
+Benchmark suite for condensing and analysing the trip data.
+
+Synthetic raw files of the requested size are generated for all three
+cities (and reused on later runs with the same size and seed), then each
+benchmark case runs in a fresh process so that its peak memory can be
+measured on its own. For every case the suite reports the wall-clock time,
+the rows processed per second and the peak resident memory of the case's
+process (including any worker processes it started).
+
+Results can be saved as a baseline and compared with a later run:
+
+    python -m benchmarks.suite --rows 1000000 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.suite --rows 1000000 --baseline benchmarks/baseline.json
+
+Cases needing pandas or pyarrow are skipped when they are not installed.
+"""
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from benchmarks.synthetic import SCHEMAS, city_info, write_city_file
+
+
+# fractional slowdown against the baseline that is reported as a regression
+DEFAULT_TOLERANCE = 0.10
+
+
+def ensure_data(data_dir, n_rows, seed):
+    """
+    Generates the synthetic raw files in data_dir unless files of the same
+    size and seed are already there. Returns the notebook style city_info.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    marker = os.path.join(data_dir, 'synthetic.json')
+    wanted = {'rows': n_rows, 'seed': seed, 'cities': sorted(SCHEMAS)}
+    try:
+        with open(marker, 'r') as f_in:
+            existing = json.load(f_in)
+    except (OSError, ValueError):
+        existing = None
+
+    info = city_info(data_dir)
+    if existing != wanted or not all(os.path.exists(files['in_file'])
+                                     for files in info.values()):
+        for city in SCHEMAS:
+            print('Generating {:,} {} trips'.format(n_rows, city), file=sys.stderr)
+            write_city_file(city, n_rows, data_dir, seed)
+        with open(marker, 'w') as f_out:
+            json.dump(wanted, f_out)
+    return info
+
+
+def summary_file(info, city, suffix):
+    return info[city]['out_file'].replace('.csv', suffix)
+
+
+def partition_root(info):
+    return os.path.join(os.path.dirname(next(iter(info.values()))['out_file']), 'partitioned')
+
+
+def store_file(info):
+    return os.path.join(os.path.dirname(next(iter(info.values()))['out_file']), 'trips.db')
+
+
+# Every case takes the city_info of the synthetic data and returns the number
+# of trips it processed.
+
+def case_condense_python(info):
+    from bikeshare.trips import condense_data
+    for city, files in info.items():
+        condense_data(files['in_file'], files['out_file'], city)
+    return None
+
+
+def case_condense_columnar(info):
+    from bikeshare.trips import condense_data
+    for city, files in info.items():
+        condense_data(files['in_file'], summary_file(info, city, '.bsum'), city,
+                      out_format='columnar')
+    return None
+
+
+def case_condense_parquet(info):
+    from bikeshare.trips import condense_data
+    for city, files in info.items():
+        condense_data(files['in_file'], summary_file(info, city, '.parquet'), city,
+                      out_format='parquet')
+    return None
+
+
+def case_condense_partitioned(info):
+    from bikeshare.trips import condense_data
+    for city, files in info.items():
+        condense_data(files['in_file'], partition_root(info), city, partitioned=True)
+    return None
+
+
+def case_condense_parallel(info):
+    from bikeshare.parallel import condense_cities
+    condense_cities(info)
+    return None
+
+
+def case_condense_pandas(info):
+    from bikeshare.trips import condense_data
+    for city, files in info.items():
+        condense_data(files['in_file'], files['out_file'], city, engine='pandas')
+    return None
+
+
+def case_stats_csv(info):
+    from bikeshare.stats import number_of_trips, rides_by_usertype, travel_length
+    for files in info.values():
+        number_of_trips(files['out_file'])
+        travel_length(files['out_file'])
+        rides_by_usertype(files['out_file'])
+    return None
+
+
+def case_summarize_csv(info):
+    from bikeshare.stats import summarize_trips
+    for files in info.values():
+        summarize_trips(files['out_file'])
+    return None
+
+
+def case_summarize_columnar(info):
+    from bikeshare.stats import summarize_trips
+    for city in info:
+        summarize_trips(summary_file(info, city, '.bsum'))
+    return None
+
+
+def case_stats_one_month(info):
+    from bikeshare.stats import number_of_trips, rides_by_usertype, travel_length
+    for city in info:
+        # opens the March partition of each city only
+        number_of_trips(partition_root(info), cities=[city], months=[3])
+        travel_length(partition_root(info), cities=[city], months=[3])
+        rides_by_usertype(partition_root(info), cities=[city], months=[3])
+    return None
+
+
+def case_load_store(info):
+    from bikeshare.store import TripStore
+    with TripStore(store_file(info)) as store:
+        for city, files in info.items():
+            store.load_summary(files['out_file'], city)
+    return None
+
+
+def case_store_queries(info):
+    from bikeshare.store import TripStore
+    with TripStore(store_file(info)) as store:
+        for city in info:
+            # the statistics and both pivots, without parsing a summary
+            store.summarize(city)
+            store.rollup(city, 'month', 'user_type')
+            store.rollup(city, 'day_of_week', 'user_type')
+    return None
+
+
+def case_pandas_pivots(info):
+    import numpy as np
+    from bikeshare.columnar import load_summary_frame
+    for files in info.values():
+        dataframe = load_summary_frame(files['out_file'])
+        dataframe.groupby(['user_type', 'month'])['duration'].count()
+        dataframe.pivot_table(values='duration', index=['day_of_week'],
+                              columns=['user_type'], aggfunc=[np.sum, np.mean, len])
+    return None
+
+
+def case_parquet_pivots(info):
+    from bikeshare.columnar import load_summary_frame
+    for city in info:
+        # only the columns and the summer row groups the pivot needs
+        dataframe = load_summary_frame(summary_file(info, city, '.parquet'),
+                                       columns=['duration', 'month', 'user_type'],
+                                       months=[6, 7, 8])
+        dataframe.groupby(['user_type', 'month'])['duration'].count()
+    return None
+
+
+# name, function and the optional modules each case needs. rows/sec are
+# always counted in raw trips, so the cases compare directly.
+CASES = [
+    ('condense python', case_condense_python, []),
+    ('condense columnar', case_condense_columnar, []),
+    ('condense parquet', case_condense_parquet, ['pyarrow']),
+    ('condense partitioned', case_condense_partitioned, []),
+    ('condense parallel', case_condense_parallel, []),
+    ('condense pandas', case_condense_pandas, ['pandas', 'numpy']),
+    ('stats csv x3', case_stats_csv, []),
+    ('summarize csv', case_summarize_csv, []),
+    ('summarize columnar', case_summarize_columnar, []),
+    ('stats one month', case_stats_one_month, []),
+    ('load store', case_load_store, []),
+    ('store queries', case_store_queries, []),
+    ('pandas pivots', case_pandas_pivots, ['pandas', 'numpy']),
+    ('parquet pivots', case_parquet_pivots, ['pandas', 'pyarrow']),
+]
+
+
+def peak_memory_mb():
+    """
+    Returns the peak resident memory in MB of this process and of its
+    finished children, whichever is larger.
+    """
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale / (1024 * 1024)
+
+
+def run_case(func, info, connection):
+    """
+    Runs one case in the current (fresh) process and sends back its timing
+    and peak memory.
+    """
+    started = time.perf_counter()
+    func(info)
+    elapsed = time.perf_counter() - started
+    connection.send({'seconds': elapsed, 'peak_mb': peak_memory_mb()})
+    connection.close()
+
+
+def measure(func, info):
+    """
+    Runs a case in a freshly spawned process and returns its measurements.
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_case, args=(func, info, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None or process.exitcode != 0:
+        raise RuntimeError('benchmark case failed with exit code {}'.format(process.exitcode))
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Adds the speed relative to the baseline to each result and returns the
+    names of the cases that are slower than the baseline by more than
+    tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        result['vs_baseline'] = result['rows_per_sec'] / previous['rows_per_sec']
+        if result['vs_baseline'] < 1 - tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=100000, help='trips per city')
+    parser.add_argument('--seed', type=int, default=2016)
+    parser.add_argument('--data-dir', default='./data/synthetic')
+    parser.add_argument('--cases', nargs='+', help='run only the named cases')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--save-baseline', help='write the results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    info = ensure_data(args.data_dir, args.rows, args.seed)
+    n_trips = args.rows * len(info)
+
+    results = {}
+    for name, func, modules in CASES:
+        if args.cases and name not in args.cases:
+            continue
+        missing = [module for module in modules if importlib.util.find_spec(module) is None]
+        if missing:
+            print('{:<22}skipped, needs {}'.format(name, ', '.join(missing)))
+            continue
+        # the analysis cases need the summaries of the condense cases
+        if name.startswith(('stats', 'summarize', 'pandas')) and not os.path.exists(
+                summary_file(info, 'NYC', '.bsum')):
+            measure(case_condense_columnar, info)
+            measure(case_condense_python, info)
+
+        result = measure(func, info)
+        result['rows_per_sec'] = n_trips / result['seconds']
+        results[name] = result
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f_in:
+            regressions = compare(results, json.load(f_in), args.tolerance)
+
+    print('{:<22}{:>10}{:>14}{:>10}{:>12}'.format('case', 'seconds', 'rows/sec',
+                                                  'peak MB', 'vs baseline'))
+    for name, result in results.items():
+        ratio = result.get('vs_baseline')
+        print('{:<22}{:>10.3f}{:>14,.0f}{:>10.1f}{:>12}'.format(
+            name, result['seconds'], result['rows_per_sec'], result['peak_mb'],
+            '' if ratio is None else '{:.2f}x'.format(ratio)))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f_out:
+            json.dump({'rows': args.rows, 'seed': args.seed, 'results': results},
+                      f_out, indent=1)
+
+    if regressions:
+        print('Slower than the baseline: {}'.format(', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
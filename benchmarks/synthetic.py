@@ -0,0 +1,244 @@
+"""
+Deterministic synthetic raw trip files in the NYC, Chicago and Washington
+schemas.
+
+The files have the same header, column order and value formats as the real
+data files printed by `print_first_point`:
+
+- NYC: durations in seconds, start and stop times with seconds
+  ('1/1/2016 00:09:55'), 'Subscriber'/'Customer' user types
+- Chicago: durations in seconds, times without seconds ('3/31/2016 23:30')
+- Washington: durations in milliseconds, times without seconds and
+  'Registered'/'Casual' member types
+
+Start times follow a seasonal and daily profile, durations are log-normal
+with longer customer trips, and some station names contain commas and quotes
+so that the csv quoting is exercised. The same seed and row count always
+give the same bytes. Rows are streamed to disk, so any scale from thousands
+to hundreds of millions of rows runs in constant memory.
+
+    python -m benchmarks.synthetic --rows 1000000 --out ./data/synthetic
+"""
+
+import argparse
+import csv
+import io
+import math
+import os
+import random
+from datetime import date, timedelta
+
+
+SCHEMAS = {
+    'NYC': {
+        'in_file': 'NYC-CitiBike-2016.csv',
+        'header': ['tripduration', 'starttime', 'stoptime', 'start station id',
+                   'start station name', 'start station latitude',
+                   'start station longitude', 'end station id',
+                   'end station name', 'end station latitude',
+                   'end station longitude', 'bikeid', 'usertype', 'birth year',
+                   'gender'],
+        'seconds': True,
+        'subscriber_share': 0.89,
+    },
+    'Chicago': {
+        'in_file': 'Chicago-Divvy-2016.csv',
+        'header': ['trip_id', 'starttime', 'stoptime', 'bikeid', 'tripduration',
+                   'from_station_id', 'from_station_name', 'to_station_id',
+                   'to_station_name', 'usertype', 'gender', 'birthyear'],
+        'seconds': False,
+        'subscriber_share': 0.76,
+    },
+    'Washington': {
+        'in_file': 'Washington-CapitalBikeshare-2016.csv',
+        'header': ['Duration (ms)', 'Start date', 'End date',
+                   'Start station number', 'Start station',
+                   'End station number', 'End station', 'Bike number',
+                   'Member Type'],
+        'seconds': False,
+        'subscriber_share': 0.78,
+    },
+}
+
+YEAR = 2016
+N_STATIONS = 600
+STREETS = ['Allen St', 'Broadway', 'Clark St', 'Wellington Ave', 'Park Rd',
+           'Holmead Pl NW', 'Ashland Ave', 'Georgia Ave', 'Fairmont St NW',
+           'S 5 Pl', 'Rivington St', 'Wrightwood Ave']
+
+# relative ridership by hour of the day, with commuter peaks
+HOURLY_PROFILE = [2, 1, 1, 1, 1, 2, 5, 10, 14, 9, 7, 8,
+                  9, 9, 9, 10, 12, 16, 13, 9, 6, 5, 4, 3]
+
+WRITE_BUFFER_BYTES = 1024 * 1024
+
+
+def csv_field(value):
+    """
+    Returns value formatted as a csv field, quoted if needed.
+    """
+    f_out = io.StringIO()
+    csv.writer(f_out, lineterminator='').writerow([value])
+    return f_out.getvalue()
+
+
+def station_names(rng):
+    """
+    Returns N_STATIONS station names, already formatted as csv fields.
+    """
+    names = []
+    for number in range(N_STATIONS):
+        first, second = rng.sample(STREETS, 2)
+        if number % 7 == 0:
+            name = '{}, {}'.format(first, second)
+        elif number % 31 == 0:
+            name = '"{}" & {}'.format(first, second)
+        else:
+            name = '{} & {}'.format(first, second)
+        names.append(csv_field(name))
+    return names
+
+
+def day_weights():
+    """
+    Returns the relative ridership of every day of the year, peaking in July
+    and dipping on weekends.
+    """
+    weights = []
+    day = date(YEAR, 1, 1)
+    while day.year == YEAR:
+        season = 1.0 + 0.8 * math.sin((day.timetuple().tm_yday - 105) / 366 * 2 * math.pi)
+        weekend = 0.8 if day.weekday() >= 5 else 1.0
+        weights.append(season * weekend)
+        day += timedelta(days=1)
+    return weights
+
+
+def date_texts():
+    """
+    Returns the 'm/d/YYYY' text of every day from the start of the year to a
+    few days past its end, where the last stop times fall.
+    """
+    first = date(YEAR, 1, 1)
+    texts = []
+    for offset in range(380):
+        day = first + timedelta(days=offset)
+        texts.append('{}/{}/{}'.format(day.month, day.day, day.year))
+    return texts
+
+
+def generate_rows(city, n_rows, seed=2016):
+    """
+    Yields the n_rows data lines (with line endings) of a synthetic raw file
+    for the city.
+    """
+    schema = SCHEMAS[city]
+    rng = random.Random('{}-{}'.format(seed, city))
+    stations = station_names(rng)
+    dates = date_texts()
+    with_seconds = schema['seconds']
+    subscriber_share = schema['subscriber_share']
+
+    cum_days = []
+    total = 0.0
+    for weight in day_weights():
+        total += weight
+        cum_days.append(total)
+    cum_hours = []
+    total = 0
+    for weight in HOURLY_PROFILE:
+        total += weight
+        cum_hours.append(total)
+    day_range = range(len(cum_days))
+    hour_range = range(24)
+
+    def timestamp(seconds):
+        day, rest = divmod(seconds, 86400)
+        hour, rest = divmod(rest, 3600)
+        minute, second = divmod(rest, 60)
+        if with_seconds:
+            return '{} {:02d}:{:02d}:{:02d}'.format(dates[day], hour, minute, second)
+        return '{} {:02d}:{:02d}'.format(dates[day], hour, minute)
+
+    for trip in range(n_rows):
+        day = rng.choices(day_range, cum_weights=cum_days)[0]
+        hour = rng.choices(hour_range, cum_weights=cum_hours)[0]
+        start = day * 86400 + hour * 3600 + rng.randrange(3600)
+
+        subscriber = rng.random() < subscriber_share
+        mu = 6.4 if subscriber else 7.2
+        duration = max(60, min(int(rng.lognormvariate(mu, 0.7)), 86400))
+        stop = start + duration
+
+        start_station = rng.randrange(N_STATIONS)
+        end_station = rng.randrange(N_STATIONS)
+        bike = rng.randrange(10000, 30000)
+        starttime = timestamp(start)
+        stoptime = timestamp(stop)
+
+        if city == 'NYC':
+            birth_year = str(rng.randrange(1940, 2000)) if subscriber else ''
+            gender = rng.randrange(1, 3) if subscriber else 0
+            yield '{},{},{},{},{},{:.6f},{:.6f},{},{},{:.6f},{:.6f},{},{},{},{}\n'.format(
+                duration, starttime, stoptime, 100 + start_station,
+                stations[start_station], 40.70 + start_station / 10000,
+                -73.99 + start_station / 10000, 100 + end_station,
+                stations[end_station], 40.70 + end_station / 10000,
+                -73.99 + end_station / 10000, bike,
+                'Subscriber' if subscriber else 'Customer', birth_year, gender)
+        elif city == 'Chicago':
+            gender = rng.choice(['Male', 'Female']) if subscriber else ''
+            birth_year = str(rng.randrange(1940, 2000)) if subscriber else ''
+            yield '{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(
+                9000000 + trip, starttime, stoptime, bike, duration,
+                start_station, stations[start_station], end_station,
+                stations[end_station], 'Subscriber' if subscriber else 'Customer',
+                gender, birth_year)
+        else:
+            yield '{},{},{},{},{},{},{},W{},{}\n'.format(
+                duration * 1000 + rng.randrange(1000), starttime, stoptime,
+                31000 + start_station, stations[start_station],
+                31000 + end_station, stations[end_station], bike,
+                'Registered' if subscriber else 'Casual')
+
+
+def write_city_file(city, n_rows, out_dir, seed=2016):
+    """
+    Writes a synthetic raw file of n_rows trips for the city into out_dir
+    and returns its path.
+    """
+    schema = SCHEMAS[city]
+    path = os.path.join(out_dir, schema['in_file'])
+    with open(path, 'w', newline='', buffering=WRITE_BUFFER_BYTES) as f_out:
+        f_out.write(','.join(schema['header']) + '\n')
+        f_out.writelines(generate_rows(city, n_rows, seed))
+    return path
+
+
+def city_info(out_dir):
+    """
+    Returns the city_info dictionary of the notebook for the synthetic files
+    in out_dir.
+    """
+    return {city: {'in_file': os.path.join(out_dir, schema['in_file']),
+                   'out_file': os.path.join(out_dir, '{}-2016-Summary.csv'.format(city))}
+            for city, schema in SCHEMAS.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=100000, help='trips per city')
+    parser.add_argument('--out', default='./data/synthetic', help='output directory')
+    parser.add_argument('--seed', type=int, default=2016)
+    parser.add_argument('--cities', nargs='+', default=list(SCHEMAS),
+                        choices=list(SCHEMAS))
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out, exist_ok=True)
+    for city in args.cities:
+        print('Writing {:,} {} trips to {}'.format(
+            args.rows, city, write_city_file(city, args.rows, args.out, args.seed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Helpers for condensing and analysing the 2016 US bike share trip data that is
+explored in the Bike_Share_Analysis notebook.
+
+The notebook helpers and summary statistics are available from the package
+itself:
+
+    from bikeshare import condense_data, number_of_trips
+
+They are resolved on first use, so importing the package only loads the
+modules actually needed. numpy, pandas and matplotlib are only imported by
+the vectorized engine and the plotting and DataFrame helpers, and pyarrow
+only by the Parquet summaries. The command
+line interface is bikeshare/cli.py (`python -m bikeshare --help`).
+"""
+
+import importlib
+
+
+# names re-exported by the package, with the submodule defining them
+EXPORTS = {'OUT_COLNAMES': 'bikeshare.trips',
+           'print_first_point': 'bikeshare.trips',
+           'duration_in_mins': 'bikeshare.trips',
+           'time_of_trip': 'bikeshare.trips',
+           'type_of_user': 'bikeshare.trips',
+           'condense_data': 'bikeshare.trips',
+           'StartTimeDecoder': 'bikeshare.timeparse',
+           'CitySchema': 'bikeshare.schema',
+           'register_schema': 'bikeshare.schema',
+           'get_schema': 'bikeshare.schema',
+           'TripSummary': 'bikeshare.stats',
+           'summarize_trips': 'bikeshare.stats',
+           'number_of_trips': 'bikeshare.stats',
+           'travel_length': 'bikeshare.stats',
+           'rides_by_usertype': 'bikeshare.stats',
+           'load_summary_frame': 'bikeshare.columnar'}
+
+__all__ = sorted(EXPORTS)
+
+
+def __getattr__(name):
+    module = EXPORTS.get(name)
+    if module is None:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(EXPORTS))
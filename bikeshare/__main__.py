@@ -0,0 +1,6 @@
+import sys
+
+from bikeshare.cli import main
+
+
+sys.exit(main())
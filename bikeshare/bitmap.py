@@ -0,0 +1,506 @@
+"""
+Compressed bitmap indexes over the low-cardinality summary columns.
+
+A question like "Subscriber trips on weekends in summer between 7 and 9am"
+is a filter on month, hour, day_of_week and user_type, which have a few
+dozen distinct values between them. A BitmapIndex keeps, for every value of
+those columns, the row ids (positions in the summary file) of its trips as
+a RoaringBitmap, and answers a filter by combining bitmaps instead of
+scanning the summary: OR over the values asked for in each column, then
+AND across the columns.
+
+A RoaringBitmap splits the row ids into chunks of 65536 rows by their high
+bits, and keeps each non-empty chunk in the smallest of three containers:
+
+- 'array': the sorted low 16 bits of its rows, for at most 4096 rows;
+- 'run': a (start, length - 1) pair for each run of consecutive rows, which
+  is how months look in a summary of trips sorted by start time;
+- 'bitmap': a 65536 bit integer.
+
+Chunks missing from one side of an AND are skipped outright. The others are
+combined as Python integers, whose & and | run in C over the 8 KiB of a
+chunk; containers are decoded to integers on first use and kept. Counts
+are population counts of the result. Durations are summed by picking the
+matching rows out of the duration column of each chunk, so the durations
+of the other trips are never read.
+
+    index = BitmapIndex.build('./data/NYC-2016-Summary.csv')
+    index.count(user_type='Subscriber', day_of_week=['Saturday', 'Sunday'],
+                month=[6, 7, 8], hour=[7, 8])
+    index.duration_sum(index.bitmap('month', 7) | index.bitmap('month', 8))
+"""
+
+import json
+import struct
+import sys
+from array import array
+from itertools import compress
+
+from bikeshare.cube import as_set
+
+
+MAGIC = b'BSBITMAP'
+FORMAT_VERSION = 1
+
+INDEXED_COLUMNS = ('month', 'hour', 'day_of_week', 'user_type')
+
+# row ids are split into a chunk number and the low CHUNK_BITS bits
+CHUNK_BITS = 16
+CHUNK_ROWS = 1 << CHUNK_BITS
+LOW_MASK = CHUNK_ROWS - 1
+BITMAP_BYTES = CHUNK_ROWS // 8
+
+# most rows of an array container, beyond which a bitmap is smaller
+ARRAY_MAX_ROWS = 4096
+
+# chunks with at most SPARSE_ROWS rows have their row ids found word by
+# word, and chunks with more than DENSE_ROWS by expanding the chunk to one
+# flag byte per row; the others byte by byte
+SPARSE_ROWS = 1024
+DENSE_ROWS = 16384
+
+# positions of the set bits of every byte value
+BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+# translation of bytes to the flag of one of their bits, for each bit
+BIT_PLANES = [bytes(value >> bit & 1 for value in range(256)) for bit in range(8)]
+
+# flag bytes of a chunk to its binary digits, used to build chunk integers
+FLAG_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+def popcount(bits):
+    """
+    Returns the number of set bits of a chunk integer. The package runs on
+    Python 3.7 and later (the package attributes are loaded through a module
+    `__getattr__`), but int.bit_count only came with Python 3.10, so 3.7 to
+    3.9 count the ones of its binary digits instead.
+    """
+    return bin(bits).count('1')
+
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+
+
+def bits_to_flags(bits):
+    """
+    Returns CHUNK_ROWS bytes holding 1 for every set bit of a chunk integer
+    and 0 for the others, lowest bit first.
+    """
+    data = bits.to_bytes(BITMAP_BYTES, 'little')
+    flags = bytearray(CHUNK_ROWS)
+    for bit, plane in enumerate(BIT_PLANES):
+        flags[bit::8] = data.translate(plane)
+    return flags
+
+
+def flags_to_bits(flags):
+    """
+    Returns the chunk integer of CHUNK_ROWS flag bytes, lowest bit first.
+    """
+    return int(bytes(flags).translate(FLAG_DIGITS)[::-1], 2)
+
+
+def set_bits(bits):
+    """
+    Returns the positions of the set bits of a chunk integer, in order.
+    """
+    count = popcount(bits)
+    if count > DENSE_ROWS:
+        return compress(range(CHUNK_ROWS), bits_to_flags(bits))
+
+    data = bits.to_bytes(BITMAP_BYTES, 'little')
+    if count > SPARSE_ROWS:
+        # only the non-zero bytes are visited
+        return [index * 8 + bit for index, byte in compress(enumerate(data), data)
+                for bit in BYTE_BITS[byte]]
+
+    words = array('Q', data)
+    if sys.byteorder != 'little':
+        words.byteswap()
+    positions = []
+    # only the non-zero words are visited
+    for index, word in compress(enumerate(words), words):
+        base = index << 6
+        while word:
+            lowest = word & -word
+            positions.append(base + lowest.bit_length() - 1)
+            word ^= lowest
+    return positions
+
+
+def make_container(bits):
+    """
+    Returns the smallest (kind, payload) container holding the set bits of
+    a non-empty chunk integer.
+    """
+    count = popcount(bits)
+    starts = bits & ~(bits << 1)
+    n_runs = popcount(starts)
+    if 4 * n_runs < min(2 * count, BITMAP_BYTES):
+        ends = bits & ~(bits >> 1)
+        runs = array('H')
+        for start, end in zip(set_bits(starts), set_bits(ends)):
+            runs.append(start)
+            runs.append(end - start)
+        return ('run', runs)
+    if count <= ARRAY_MAX_ROWS:
+        return ('array', array('H', set_bits(bits)))
+    return ('bitmap', bits)
+
+
+def decode_container(kind, payload):
+    """
+    Returns the chunk integer of a container.
+    """
+    if kind == 'bitmap':
+        return payload
+    if kind == 'run':
+        bits = 0
+        for number in range(0, len(payload), 2):
+            bits |= ((2 << payload[number + 1]) - 1) << payload[number]
+        return bits
+    flags = bytearray(CHUNK_ROWS)
+    for low in payload:
+        flags[low] = 1
+    return flags_to_bits(flags)
+
+
+class RoaringBitmap(object):
+    """
+    Set of row ids kept as a container per chunk of CHUNK_ROWS rows.
+
+    `&` and `|` combine two bitmaps; the result keeps its chunks as decoded
+    integers. Iterating yields the row ids in order.
+    """
+
+    def __init__(self, containers=None):
+        # (kind, payload) container of each non-empty chunk
+        self.containers = containers if containers is not None else {}
+        # decoded integer of each chunk used so far
+        self._bits = {}
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """
+        Returns the bitmap of the given chunk integers (by chunk number),
+        each kept in its smallest container.
+        """
+        return cls({high: make_container(bits) for high, bits in chunks.items() if bits})
+
+    def __repr__(self):
+        return 'RoaringBitmap({} rows in {} containers)'.format(len(self), len(self.containers))
+
+    def bits(self, high):
+        """
+        Returns the integer of a chunk, 0 if it is empty.
+        """
+        bits = self._bits.get(high)
+        if bits is None:
+            container = self.containers.get(high)
+            if container is None:
+                return 0
+            bits = self._bits[high] = decode_container(*container)
+        return bits
+
+    def chunks(self):
+        """
+        Yields (chunk number, chunk integer) for every non-empty chunk, in
+        order.
+        """
+        for high in sorted(self.containers):
+            yield (high, self.bits(high))
+
+    def __len__(self):
+        count = 0
+        for high, (kind, payload) in self.containers.items():
+            if high in self._bits or kind == 'bitmap':
+                count += popcount(self.bits(high))
+            elif kind == 'array':
+                count += len(payload)
+            else:
+                count += len(payload) // 2 + sum(payload[1::2])
+        return count
+
+    def __and__(self, other):
+        containers = {}
+        for high in self.containers.keys() & other.containers.keys():
+            bits = self.bits(high) & other.bits(high)
+            if bits:
+                containers[high] = ('bitmap', bits)
+        return RoaringBitmap(containers)
+
+    def __or__(self, other):
+        containers = {}
+        for high in self.containers.keys() | other.containers.keys():
+            containers[high] = ('bitmap', self.bits(high) | other.bits(high))
+        return RoaringBitmap(containers)
+
+    def __iter__(self):
+        for high, bits in self.chunks():
+            base = high << CHUNK_BITS
+            for low in set_bits(bits):
+                yield base + low
+
+    def compressed(self):
+        """
+        Returns the same set of rows with every chunk in its smallest
+        container.
+        """
+        return RoaringBitmap.from_chunks(dict(self.chunks()))
+
+
+class BitmapIndex(object):
+    """
+    RoaringBitmaps of the row ids of every value of the INDEXED_COLUMNS of
+    a summary file, along with the duration of every row.
+
+    Like a TripCube, it offers the `writerow` and `add_frame` methods, so
+    `condense_data` can build it while writing the summary, and is kept
+    with `save` and `load`. Filters are keyword arguments naming a single
+    value or a sequence of values of a column, as in `TripCube.query`.
+    """
+
+    def __init__(self, city=None):
+        self.city = city
+        self.n_rows = 0
+        self.durations = array('d')
+        # bitmap of each value, by column
+        self.bitmaps = {column: {} for column in INDEXED_COLUMNS}
+        # low bits of the rows added since the bitmaps were last built, by
+        # (column, value) and chunk number
+        self._pending = {}
+
+    def __repr__(self):
+        return 'BitmapIndex({!r}, n_rows={})'.format(self.city, self.n_rows)
+
+    @classmethod
+    def build(cls, filename, city=None):
+        """
+        Returns the index of a csv or columnar summary file.
+        """
+        index = cls(city)
+        index.add_summary(filename)
+        return index
+
+    def _pending_rows(self, column, value, high):
+        chunks = self._pending.get((column, value))
+        if chunks is None:
+            chunks = self._pending[(column, value)] = {}
+        lows = chunks.get(high)
+        if lows is None:
+            lows = chunks[high] = array('H')
+        return lows
+
+    def add(self, duration, month, hour, day_of_week, user_type):
+        """
+        Adds a single trip as the next row.
+        """
+        high, low = self.n_rows >> CHUNK_BITS, self.n_rows & LOW_MASK
+        self._pending_rows('month', month, high).append(low)
+        self._pending_rows('hour', hour, high).append(low)
+        self._pending_rows('day_of_week', day_of_week, high).append(low)
+        self._pending_rows('user_type', user_type, high).append(low)
+        self.durations.append(duration)
+        self.n_rows += 1
+
+    def writerow(self, new_point):
+        """
+        Adds a condensed data point, as written by `condense_rows`.
+        """
+        self.add(new_point['duration'], new_point['month'], new_point['hour'],
+                 new_point['day_of_week'], new_point['user_type'])
+
+    def add_frame(self, frame):
+        """
+        Adds every row of a pandas DataFrame holding the summary columns.
+        """
+        import numpy as np
+
+        rows = np.arange(self.n_rows, self.n_rows + len(frame), dtype=np.int64)
+        for column in INDEXED_COLUMNS:
+            values = frame[column].to_numpy()
+            for value in frame[column].unique():
+                matching = rows[values == value]
+                highs = matching >> CHUNK_BITS
+                if isinstance(value, np.generic):
+                    value = value.item()
+                for high in np.unique(highs).tolist():
+                    lows = (matching[highs == high] & LOW_MASK).astype(np.uint16)
+                    self._pending_rows(column, value, high).frombytes(lows.tobytes())
+        self.durations.frombytes(frame['duration'].to_numpy(dtype=np.float64).tobytes())
+        self.n_rows += len(frame)
+
+    def add_summary(self, filename):
+        """
+        Adds every trip of a csv or columnar summary file.
+        """
+        from bikeshare.pipeline import read_trips
+
+        add = self.add
+        for trip in read_trips(filename):
+            add(*trip)
+
+    def _build_pending(self):
+        for (column, value), chunks in self._pending.items():
+            bits = {}
+            for high, lows in chunks.items():
+                flags = bytearray(CHUNK_ROWS)
+                for low in lows:
+                    flags[low] = 1
+                bits[high] = flags_to_bits(flags)
+            bitmap = RoaringBitmap.from_chunks(bits)
+            if value in self.bitmaps[column]:
+                bitmap = (self.bitmaps[column][value] | bitmap).compressed()
+            self.bitmaps[column][value] = bitmap
+        self._pending = {}
+
+    def values(self, column):
+        """
+        Returns the values of a column that occur in the summary.
+        """
+        self._build_pending()
+        return sorted(self.bitmaps[column])
+
+    def bitmap(self, column, value):
+        """
+        Returns the RoaringBitmap of the rows holding value in column.
+        """
+        if column not in self.bitmaps:
+            raise ValueError('unknown indexed column {!r}'.format(column))
+        if self._pending:
+            self._build_pending()
+        bitmap = self.bitmaps[column].get(value)
+        return bitmap if bitmap is not None else RoaringBitmap()
+
+    def all_rows(self):
+        """
+        Returns the RoaringBitmap of every row.
+        """
+        chunks = {}
+        for high in range(0, (self.n_rows + LOW_MASK) >> CHUNK_BITS):
+            rows = min(CHUNK_ROWS, self.n_rows - (high << CHUNK_BITS))
+            chunks[high] = (1 << rows) - 1
+        return RoaringBitmap({high: ('bitmap', bits) for high, bits in chunks.items()})
+
+    def select(self, **filters):
+        """
+        Returns the RoaringBitmap of the rows matching the keyword filters:
+        any of the values given for a column, and every column filtered.
+        """
+        selection = None
+        for column, values in filters.items():
+            matching = None
+            for value in as_set(values):
+                bitmap = self.bitmap(column, value)
+                matching = bitmap if matching is None else matching | bitmap
+            if matching is None:
+                matching = RoaringBitmap()
+            selection = matching if selection is None else selection & matching
+        return selection if selection is not None else self.all_rows()
+
+    def count(self, selection=None, **filters):
+        """
+        Returns the number of rows of a RoaringBitmap, or of the rows
+        matching the keyword filters.
+        """
+        if selection is None:
+            selection = self.select(**filters)
+        return len(selection)
+
+    def row_ids(self, selection=None, **filters):
+        """
+        Returns an array of the row ids of a RoaringBitmap, or of the rows
+        matching the keyword filters, in order.
+        """
+        if selection is None:
+            selection = self.select(**filters)
+        return array('q', selection)
+
+    def duration_sum(self, selection=None, **filters):
+        """
+        Returns the total duration of the rows of a RoaringBitmap, or of the
+        rows matching the keyword filters. The durations are added in row
+        order, as in a pass over the summary file.
+        """
+        if selection is None:
+            selection = self.select(**filters)
+        durations = memoryview(self.durations)
+        total = 0
+        for high, bits in selection.chunks():
+            base = high << CHUNK_BITS
+            chunk = durations[base:base + CHUNK_ROWS]
+            if popcount(bits) > DENSE_ROWS:
+                total = sum(compress(chunk, bits_to_flags(bits)), total)
+            else:
+                # only the durations of the matching rows are read
+                total = sum(map(chunk.__getitem__, set_bits(bits)), total)
+        return total
+
+    def save(self, filename):
+        """
+        Writes the index to filename.
+        """
+        self._build_pending()
+        descriptors = []
+        payloads = []
+        for column in INDEXED_COLUMNS:
+            for value, bitmap in sorted(self.bitmaps[column].items()):
+                containers = []
+                for high in sorted(bitmap.containers):
+                    kind, payload = bitmap.containers[high]
+                    if kind == 'bitmap':
+                        payload = payload.to_bytes(BITMAP_BYTES, 'little')
+                    else:
+                        payload = payload.tobytes()
+                    containers.append([high, kind, len(payload)])
+                    payloads.append(payload)
+                descriptors.append({'column': column, 'value': value,
+                                    'containers': containers})
+
+        header = json.dumps({'version': FORMAT_VERSION, 'city': self.city,
+                             'n_rows': self.n_rows, 'byteorder': sys.byteorder,
+                             'bitmaps': descriptors}).encode('utf-8')
+        with open(filename, 'wb') as f_out:
+            f_out.write(MAGIC)
+            f_out.write(struct.pack('<I', len(header)))
+            f_out.write(header)
+            for payload in payloads:
+                f_out.write(payload)
+            self.durations.tofile(f_out)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads an index written by `save`.
+        """
+        with open(filename, 'rb') as f_in:
+            if f_in.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a bitmap index file'.format(filename))
+            header_length, = struct.unpack('<I', f_in.read(4))
+            header = json.loads(f_in.read(header_length).decode('utf-8'))
+            if header['version'] != FORMAT_VERSION:
+                raise ValueError('unsupported bitmap index version {}'
+                                 .format(header['version']))
+            swap = header['byteorder'] != sys.byteorder
+
+            index = cls(header['city'])
+            index.n_rows = header['n_rows']
+            for descriptor in header['bitmaps']:
+                containers = {}
+                for high, kind, size in descriptor['containers']:
+                    payload = f_in.read(size)
+                    if kind == 'bitmap':
+                        payload = int.from_bytes(payload, 'little')
+                    else:
+                        payload = array('H', payload)
+                        if swap:
+                            payload.byteswap()
+                    containers[high] = (kind, payload)
+                index.bitmaps[descriptor['column']][descriptor['value']] = \
+                    RoaringBitmap(containers)
+            index.durations.fromfile(f_in, index.n_rows)
+            if swap:
+                index.durations.byteswap()
+        return index
@@ -0,0 +1,230 @@
+"""
+Persistent cache of summary statistics results.
+
+Results are stored on disk keyed on the function and its arguments, and
+validated against the size, modification time and SHA-256 content hash of
+the summary file they were computed from, or of every partition file of a
+partitioned summary (see bikeshare/partition.py). A hit whose files still
+have the recorded sizes and mtimes returns without reading them; if only an
+mtime changed, that file is hashed and the entry is kept when the content
+is the same. Any other change to a summary, including partitions added or
+removed, invalidates exactly the entries computed from it.
+
+The cache holds at most max_bytes of pickled results and evicts the least
+recently used entries beyond that.
+
+    cache = ResultCache('./data/.cache')
+    number_of_trips = cache.cached(number_of_trips)
+"""
+
+import functools
+import hashlib
+import json
+import os
+import pickle
+import time
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'bikeshare')
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+INDEX_FILE = 'index.json'
+INDEX_VERSION = 2
+
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+def file_hash(filename):
+    """
+    Returns the SHA-256 hex digest of the content of filename.
+    """
+    hasher = hashlib.sha256()
+    with open(filename, 'rb') as f_in:
+        for block in iter(functools.partial(f_in.read, HASH_BLOCK_BYTES), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def source_files(filename):
+    """
+    Returns the absolute paths of the files a result computed from filename
+    depends on: the summary file itself, or the partition files of a
+    partitioned summary.
+    """
+    if os.path.isdir(filename):
+        from bikeshare.partition import partition_files
+
+        return sorted(os.path.abspath(path) for _, _, path in partition_files(filename))
+    return [os.path.abspath(filename)]
+
+
+def function_name(func):
+    """
+    Returns the module-qualified name used to key the results of func.
+    """
+    return '{}.{}'.format(func.__module__, getattr(func, '__qualname__', func.__name__))
+
+
+class ResultCache(object):
+    """
+    On-disk LRU cache of results computed from a summary file.
+
+    Entries are pickled to one file each in `directory`, next to an index
+    recording for every entry its source, the size, mtime and hash of each
+    file of that source, the size of the pickle and when it was last used.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.index = self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), 'r') as f_in:
+                index = json.load(f_in)
+        except (OSError, ValueError):
+            return {}
+        if index.get('version') != INDEX_VERSION:
+            return {}
+        return index['entries']
+
+    def _save_index(self):
+        # write to a temporary file first so that readers never see half an
+        # index
+        temporary = self._index_path() + '.tmp'
+        with open(temporary, 'w') as f_out:
+            json.dump({'version': INDEX_VERSION, 'entries': self.index}, f_out)
+        os.replace(temporary, self._index_path())
+
+    def _entry_path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.pickle')
+
+    def _remove(self, key):
+        entry = self.index.pop(key, None)
+        if entry is not None:
+            try:
+                os.remove(self._entry_path(key))
+            except OSError:
+                pass
+
+    def key(self, func, filename, args, kwargs):
+        """
+        Returns the cache key of a call of func on filename.
+        """
+        return json.dumps([function_name(func), os.path.abspath(filename),
+                           repr(args), repr(sorted(kwargs.items()))])
+
+    def is_valid(self, entry):
+        """
+        Returns True if the cached entry still matches the files of its
+        source. Refreshes the recorded mtime of a file when only the mtime
+        changed.
+        """
+        try:
+            if source_files(entry['source']) != sorted(entry['files']):
+                return False
+            stats = {path: os.stat(path) for path in entry['files']}
+        except OSError:
+            return False
+        for path, recorded in entry['files'].items():
+            stat = stats[path]
+            if recorded['size'] != stat.st_size:
+                return False
+            if recorded['mtime_ns'] == stat.st_mtime_ns:
+                continue
+            if file_hash(path) != recorded['sha256']:
+                return False
+            recorded['mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    def call(self, func, filename, *args, **kwargs):
+        """
+        Returns func(filename, *args, **kwargs), from the cache when a valid
+        result is stored and computing and storing it otherwise. filename is
+        a summary file or the root of a partitioned summary.
+        """
+        key = self.key(func, filename, args, kwargs)
+        # a missing summary raises OSError rather than missing the cache
+        os.stat(filename)
+        entry = self.index.get(key)
+
+        if entry is not None and self.is_valid(entry):
+            try:
+                with open(self._entry_path(key), 'rb') as f_in:
+                    result = pickle.load(f_in)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                self._remove(key)
+            else:
+                self.hits += 1
+                entry['last_used'] = time.time()
+                self._save_index()
+                return result
+
+        # miss: drop every stale entry of the same file along with this one
+        self.misses += 1
+        self.invalidate(filename)
+
+        # the files are taken as they were before the result was computed
+        stats = {path: os.stat(path) for path in source_files(filename)}
+        result = func(filename, *args, **kwargs)
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) <= self.max_bytes:
+            with open(self._entry_path(key), 'wb') as f_out:
+                f_out.write(data)
+            self.index[key] = {'source': os.path.abspath(filename),
+                               'files': {path: {'size': stat.st_size,
+                                                'mtime_ns': stat.st_mtime_ns,
+                                                'sha256': file_hash(path)}
+                                         for path, stat in stats.items()},
+                               'bytes': len(data),
+                               'last_used': time.time()}
+            self._evict()
+        self._save_index()
+        return result
+
+    def cached(self, func):
+        """
+        Decorator returning a version of func, whose first argument is a
+        summary file name or partitioned summary root, with results served
+        from this cache.
+        """
+        @functools.wraps(func)
+        def wrapper(filename, *args, **kwargs):
+            return self.call(func, filename, *args, **kwargs)
+        return wrapper
+
+    def invalidate(self, filename=None):
+        """
+        Removes the entries whose source file has changed since they were
+        stored, or every entry if filename is None.
+        """
+        if filename is None:
+            for key in list(self.index):
+                self._remove(key)
+            self._save_index()
+            return
+
+        source = os.path.abspath(filename)
+        for key, entry in list(self.index.items()):
+            if entry['source'] == source and not self.is_valid(entry):
+                self._remove(key)
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the cache fits in
+        max_bytes.
+        """
+        total = sum(entry['bytes'] for entry in self.index.values())
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= entry['bytes']
+            self._remove(key)
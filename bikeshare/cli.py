@@ -0,0 +1,229 @@
+"""
+Command line interface to the bike share analysis.
+
+    python -m bikeshare first ./data/NYC-CitiBike-2016.csv
+    python -m bikeshare condense NYC ./data/NYC-CitiBike-2016.csv ./data/NYC-2016-Summary.csv
+    python -m bikeshare stats ./data/*-2016-Summary.csv
+    python -m bikeshare load ./data/trips.db ./data/*-2016-Summary.csv
+    python -m bikeshare stats --store ./data/trips.db
+    python -m bikeshare hist ./data/Washington-2016-Summary.csv --output washington.png
+    python -m bikeshare serve --port 8080
+
+Every subcommand imports what it needs when it runs, so that `stats` only
+loads the csv and columnar readers and never numpy, pandas or matplotlib.
+"""
+
+import argparse
+import sys
+
+
+def city_of(filename):
+    """
+    Returns the city name at the start of a data file name, as
+    `print_first_point` does.
+    """
+    return filename.split('-')[0].split('/')[-1]
+
+
+def parse_bins(text):
+    """
+    Parses histogram bin edges given either as start:stop:step, with the
+    stop excluded like in np.arange, or as a comma separated list.
+    """
+    if ':' in text:
+        start, stop, step = (float(part) for part in text.split(':'))
+        if step <= 0:
+            raise argparse.ArgumentTypeError('bin step must be positive')
+        count = int((stop - start) / step)
+        if start + count * step < stop:
+            count += 1
+        return [start + i * step for i in range(count)]
+    return [float(edge) for edge in text.split(',')]
+
+
+def run_first(args):
+    from bikeshare.trips import print_first_point
+
+    for filename in args.files:
+        print_first_point(filename)
+
+
+def run_condense(args):
+    from bikeshare import instrument
+    from bikeshare.trips import condense_data
+
+    if args.report_dir is not None:
+        instrument.enable(report_dir=args.report_dir,
+                          progress_every=args.progress_every)
+    condense_data(args.in_file, args.out_file, args.city, out_format=args.format,
+                  engine=args.engine, cube_file=args.cube, sketch_file=args.sketch,
+                  partitioned=args.partitioned, index_file=args.index)
+
+
+def print_summary(city, summary):
+    """
+    Prints the trip statistics of a city from its TripSummary.
+    """
+    n_subscribers, n_customers, n_total, subs_ratio, cust_ratio = summary.trip_counts()
+    average_trip, short_trip_pct, long_trip_pct = summary.trip_lengths()
+
+    print('\nCity: {}'.format(city))
+    print('Total number of trips: {} ({} Subscribers, {} Customers)'
+          .format(n_total, n_subscribers, n_customers))
+    print('Subscriber ratio: {}, Customer ratio: {}'.format(subs_ratio, cust_ratio))
+    print('The average trip length is {} minutes and {} of trips are longer than 30 minutes'
+          .format(average_trip, long_trip_pct))
+    if n_subscribers and n_customers:
+        avg_sub_trip, avg_cust_trip = summary.user_type_lengths()[:2]
+        print('The average Subscriber trip duration is {} minutes and {} minutes the average Customer trip duration'
+              .format(avg_sub_trip, avg_cust_trip))
+
+
+def run_stats(args):
+    if args.store is not None:
+        from bikeshare.store import TripStore
+
+        if args.files:
+            raise ValueError('give either summary files or --store, not both')
+        with TripStore(args.store) as store:
+            for city in store.cities():
+                print_summary(city, store.summarize(city))
+        return
+    if not args.files:
+        raise ValueError('no summary files given')
+
+    from bikeshare.partition import is_partitioned, partition_files
+    from bikeshare.stats import summarize_trips
+
+    if args.cache_dir is not None:
+        from bikeshare.cache import ResultCache
+
+        summarize_trips = ResultCache(args.cache_dir).cached(summarize_trips)
+
+    for filename in args.files:
+        if is_partitioned(filename):
+            # one report per city of a partitioned summary
+            cities = sorted(set(city for city, _, _ in partition_files(filename)))
+            for city in cities:
+                print_summary(city, summarize_trips(filename, cities=[city]))
+        else:
+            print_summary(city_of(filename), summarize_trips(filename))
+
+
+def run_load(args):
+    from bikeshare.store import TripStore
+
+    with TripStore(args.database) as store:
+        for filename in args.files:
+            city = city_of(filename.rstrip('/')) if args.city is None else args.city
+            n_rows = store.load_summary(filename, city)
+            print('Loaded {:,} {} trips from {}'.format(n_rows, city, filename))
+
+
+def run_hist(args):
+    from bikeshare.histogram import DurationHistogram
+
+    histogram = DurationHistogram(args.bins, split_by='user_type' if args.user_type else None)
+    histogram.add_summary(args.file)
+
+    import matplotlib
+    if args.output is not None:
+        # render to a file without needing a display
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    histogram.plot(args.user_type, facecolor='#607c8e')
+    plt.ylabel('Frequency')
+    plt.xlabel('Duration (minutes)')
+    title = 'Frequency Distribution of Duration for {}'.format(city_of(args.file))
+    if args.user_type:
+        title += ' {}s'.format(args.user_type)
+    plt.title(title)
+    plt.axis([0, None, 0, None])
+
+    if args.output is not None:
+        plt.savefig(args.output)
+    else:
+        plt.show()
+
+
+def run_serve(args):
+    from bikeshare.ingest import serve
+
+    try:
+        serve(args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='python -m bikeshare',
+                                     description='Analysis of the 2016 US bike share trip data.')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    first = commands.add_parser('first', help='print the first data point of csv files')
+    first.add_argument('files', nargs='+', metavar='file')
+    first.set_defaults(run=run_first)
+
+    condense = commands.add_parser('condense', help='condense a raw city trip file')
+    condense.add_argument('city', help='NYC, Chicago or Washington')
+    condense.add_argument('in_file')
+    condense.add_argument('out_file')
+    condense.add_argument('--format', choices=['csv', 'columnar', 'parquet'],
+                          default='csv')
+    condense.add_argument('--engine', choices=['python', 'pandas'], default='python')
+    condense.add_argument('--partitioned', action='store_true',
+                          help='write one file per month under out_file/city')
+    condense.add_argument('--cube', metavar='FILE', help='also save a trip cube')
+    condense.add_argument('--sketch', metavar='FILE',
+                          help='also save duration quantile sketches')
+    condense.add_argument('--index', metavar='FILE', help='also save a bitmap index')
+    condense.add_argument('--report-dir', metavar='DIR',
+                          help='time each stage and write reports to DIR')
+    condense.add_argument('--progress-every', type=int, default=100000, metavar='ROWS',
+                          help='rows between progress lines of an instrumented run')
+    condense.set_defaults(run=run_condense)
+
+    stats = commands.add_parser('stats', help='print trip statistics of summary files')
+    stats.add_argument('files', nargs='*', metavar='file')
+    stats.add_argument('--cache-dir', metavar='DIR',
+                       help='serve results from a cache in DIR')
+    stats.add_argument('--store', metavar='DB',
+                       help='report every city of a SQLite trip store instead')
+    stats.set_defaults(run=run_stats)
+
+    load = commands.add_parser('load', help='bulk load summary files into a SQLite trip store')
+    load.add_argument('database')
+    load.add_argument('files', nargs='+', metavar='file')
+    load.add_argument('--city', help='city of the trips, by default taken from each file name')
+    load.set_defaults(run=run_load)
+
+    hist = commands.add_parser('hist', help='plot a histogram of trip durations')
+    hist.add_argument('file')
+    hist.add_argument('--bins', type=parse_bins, default=parse_bins('0:200:5'),
+                      help='start:stop:step or a comma separated list of edges')
+    hist.add_argument('--user-type', help='only plot trips of this user type')
+    hist.add_argument('--output', metavar='FILE',
+                      help='save the plot to FILE instead of showing it')
+    hist.set_defaults(run=run_hist)
+
+    serve = commands.add_parser('serve', help='ingest live trip batches over HTTP')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.set_defaults(run=run_serve)
+
+    return parser
+
+
+def main(argv=None):
+    """
+    Runs the command line interface and returns its exit status.
+    """
+    args = make_parser().parse_args(argv)
+    try:
+        args.run(args)
+    except (OSError, ValueError) as error:
+        print('error: {}'.format(error), file=sys.stderr)
+        return 1
+    return 0
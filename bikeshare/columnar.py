@@ -0,0 +1,311 @@
+"""
+Columnar binary format for the condensed trip summaries.
+
+A columnar summary holds the same five fields as a *-2016-Summary.csv file,
+stored as typed arrays instead of text:
+
+- duration: float64 minutes, the exact values written to the csv file
+- month, hour: uint8
+- day_of_week, user_type: uint8 codes into a small list of categories
+
+The file starts with an 8 byte magic string and a little-endian uint32
+giving the length of a JSON header that lists the row count and the type,
+byte offset and categories of each column. Every column starts on an 8 byte
+boundary so that readers can memory map the file and use the columns in
+place without parsing anything.
+"""
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from bikeshare.trips import OUT_COLNAMES
+
+
+MAGIC = b'BSUMCOL1'
+FORMAT_VERSION = 1
+
+# array typecode of each summary column; 'B' columns holding strings are
+# stored as category codes
+COLUMN_TYPES = {'duration': 'd',
+                'month': 'B',
+                'hour': 'B',
+                'day_of_week': 'B',
+                'user_type': 'B'}
+CATEGORICAL_COLUMNS = ('day_of_week', 'user_type')
+
+# numpy dtype matching each array typecode, used by `to_dataframe`
+NUMPY_DTYPES = {'d': 'float64', 'B': 'uint8'}
+
+ALIGNMENT = 8
+
+
+def is_columnar(filename):
+    """
+    Returns True if the given summary file is in the columnar binary format.
+    """
+    with open(filename, 'rb') as f_in:
+        return f_in.read(len(MAGIC)) == MAGIC
+
+
+def padding(offset):
+    """
+    Returns the number of bytes needed to align offset on ALIGNMENT.
+    """
+    return -offset % ALIGNMENT
+
+
+class ColumnarWriter(object):
+    """
+    Collects condensed data points and writes them to a columnar summary file.
+
+    It offers the `writeheader` and `writerow` methods of the csv DictWriter
+    object, so it can be handed to `condense_rows` in place of one. The
+    columns are written out when the writer is closed.
+    """
+
+    def __init__(self, f_out):
+        self.f_out = f_out
+        self.columns = {name: array(COLUMN_TYPES[name]) for name in OUT_COLNAMES}
+        self.categories = {name: {} for name in CATEGORICAL_COLUMNS}
+
+    def writeheader(self):
+        # the header is written together with the columns in `close`
+        pass
+
+    def writerow(self, new_point):
+        for name in OUT_COLNAMES:
+            value = new_point[name]
+            if name in self.categories:
+                codes = self.categories[name]
+                value = codes.setdefault(value, len(codes))
+            self.columns[name].append(value)
+
+    def write_frame(self, frame):
+        """
+        Appends every row of a pandas DataFrame holding the summary columns.
+        """
+        for name in OUT_COLNAMES:
+            values = frame[name]
+            if name in self.categories:
+                codes = self.categories[name]
+                for value in values.unique():
+                    codes.setdefault(value, len(codes))
+                values = values.map(codes)
+            column = self.columns[name]
+            column.frombytes(values.to_numpy(dtype=NUMPY_DTYPES[column.typecode]).tobytes())
+
+    def close(self):
+        """
+        Writes the header and every column to the output file.
+        """
+        n_rows = len(self.columns['duration'])
+
+        # lay out the columns after the header, each aligned on ALIGNMENT
+        descriptors = []
+        for name in OUT_COLNAMES:
+            column = {'name': name, 'type': COLUMN_TYPES[name]}
+            if name in self.categories:
+                codes = self.categories[name]
+                column['categories'] = sorted(codes, key=codes.get)
+            descriptors.append(column)
+
+        header = {'version': FORMAT_VERSION, 'rows': n_rows,
+                  'byteorder': sys.byteorder, 'columns': descriptors}
+
+        # the column offsets depend on the header length, so lay the header
+        # out again until the start of the data stops moving
+        start = None
+        while True:
+            header_bytes = json.dumps(header).encode('utf-8')
+            data_start = len(MAGIC) + 4 + len(header_bytes)
+            data_start += padding(data_start)
+            if data_start == start:
+                break
+            start = offset = data_start
+            for column in descriptors:
+                column['offset'] = offset
+                offset += n_rows * self.columns[column['name']].itemsize
+                offset += padding(offset)
+
+        self.f_out.write(MAGIC)
+        self.f_out.write(struct.pack('<I', len(header_bytes)))
+        self.f_out.write(header_bytes)
+        for column in descriptors:
+            self.f_out.write(b'\0' * (column['offset'] - self.f_out.tell()))
+            self.columns[column['name']].tofile(self.f_out)
+
+
+class ColumnarSummary(object):
+    """
+    Read-only view of a columnar summary file through a memory map.
+
+    Each column is available as an attribute holding a memoryview of its
+    values (durations as floats, the other columns as uint8 codes), and the
+    category names of the day_of_week and user_type columns are found in the
+    `categories` dictionary. Use as a context manager or call `close` to
+    release the map.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f_in:
+            if f_in.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a columnar summary file'.format(filename))
+            header_length, = struct.unpack('<I', f_in.read(4))
+            header = json.loads(f_in.read(header_length).decode('utf-8'))
+            self._map = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if header['version'] != FORMAT_VERSION:
+            raise ValueError('unsupported columnar summary version {}'
+                             .format(header['version']))
+
+        self.n_rows = header['rows']
+        self.categories = {}
+        self._views = []
+        buffer = memoryview(self._map)
+        self._views.append(buffer)
+        for column in header['columns']:
+            itemsize = array(column['type']).itemsize
+            start = column['offset']
+            view = buffer[start:start + self.n_rows * itemsize].cast(column['type'])
+            if itemsize > 1 and header['byteorder'] != sys.byteorder:
+                # files written on a machine of the other endianness have to
+                # be copied and swapped instead of used in place
+                swapped = array(column['type'], view)
+                swapped.byteswap()
+                view = memoryview(swapped)
+            self._views.append(view)
+            setattr(self, column['name'], view)
+            if 'categories' in column:
+                self.categories[column['name']] = column['categories']
+
+    def __len__(self):
+        return self.n_rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Releases the column views and the memory map.
+        """
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+
+    def code_of(self, name, value):
+        """
+        Returns the code of a category value of the named column, or None if
+        the value does not occur in the file.
+        """
+        categories = self.categories[name]
+        return categories.index(value) if value in categories else None
+
+    def rows(self):
+        """
+        Yields each data point as a dictionary keyed by the summary column
+        names, like the rows of a DictReader over the csv summary.
+        """
+        days = self.categories['day_of_week']
+        user_types = self.categories['user_type']
+        for duration, month, hour, day, user in zip(self.duration, self.month,
+                                                    self.hour, self.day_of_week,
+                                                    self.user_type):
+            yield {'duration': duration, 'month': month, 'hour': hour,
+                   'day_of_week': days[day], 'user_type': user_types[user]}
+
+    def to_dataframe(self, columns=None):
+        """
+        Returns the summary, or only the given columns of it, as a pandas
+        DataFrame with the same columns and dtypes as `pd.read_csv` gives for
+        the csv summary.
+        """
+        import numpy as np
+        import pandas as pd
+
+        columns = OUT_COLNAMES if columns is None else list(columns)
+        frame = {}
+        for name in columns:
+            view = getattr(self, name)
+            values = np.frombuffer(view, dtype=NUMPY_DTYPES[view.format])
+            if name in self.categories:
+                names = np.array(self.categories[name], dtype=object)
+                values = names[values]
+            elif name != 'duration':
+                values = values.astype('int64')
+            else:
+                values = values.copy()
+            frame[name] = values
+        return pd.DataFrame(frame, columns=columns)
+
+
+def needed_columns(columns, months=None, days=None):
+    """
+    Returns the columns to read for the given columns and filters: all of
+    them if columns is None, and the month and day_of_week columns as well
+    if the rows are filtered by month or by day.
+    """
+    if columns is None:
+        return None
+    columns = list(columns)
+    if months is not None and 'month' not in columns:
+        columns.append('month')
+    if days is not None and 'day_of_week' not in columns:
+        columns.append('day_of_week')
+    return columns
+
+
+def select_frame(frame, columns=None, months=None, days=None):
+    """
+    Returns the rows of a summary DataFrame of the given months and days
+    (all of them if None), keeping only the given columns.
+    """
+    if months is not None:
+        frame = frame[frame['month'].isin(list(months))]
+    if days is not None:
+        frame = frame[frame['day_of_week'].isin(list(days))]
+    if months is not None or days is not None:
+        frame = frame.reset_index(drop=True)
+    if columns is not None:
+        frame = frame[list(columns)]
+    return frame
+
+
+def load_summary_frame(filename, columns=None, months=None, cities=None, days=None):
+    """
+    Loads a summary file in the csv, columnar or Parquet format into a pandas
+    DataFrame. csv summaries may be gzip, bz2 or xz compressed.
+
+    Only the given columns are kept if columns is given, and only the trips
+    of the given months and days (weekday names) if those are given. A
+    Parquet summary then only reads those columns and the row groups of
+    those months.
+
+    filename may also be the root directory of a partitioned summary, of
+    which only the partitions of the given cities and months are read; see
+    `load_partitions_frame`.
+    """
+    import pandas as pd
+
+    from bikeshare.compression import detect_compression
+    from bikeshare.parquet import is_parquet, read_parquet_frame
+    from bikeshare.partition import is_partitioned, load_partitions_frame
+
+    if is_partitioned(filename):
+        return load_partitions_frame(filename, columns, cities, months, days)
+    if is_parquet(filename):
+        return read_parquet_frame(filename, columns, months, days)
+    if is_columnar(filename):
+        with ColumnarSummary(filename) as summary:
+            frame = summary.to_dataframe(needed_columns(columns, months, days))
+    else:
+        frame = pd.read_csv(filename, compression=detect_compression(filename),
+                            usecols=needed_columns(columns, months, days))
+    return select_frame(frame, columns, months, days)
@@ -0,0 +1,296 @@
+"""
+Transparent gzip, bz2 and xz compression of raw trip files and summaries.
+
+`open_text` opens a file for reading text whatever it is compressed with,
+detecting the format from its first bytes, so that the raw archives can be
+condensed without decompressing them to disk first. The decompression runs
+in a background thread that inflates the next chunks while the csv parser
+works on the previous ones; zlib, bz2 and lzma release the GIL while they
+work, so both really run at the same time. Files made of several
+compressed members or streams, as written by concatenating compressed
+parts, are read through to the end like the gzip module does.
+
+For writing, the compression is taken from the file suffix ('.gz', '.bz2',
+'.xz'). gzip files are written as a series of small members that record
+their own compressed size in a 'BC' header field, the block layout of
+BGZF. They are ordinary gzip files to any other reader, but
+`gzip_members` can list their members without decompressing anything, so
+bikeshare/parallel.py can inflate and condense them in parallel.
+"""
+
+import bz2
+import io
+import lzma
+import os
+import queue
+import struct
+import threading
+import zlib
+
+
+# magic bytes at the start of each compressed format
+MAGIC = {'gzip': b'\x1f\x8b', 'bz2': b'BZh', 'xz': b'\xfd7zXZ\x00'}
+
+# file suffixes selecting the compression of written files
+SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+
+# compressed bytes read by the decompression thread at a time
+READ_BYTES = 256 * 1024
+
+# decompressed chunks the thread may run ahead of the reader
+QUEUE_CHUNKS = 8
+
+# uncompressed bytes per written gzip member, as in BGZF, so that every
+# member stays below the 64KiB its 16 bit size field can describe
+BLOCK_INPUT_BYTES = 0xff00
+
+COMPRESS_LEVEL = 6
+
+# buffer size of summary files opened for writing
+WRITE_BUFFER_BYTES = 1 << 20
+
+# fixed part of the header of a gzip member carrying a 'BC' size field
+GZIP_HEADER = struct.Struct('<4BI2BH')
+BLOCK_FIELD = struct.Struct('<2BHH')
+GZIP_FLAG_EXTRA = 4
+
+
+def detect_compression(filename):
+    """
+    Returns 'gzip', 'bz2' or 'xz' according to the first bytes of a file, or
+    None if it is not compressed.
+    """
+    with open(filename, 'rb') as f_in:
+        start = f_in.read(6)
+    for compression, magic in MAGIC.items():
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def suffix_compression(filename):
+    """
+    Returns the compression selected by the suffix of a file name, or None.
+    """
+    return SUFFIXES.get(os.path.splitext(filename)[1].lower())
+
+
+def make_decompressor(compression):
+    """
+    Returns a decompressor object for one member or stream of the given
+    compression.
+    """
+    if compression == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == 'bz2':
+        return bz2.BZ2Decompressor()
+    if compression == 'xz':
+        return lzma.LZMADecompressor()
+    raise ValueError('unknown compression {!r}'.format(compression))
+
+
+class ThreadedDecompressor(io.RawIOBase):
+    """
+    Raw binary stream of the decompressed content of the binary file raw.
+
+    A background thread reads and decompresses raw ahead of the reader into
+    a bounded queue, so the consumer's parsing overlaps the decompression.
+    Concatenated members or streams are decompressed one after the other.
+    """
+
+    def __init__(self, raw, compression):
+        self.raw = raw
+        self.compression = compression
+        self.chunks = queue.Queue(QUEUE_CHUNKS)
+        self.pending = b''
+        self.finished = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._decompress, daemon=True)
+        self.thread.start()
+
+    def readable(self):
+        return True
+
+    def _put(self, item):
+        """
+        Hands an item to the reader, giving up once the stream is closed.
+        """
+        while not self.stopping.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decompress(self):
+        try:
+            decompressor = make_decompressor(self.compression)
+            started = False
+            while not self.stopping.is_set():
+                data = self.raw.read(READ_BYTES)
+                if not data:
+                    break
+                while data:
+                    started = True
+                    chunk = decompressor.decompress(data)
+                    if chunk and not self._put(chunk):
+                        return
+                    if not decompressor.eof:
+                        break
+                    # the next member starts right after this one; padding
+                    # zeros at the end of the file are ignored
+                    data = decompressor.unused_data
+                    decompressor = make_decompressor(self.compression)
+                    started = False
+                    if not data.strip(b'\x00'):
+                        data = b''
+            if started and not decompressor.eof:
+                raise EOFError('compressed file ended before the end-of-stream '
+                               'marker was reached')
+            self._put(b'')
+        except Exception as error:
+            self._put(error)
+
+    def readinto(self, buffer):
+        while not self.pending:
+            if self.finished:
+                return 0
+            item = self.chunks.get()
+            if isinstance(item, Exception):
+                self.finished = True
+                raise item
+            if not item:
+                self.finished = True
+                return 0
+            self.pending = memoryview(item)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopping.set()
+            self.thread.join()
+            self.raw.close()
+        super(ThreadedDecompressor, self).close()
+
+
+class BlockGzipWriter(io.RawIOBase):
+    """
+    Raw binary stream writing gzip members of BLOCK_INPUT_BYTES of input each
+    to the binary file raw, every member recording its size in a 'BC' extra
+    field. An empty member marks the end of the file, as in BGZF.
+    """
+
+    def __init__(self, raw, level=COMPRESS_LEVEL):
+        self.raw = raw
+        self.level = level
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BLOCK_INPUT_BYTES:
+            self._write_member(bytes(self.buffer[:BLOCK_INPUT_BYTES]))
+            del self.buffer[:BLOCK_INPUT_BYTES]
+        return len(data)
+
+    def _write_member(self, block):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = compressor.compress(block) + compressor.flush()
+        size = GZIP_HEADER.size + BLOCK_FIELD.size + len(deflated) + 8
+        self.raw.write(GZIP_HEADER.pack(0x1f, 0x8b, 8, GZIP_FLAG_EXTRA, 0, 0, 255,
+                                        BLOCK_FIELD.size))
+        self.raw.write(BLOCK_FIELD.pack(ord('B'), ord('C'), 2, size - 1))
+        self.raw.write(deflated)
+        self.raw.write(struct.pack('<2I', zlib.crc32(block), len(block) & 0xffffffff))
+
+    def close(self):
+        if not self.closed:
+            if self.buffer:
+                self._write_member(bytes(self.buffer))
+                self.buffer.clear()
+            self._write_member(b'')
+            self.raw.close()
+        super(BlockGzipWriter, self).close()
+
+
+def gzip_members(filename):
+    """
+    Returns the (start, end) byte offsets of the members of a gzip file
+    written in blocks with 'BC' size fields, found by reading their headers
+    only. Returns None for any other file.
+    """
+    members = []
+    with open(filename, 'rb') as f_in:
+        size = os.fstat(f_in.fileno()).st_size
+        start = 0
+        while start < size:
+            f_in.seek(start)
+            header = f_in.read(GZIP_HEADER.size + BLOCK_FIELD.size)
+            if len(header) < GZIP_HEADER.size + BLOCK_FIELD.size:
+                return None
+            id1, id2, method, flags, _, _, _, extra_size = GZIP_HEADER.unpack_from(header)
+            if ((id1, id2, method) != (0x1f, 0x8b, 8) or not flags & GZIP_FLAG_EXTRA
+                    or extra_size < BLOCK_FIELD.size):
+                return None
+
+            # look for the 'BC' subfield among the extra fields
+            extra = header[GZIP_HEADER.size:] + f_in.read(extra_size - BLOCK_FIELD.size)
+            block_size = None
+            position = 0
+            while position + 4 <= len(extra):
+                si1, si2, field_size = struct.unpack_from('<2BH', extra, position)
+                if (si1, si2, field_size) == (ord('B'), ord('C'), 2):
+                    block_size = struct.unpack_from('<H', extra, position + 4)[0] + 1
+                    break
+                position += 4 + field_size
+            if block_size is None:
+                return None
+
+            members.append((start, min(start + block_size, size)))
+            start += block_size
+    return members
+
+
+def open_text(filename, mode='r', compression='infer', wrap_raw=None):
+    """
+    Opens a file for reading ('r') or writing ('w') text like open() does,
+    through gzip, bz2 or xz compression.
+
+    When reading, compression='infer' detects the compression from the first
+    bytes of the file. When writing, it takes it from the suffix of the file
+    name, and None writes plain text. wrap_raw, if given, is applied to the
+    raw binary file before any decompression when reading, e.g. to count the
+    bytes read.
+    """
+    if mode == 'r':
+        if compression == 'infer':
+            compression = detect_compression(filename)
+        if compression is None and wrap_raw is None:
+            return open(filename, 'r')
+        raw = io.FileIO(filename, 'r')
+        if wrap_raw is not None:
+            raw = wrap_raw(raw)
+        if compression is not None:
+            raw = ThreadedDecompressor(raw, compression)
+        return io.TextIOWrapper(io.BufferedReader(raw))
+
+    if mode != 'w':
+        raise ValueError('compressed files can only be opened with mode r or w')
+    if compression == 'infer':
+        compression = suffix_compression(filename)
+    if compression is None:
+        return open(filename, 'w', buffering=WRITE_BUFFER_BYTES)
+    if compression == 'gzip':
+        raw = BlockGzipWriter(io.FileIO(filename, 'w'))
+        return io.TextIOWrapper(io.BufferedWriter(raw, WRITE_BUFFER_BYTES))
+    if compression == 'bz2':
+        return bz2.open(filename, 'wt', compresslevel=9)
+    if compression == 'xz':
+        return lzma.open(filename, 'wt')
+    raise ValueError('unknown compression {!r}'.format(compression))
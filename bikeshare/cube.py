@@ -0,0 +1,285 @@
+"""
+Precomputed trip data cube.
+
+Every question of the analysis is a count, a duration total or a duration
+spread over some slice of (month, hour, day_of_week, user_type). A TripCube
+holds, for one city, the trip count, the duration sum and the duration sum
+of squares of every cell of that space: 12 x 24 x 7 cells per user type,
+a few hundred kilobytes at most. `condense_data` can fill a cube while it
+writes the summary, and `query` and `rollup` then answer trips per city,
+subscriber ratios, average trip lengths, per-user-type averages and the
+month and weekday pivots without touching trip-level data again.
+
+Cube totals are summed per cell and then across cells, so they can differ
+from a straight pass over the summary file in the last bits of a float.
+"""
+
+import json
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+from bikeshare.timeparse import DAY_NAMES
+
+
+MAGIC = b'BSCUBE01'
+FORMAT_VERSION = 1
+
+DIMENSIONS = ('month', 'hour', 'day_of_week', 'user_type')
+MONTHS = range(1, 13)
+HOURS = range(24)
+CELLS_PER_USER_TYPE = len(MONTHS) * len(HOURS) * len(DAY_NAMES)
+
+
+class CubeStats(namedtuple('CubeStats', ['count', 'total', 'sumsq'])):
+    """
+    Trip count, duration sum and duration sum of squares of a slice of the
+    cube, with the derived mean and variance of the durations.
+    """
+    __slots__ = ()
+
+    @property
+    def mean(self):
+        return self.total / self.count
+
+    @property
+    def variance(self):
+        return self.sumsq / self.count - self.mean ** 2
+
+    def __add__(self, other):
+        return CubeStats(self.count + other.count, self.total + other.total,
+                         self.sumsq + other.sumsq)
+
+
+EMPTY = CubeStats(0, 0.0, 0.0)
+
+
+def as_set(values):
+    """
+    Returns a filter value as a set, accepting a single value or a sequence.
+    """
+    if isinstance(values, (list, tuple, set, frozenset, range)):
+        return set(values)
+    return {values}
+
+
+class TripCube(object):
+    """
+    Dense (month x hour x day_of_week x user_type) cube of trip counts and
+    duration sums for one city.
+
+    The user types are kept in order of first appearance in `user_types`;
+    each one owns a block of CELLS_PER_USER_TYPE cells.
+    """
+
+    def __init__(self, city=None, user_types=None):
+        self.city = city
+        self.user_types = []
+        self._user_codes = {}
+        self.counts = array('Q')
+        self.totals = array('d')
+        self.sumsqs = array('d')
+        self._day_codes = {name: code for code, name in enumerate(DAY_NAMES)}
+        for user_type in user_types or []:
+            self.user_code(user_type)
+
+    def user_code(self, user_type):
+        """
+        Returns the code of a user type, adding a block of cells for it the
+        first time it is seen.
+        """
+        code = self._user_codes.get(user_type)
+        if code is None:
+            code = self._user_codes[user_type] = len(self.user_types)
+            self.user_types.append(user_type)
+            self.counts.extend([0] * CELLS_PER_USER_TYPE)
+            self.totals.extend([0.0] * CELLS_PER_USER_TYPE)
+            self.sumsqs.extend([0.0] * CELLS_PER_USER_TYPE)
+        return code
+
+    def cell(self, month, hour, day_of_week, user_type):
+        """
+        Returns the flat index of a cell.
+        """
+        day = self._day_codes[day_of_week]
+        user = self.user_code(user_type)
+        return ((user * 12 + month - 1) * 24 + hour) * 7 + day
+
+    def add(self, duration, month, hour, day_of_week, user_type):
+        """
+        Adds a single trip to its cell.
+        """
+        index = self.cell(month, hour, day_of_week, user_type)
+        self.counts[index] += 1
+        self.totals[index] += duration
+        self.sumsqs[index] += duration * duration
+
+    def writerow(self, new_point):
+        """
+        Adds a condensed data point, as written by `condense_rows`.
+        """
+        self.add(new_point['duration'], new_point['month'], new_point['hour'],
+                 new_point['day_of_week'], new_point['user_type'])
+
+    def add_frame(self, frame):
+        """
+        Adds every row of a pandas DataFrame holding the summary columns.
+        """
+        import numpy as np
+
+        for user_type in frame['user_type'].unique():
+            self.user_code(user_type)
+        days = frame['day_of_week'].map(self._day_codes).to_numpy(dtype=np.int64)
+        users = frame['user_type'].map(self._user_codes).to_numpy(dtype=np.int64)
+        index = (((users * 12 + frame['month'].to_numpy(dtype=np.int64) - 1) * 24
+                  + frame['hour'].to_numpy(dtype=np.int64)) * 7 + days)
+        duration = frame['duration'].to_numpy(dtype=np.float64)
+
+        size = len(self.counts)
+        counts = np.frombuffer(self.counts, dtype=np.uint64)
+        totals = np.frombuffer(self.totals, dtype=np.float64)
+        sumsqs = np.frombuffer(self.sumsqs, dtype=np.float64)
+        counts += np.bincount(index, minlength=size).astype(np.uint64)
+        totals += np.bincount(index, weights=duration, minlength=size)
+        sumsqs += np.bincount(index, weights=duration * duration, minlength=size)
+
+    def merge(self, other):
+        """
+        Adds the cells of another cube into this one.
+        """
+        for user_type in other.user_types:
+            self.user_code(user_type)
+        for other_code, user_type in enumerate(other.user_types):
+            offset = self._user_codes[user_type] * CELLS_PER_USER_TYPE
+            other_offset = other_code * CELLS_PER_USER_TYPE
+            for index in range(CELLS_PER_USER_TYPE):
+                self.counts[offset + index] += other.counts[other_offset + index]
+                self.totals[offset + index] += other.totals[other_offset + index]
+                self.sumsqs[offset + index] += other.sumsqs[other_offset + index]
+
+    def cells(self, **filters):
+        """
+        Yields (month, hour, day_of_week, user_type, index) for every
+        non-empty cell matching the keyword filters, each of which is a
+        single value or a sequence of values of that dimension.
+        """
+        for name in filters:
+            if name not in DIMENSIONS:
+                raise ValueError('unknown cube dimension {!r}'.format(name))
+        months = as_set(filters.get('month', MONTHS))
+        hours = as_set(filters.get('hour', HOURS))
+        days = as_set(filters.get('day_of_week', DAY_NAMES))
+        user_types = as_set(filters.get('user_type', self.user_types))
+
+        index = 0
+        for user_type in self.user_types:
+            for month in MONTHS:
+                for hour in HOURS:
+                    for day_of_week in DAY_NAMES:
+                        if (self.counts[index] and user_type in user_types
+                                and month in months and hour in hours
+                                and day_of_week in days):
+                            yield (month, hour, day_of_week, user_type, index)
+                        index += 1
+
+    def query(self, **filters):
+        """
+        Returns the CubeStats of the slice matching the keyword filters, e.g.
+        query(user_type='Subscriber', month=[6, 7, 8]).
+        """
+        count, total, sumsq = 0, 0.0, 0.0
+        for _, _, _, _, index in self.cells(**filters):
+            count += self.counts[index]
+            total += self.totals[index]
+            sumsq += self.sumsqs[index]
+        return CubeStats(count, total, sumsq)
+
+    def rollup(self, *by, **filters):
+        """
+        Returns a dictionary mapping each value (or tuple of values) of the
+        dimensions named in `by` to the CubeStats of the matching slice,
+        e.g. rollup('month', 'user_type') for the rides by month pivot.
+        """
+        for name in by:
+            if name not in DIMENSIONS:
+                raise ValueError('unknown cube dimension {!r}'.format(name))
+        positions = [DIMENSIONS.index(name) for name in by]
+
+        groups = {}
+        for cell in self.cells(**filters):
+            index = cell[4]
+            key = tuple(cell[position] for position in positions)
+            if len(key) == 1:
+                key = key[0]
+            stats = CubeStats(self.counts[index], self.totals[index], self.sumsqs[index])
+            groups[key] = groups.get(key, EMPTY) + stats
+        return groups
+
+    def to_dataframe(self):
+        """
+        Returns the non-empty cells as a pandas DataFrame with the four
+        dimensions and the count, duration_sum and duration_sumsq of each.
+        """
+        import pandas as pd
+
+        rows = [(month, hour, day, user, self.counts[index], self.totals[index],
+                 self.sumsqs[index])
+                for month, hour, day, user, index in self.cells()]
+        return pd.DataFrame(rows, columns=list(DIMENSIONS) +
+                            ['count', 'duration_sum', 'duration_sumsq'])
+
+    def save(self, filename):
+        """
+        Writes the cube to filename.
+        """
+        header = json.dumps({'version': FORMAT_VERSION, 'city': self.city,
+                             'user_types': self.user_types,
+                             'byteorder': sys.byteorder}).encode('utf-8')
+        with open(filename, 'wb') as f_out:
+            f_out.write(MAGIC)
+            f_out.write(struct.pack('<I', len(header)))
+            f_out.write(header)
+            for column in (self.counts, self.totals, self.sumsqs):
+                column.tofile(f_out)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads a cube written by `save`.
+        """
+        with open(filename, 'rb') as f_in:
+            if f_in.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a trip cube file'.format(filename))
+            header_length, = struct.unpack('<I', f_in.read(4))
+            header = json.loads(f_in.read(header_length).decode('utf-8'))
+            if header['version'] != FORMAT_VERSION:
+                raise ValueError('unsupported trip cube version {}'
+                                 .format(header['version']))
+
+            cube = cls(header['city'])
+            size = len(header['user_types']) * CELLS_PER_USER_TYPE
+            for column in (cube.counts, cube.totals, cube.sumsqs):
+                column.fromfile(f_in, size)
+                if header['byteorder'] != sys.byteorder:
+                    column.byteswap()
+        cube.user_types = header['user_types']
+        cube._user_codes = {name: code for code, name in enumerate(cube.user_types)}
+        return cube
+
+
+def rollup_cities(cubes, *by, **filters):
+    """
+    Takes as input a dictionary of cubes by city and returns a dictionary
+    mapping (city,) + group key to the CubeStats of each group, or each city
+    to its CubeStats if no dimensions are given.
+    """
+    groups = {}
+    for city, cube in cubes.items():
+        if not by:
+            groups[city] = cube.query(**filters)
+            continue
+        for key, stats in cube.rollup(*by, **filters).items():
+            key = (city,) + (key if isinstance(key, tuple) else (key,))
+            groups[key] = stats
+    return groups
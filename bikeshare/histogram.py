@@ -0,0 +1,216 @@
+"""
+Streaming, mergeable fixed-bin histograms of trip durations.
+
+A DurationHistogram only holds one count per bin (per group when split by
+user type), so durations can be fed to it chunk by chunk from summary files
+of any size. Histograms with the same bin edges built from different chunks,
+cities or processes are combined with `merge`, and `plot` hands the counts to
+matplotlib as pre-binned weights.
+
+Binning follows `plt.hist`/`np.histogram`: every bin is half-open [a, b)
+except the last one, which also includes its right edge, and durations
+outside the edges are not counted.
+
+    histogram = DurationHistogram(np.arange(0, 75, 5), split_by='user_type')
+    histogram.add_summary('./data/Washington-2016-Summary.csv')
+    histogram.plot('Subscriber', facecolor='#56B4E9')
+"""
+
+import csv
+import os
+from array import array
+from bisect import bisect_right
+
+from bikeshare.columnar import ColumnarSummary, is_columnar
+from bikeshare.compression import open_text
+from bikeshare.parquet import is_parquet, iter_parquet_columns
+
+
+# rows read from a csv summary at a time
+CHUNK_ROWS = 65536
+
+
+class DurationHistogram(object):
+    """
+    Histogram of trip durations over fixed bin edges, optionally split by
+    user type. Counts are kept per group in `counts`, a dictionary of arrays
+    with one entry per bin; the group is None when the histogram is not
+    split.
+    """
+
+    def __init__(self, edges, split_by=None):
+        self.edges = [float(edge) for edge in edges]
+        if len(self.edges) < 2 or any(b <= a for a, b in zip(self.edges, self.edges[1:])):
+            raise ValueError('bin edges must be at least two increasing values')
+        if split_by not in (None, 'user_type'):
+            raise ValueError('histograms can only be split by user_type')
+        self.split_by = split_by
+        self.counts = {}
+
+    @property
+    def n_bins(self):
+        return len(self.edges) - 1
+
+    def _bins(self, group):
+        bins = self.counts.get(group)
+        if bins is None:
+            bins = self.counts[group] = array('Q', bytes(8 * self.n_bins))
+        return bins
+
+    def bin_of(self, duration):
+        """
+        Returns the bin index of a duration, or None if it is out of range.
+        """
+        edges = self.edges
+        if duration == edges[-1]:
+            return self.n_bins - 1
+        index = bisect_right(edges, duration) - 1
+        if 0 <= index < self.n_bins:
+            return index
+        return None
+
+    def add(self, duration, user_type=None):
+        """
+        Counts a single duration, for the given user type when split.
+        """
+        index = self.bin_of(duration)
+        if index is not None:
+            self._bins(user_type if self.split_by else None)[index] += 1
+
+    def update(self, durations, user_types=None):
+        """
+        Counts a chunk of durations, with a matching sequence of user types
+        when split. NumPy arrays are binned with np.histogram.
+        """
+        if self.split_by and user_types is None:
+            raise ValueError('a split histogram needs the user type of each duration')
+
+        if hasattr(durations, 'dtype'):
+            self._update_numpy(durations, user_types)
+            return
+
+        edges = self.edges
+        last = self.n_bins - 1
+        if not self.split_by:
+            bins = self._bins(None)
+            for duration in durations:
+                index = bisect_right(edges, duration) - 1
+                if 0 <= index <= last:
+                    bins[index] += 1
+                elif duration == edges[-1]:
+                    bins[last] += 1
+            return
+
+        for duration, user_type in zip(durations, user_types):
+            index = bisect_right(edges, duration) - 1
+            if 0 <= index <= last:
+                self._bins(user_type)[index] += 1
+            elif duration == edges[-1]:
+                self._bins(user_type)[last] += 1
+
+    def _update_numpy(self, durations, user_types):
+        import numpy as np
+
+        if not self.split_by:
+            groups = [(None, durations)]
+        else:
+            user_types = np.asarray(user_types)
+            groups = [(user_type, durations[user_types == user_type])
+                      for user_type in np.unique(user_types).tolist()]
+        for group, values in groups:
+            counts, _ = np.histogram(values, bins=self.edges)
+            bins = self._bins(group)
+            for index, count in enumerate(counts.tolist()):
+                bins[index] += count
+
+    def add_summary(self, filename, chunk_rows=CHUNK_ROWS):
+        """
+        Counts every duration of a csv, columnar or Parquet summary file,
+        reading it chunk by chunk, or of every partition of a partitioned
+        summary.
+        """
+        if os.path.isdir(filename):
+            from bikeshare.partition import partition_files
+
+            for _, _, path in partition_files(filename):
+                self.add_summary(path, chunk_rows)
+            return
+
+        if is_columnar(filename):
+            with ColumnarSummary(filename) as summary:
+                if self.split_by:
+                    names = summary.categories['user_type']
+                    self.update(summary.duration, (names[code] for code in summary.user_type))
+                else:
+                    self.update(summary.duration)
+            return
+        if is_parquet(filename):
+            columns = ['duration', 'user_type'] if self.split_by else ['duration']
+            for values in iter_parquet_columns(filename, columns, chunk_rows):
+                self.update(*values)
+            return
+
+        with open_text(filename) as f_in:
+            reader = csv.reader(f_in)
+            header = next(reader)
+            duration_col = header.index('duration')
+            user_type_col = header.index('user_type')
+
+            durations = []
+            user_types = []
+            for row in reader:
+                if not row:
+                    continue
+                durations.append(float(row[duration_col]))
+                user_types.append(row[user_type_col])
+                if len(durations) == chunk_rows:
+                    self.update(durations, user_types)
+                    durations = []
+                    user_types = []
+            self.update(durations, user_types)
+
+    def merge(self, other):
+        """
+        Adds the counts of another histogram with the same edges and split.
+        """
+        if other.edges != self.edges or other.split_by != self.split_by:
+            raise ValueError('only histograms with the same bins and split can be merged')
+        for group, counts in other.counts.items():
+            bins = self._bins(group)
+            for index, count in enumerate(counts):
+                bins[index] += count
+        return self
+
+    def bin_counts(self, user_type=None):
+        """
+        Returns the list of counts per bin, of one user type when split or
+        of all of them together when user_type is None. A user type can only
+        be given for a histogram split by user type.
+        """
+        if user_type is not None and not self.split_by:
+            raise ValueError('counts of a user type need a histogram split by user_type')
+        if user_type is not None or not self.split_by:
+            return list(self.counts.get(user_type, [0] * self.n_bins))
+        totals = [0] * self.n_bins
+        for counts in self.counts.values():
+            totals = [total + count for total, count in zip(totals, counts)]
+        return totals
+
+    def total(self, user_type=None):
+        """
+        Returns the number of durations counted in the bins.
+        """
+        return sum(self.bin_counts(user_type))
+
+    def plot(self, user_type=None, ax=None, **kwargs):
+        """
+        Draws the histogram with matplotlib from the pre-binned counts, in
+        the same way as `plt.hist` over the raw durations would, and returns
+        what `hist` returns. Keyword arguments go to `hist`.
+        """
+        if ax is None:
+            import matplotlib.pyplot as ax
+
+        # one sample at the left edge of each bin, weighted by its count
+        return ax.hist(self.edges[:-1], bins=self.edges,
+                       weights=self.bin_counts(user_type), **kwargs)
@@ -0,0 +1,257 @@
+"""
+Incremental condensing of raw city trip files that grow by appending.
+
+After each run a small JSON manifest is written next to the summary file. It
+records the byte offset of the raw input that has been condensed, the number
+of condensed rows and a SHA-256 hash of every HASH_BLOCK_BYTES block of that
+processed prefix. The next run checks the prefix, skips straight to the new
+bytes and appends their condensed rows to the existing summary. If the
+processed prefix, the city or the summary file has changed since, the
+summary is rebuilt from scratch instead.
+
+Every block of the processed prefix is hashed again on each run, which reads
+the prefix at hashing speed but condenses only the new rows. With
+`quick_check=True`, an input that is still the same file (device and inode)
+only has its first and last processed blocks hashed again: this makes an
+append cost as much as the new rows, but misses an edit in place anywhere
+in between, so it is only for inputs known to be append-only.
+
+Only complete records are condensed: the new bytes are cut at line breaks
+with an even number of quotes before them, the way bikeshare/scanner.py cuts
+its chunks, so a quoted field spanning several lines is condensed whole and
+a last record still being appended is left for the next run. Byte offsets
+only make sense for an uncompressed input file.
+"""
+
+import hashlib
+import json
+import os
+
+from bikeshare.compression import detect_compression
+from bikeshare.parallel import condense_range, header_text, read_fieldnames
+
+
+# manifests of version 2 may end inside a quoted field and are rebuilt
+MANIFEST_VERSION = 3
+
+# bytes read and condensed at a time
+BLOCK_BYTES = 8 * 1024 * 1024
+
+# bytes of the raw input covered by each hash of the manifest
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+def manifest_path(out_file):
+    """
+    Returns the path of the manifest kept for the given summary file.
+    """
+    return out_file + '.manifest.json'
+
+
+def load_manifest(filename):
+    """
+    Returns the manifest stored in filename, or None if there is none.
+    """
+    try:
+        with open(filename, 'r') as f_in:
+            return json.load(f_in)
+    except (OSError, ValueError):
+        return None
+
+
+def read_range(f_in, start, end):
+    """
+    Yields the bytes of the open binary file f_in between start and end in
+    blocks of at most BLOCK_BYTES.
+    """
+    f_in.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        block = f_in.read(min(BLOCK_BYTES, remaining))
+        if not block:
+            raise ValueError('file ended before offset {}'.format(end))
+        yield block
+        remaining -= len(block)
+
+
+def hash_range(f_in, start, end):
+    """
+    Returns the SHA-256 hex digest of the bytes of the open binary file f_in
+    between start and end.
+    """
+    hasher = hashlib.sha256()
+    for block in read_range(f_in, start, end):
+        hasher.update(block)
+    return hasher.hexdigest()
+
+
+def count_quotes(f_in, start, end):
+    """
+    Returns the number of quote characters of the open binary file f_in
+    between start and end.
+    """
+    return sum(block.count(b'"') for block in read_range(f_in, start, end))
+
+
+def block_hashes(f_in, start, end):
+    """
+    Returns the hashes of the HASH_BLOCK_BYTES blocks of the open binary file
+    f_in from the block boundary start up to end, the last of which may be
+    shorter.
+    """
+    return [hash_range(f_in, block_start, min(block_start + HASH_BLOCK_BYTES, end))
+            for block_start in range(start, end, HASH_BLOCK_BYTES)]
+
+
+def prefix_unchanged(f_in, manifest, quick_check=False):
+    """
+    Returns True if the first manifest['offset'] bytes of the open binary
+    file f_in still have the block hashes of the manifest. Every block is
+    checked unless quick_check is set, in which case only the first and last
+    blocks are.
+    """
+    offset = manifest['offset']
+    hashes = manifest['blocks']
+    if len(hashes) != len(range(0, offset, HASH_BLOCK_BYTES)):
+        return False
+    if not quick_check:
+        return block_hashes(f_in, 0, offset) == hashes
+    for index in {0, len(hashes) - 1}:
+        block_start = index * HASH_BLOCK_BYTES
+        block_end = min(block_start + HASH_BLOCK_BYTES, offset)
+        if hash_range(f_in, block_start, block_end) != hashes[index]:
+            return False
+    return True
+
+
+def complete_lines_end(f_in, start, size):
+    """
+    Returns the offset just past the last newline of the open binary file
+    f_in at or after start, or start if there is no newline past it.
+    """
+    end = size
+    while end > start:
+        block_start = max(start, end - BLOCK_BYTES)
+        f_in.seek(block_start)
+        block = f_in.read(end - block_start)
+        newline = block.rfind(b'\n')
+        if newline >= 0:
+            return block_start + newline + 1
+        end = block_start
+    return start
+
+
+def complete_records_end(f_in, start, size):
+    """
+    Returns the offset just past the last newline of the open binary file
+    f_in at or after start that ends a record, with an even number of quotes
+    between start and it, or start if there is no such newline. start must
+    be the start of a record.
+    """
+    end = complete_lines_end(f_in, start, size)
+    quotes = count_quotes(f_in, start, end)
+    # an odd number of quotes leaves the last line inside a quoted field, so
+    # step back over the lines of the record it belongs to
+    while quotes % 2:
+        previous = complete_lines_end(f_in, start, end - 1)
+        quotes -= count_quotes(f_in, previous, end)
+        end = previous
+    return end
+
+
+def condense_new_rows(in_file, f_out, start, end, fieldnames, city):
+    """
+    Condenses the raw trips between the byte offsets start and end of in_file
+    block by block and writes them to f_out. Returns the number of rows.
+    """
+    n_rows = 0
+    with open(in_file, 'rb') as f_in:
+        position = start
+        while position < end:
+            # finish the line the block ends in, and the lines of a quoted
+            # field going on past it
+            f_in.seek(min(position + BLOCK_BYTES, end))
+            f_in.readline()
+            stop = min(f_in.tell(), end)
+            quotes = count_quotes(f_in, position, stop)
+            while quotes % 2 and stop < end:
+                quotes += f_in.readline().count(b'"')
+                stop = min(f_in.tell(), end)
+
+            text = condense_range(in_file, position, stop, fieldnames, city)
+            f_out.write(text)
+            n_rows += text.count('\n')
+            position = stop
+    return n_rows
+
+
+def condense_data_incremental(in_file, out_file, city, manifest_file=None,
+                              quick_check=False):
+    """
+    Incremental version of `condense_data`: condenses only the raw trips that
+    were appended to the specified input file since the last run, and
+    appends them to the specified output file. The output file is rebuilt
+    when the previously processed data has changed. With quick_check, an
+    input that is still the same file only has the first and last processed
+    blocks hashed again, see the module docstring.
+
+    Returns a tuple of the number of rows condensed in this run and whether
+    the output was rebuilt.
+    """
+    if detect_compression(in_file) is not None:
+        raise ValueError('incremental condensing needs an uncompressed input file')
+    if manifest_file is None:
+        manifest_file = manifest_path(out_file)
+    manifest = load_manifest(manifest_file)
+
+    with open(in_file, 'rb') as f_in:
+        header = f_in.readline()
+        data_start = f_in.tell()
+        status = os.fstat(f_in.fileno())
+        size = status.st_size
+        fieldnames = read_fieldnames(header)
+
+        rebuild = (manifest is None
+                   or manifest.get('version') != MANIFEST_VERSION
+                   or manifest.get('city') != city
+                   or not os.path.exists(out_file)
+                   or os.path.getsize(out_file) != manifest.get('out_size')
+                   or not data_start <= manifest.get('offset', -1) <= size)
+        if not rebuild:
+            # a replaced input file gets every block checked
+            same_file = [status.st_dev, status.st_ino] == manifest['in_file_id']
+            rebuild = not prefix_unchanged(f_in, manifest, quick_check and same_file)
+
+        if rebuild:
+            start = data_start
+            n_rows = 0
+            hashes = []
+        else:
+            start = manifest['offset']
+            n_rows = manifest['rows']
+            # the last block is hashed again when it was not full
+            hashes = manifest['blocks'][:start // HASH_BLOCK_BYTES]
+
+        end = complete_records_end(f_in, start, size)
+        hashes += block_hashes(f_in, len(hashes) * HASH_BLOCK_BYTES, end)
+
+    if rebuild:
+        with open(out_file, 'w') as f_out:
+            f_out.write(header_text())
+            n_new = condense_new_rows(in_file, f_out, start, end, fieldnames, city)
+    else:
+        with open(out_file, 'a') as f_out:
+            n_new = condense_new_rows(in_file, f_out, start, end, fieldnames, city)
+
+    manifest = {'version': MANIFEST_VERSION,
+                'in_file': in_file,
+                'city': city,
+                'offset': end,
+                'rows': n_rows + n_new,
+                'in_file_id': [status.st_dev, status.st_ino],
+                'blocks': hashes,
+                'out_size': os.path.getsize(out_file)}
+    with open(manifest_file, 'w') as f_out:
+        json.dump(manifest, f_out, indent=1)
+
+    return (n_new, rebuild)
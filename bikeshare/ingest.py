@@ -0,0 +1,386 @@
+"""
+Live ingestion of raw trip records over HTTP.
+
+Instead of waiting for the nightly files, the dock system can post each
+batch of completed trips to a small asyncio service as they come in:
+
+    python -m bikeshare serve --port 8080
+    curl --data-binary @batch.csv -H 'Content-Type: text/csv' \\
+        http://127.0.0.1:8080/trips/NYC
+    curl http://127.0.0.1:8080/stats
+
+A batch is either csv text with a header row, like the raw city files, or a
+JSON list of objects keyed by the same column names, in the schema of the
+city named in the path. Every record is normalized with the notebook
+helpers (`duration_in_mins`, the cached equivalent of `time_of_trip`, and
+`type_of_user`) and added to a TripSummary of its city, so that
+`GET /stats` serves the current counts, ratios and mean durations, and to
+the sliding windows of bikeshare/window.py, which `GET /rolling/<city>`
+serves for the trips that ended in the last 15 minutes and hour.
+
+Parsing runs in a worker thread and the aggregation a slice of records at a
+time, so the event loop keeps answering stats requests while thousands of
+trips a second come in. Parsed batches wait in a bounded queue: when the
+aggregation falls behind, new batches wait for room, and a batch that
+cannot be queued within ENQUEUE_TIMEOUT seconds is refused with a 503 for
+the client to retry later.
+"""
+
+import asyncio
+import csv
+import io
+import json
+import sys
+
+from bikeshare.pipeline import Trip
+from bikeshare.schema import SCHEMAS
+from bikeshare.stats import TripSummary
+from bikeshare.timeparse import StartTimeDecoder
+from bikeshare.trips import duration_in_mins, type_of_user
+from bikeshare.window import RollingMetrics
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+# parsed batches waiting for the aggregation before new batches have to wait
+QUEUE_BATCHES = 64
+
+# seconds a batch may wait for room in the queue before it is refused
+ENQUEUE_TIMEOUT = 5.0
+
+# records in a single batch, and bytes in a request body
+MAX_BATCH_TRIPS = 10000
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+# records aggregated between two turns of the event loop
+AGGREGATE_SLICE = 500
+
+# reason phrases of the status codes the service answers with
+REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 411: 'Length Required',
+           413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+class HTTPError(Exception):
+    """
+    Error answered to the client with the given HTTP status code.
+    """
+
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+
+
+def parse_batch(city, body, content_type):
+    """
+    Parses the body of a posted batch of raw trips from the given city into a
+    list of trip dictionaries. Raises a ValueError for a body that is not a
+    batch of that city's records.
+    """
+    if city not in SCHEMAS:
+        raise ValueError('unknown city {!r}'.format(city))
+
+    text = body.decode('utf-8')
+    if content_type.startswith('application/json'):
+        records = json.loads(text)
+        if not isinstance(records, list) or not all(isinstance(datum, dict)
+                                                    for datum in records):
+            raise ValueError('a JSON batch must be a list of objects')
+        fieldnames = set().union(*records) if records else set()
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        try:
+            records = list(reader)
+        except csv.Error as error:
+            raise ValueError('malformed csv batch: {}'.format(error))
+        fieldnames = set(reader.fieldnames or ())
+
+    if len(records) > MAX_BATCH_TRIPS:
+        raise ValueError('batches hold at most {} trips'.format(MAX_BATCH_TRIPS))
+    if fieldnames:
+        missing = [column for column in SCHEMAS[city].columns if column not in fieldnames]
+        if missing:
+            raise ValueError('{} trips need the columns {}'.format(city, ', '.join(missing)))
+    return records
+
+
+class TripAggregates(object):
+    """
+    In-memory TripSummary of the trips ingested for each city, with the
+    number of records that could not be normalized, and the RollingMetrics
+    of the same trips.
+    """
+
+    def __init__(self):
+        self.summaries = {}
+        self.decoders = {}
+        self.rejected = {}
+        self.rolling = RollingMetrics()
+
+    def normalize(self, datum, city):
+        """
+        Returns the condensed Trip of a raw trip dictionary, as `condense_data`
+        would write it, and its start time as a number of seconds (see
+        `StartTimeDecoder.timestamp`), decoding the start time once.
+        """
+        decoder = self.decoders[city]
+        (month, hour, day_of_week), timestamp = decoder.decode_timestamp(datum[decoder.column])
+        return (Trip(duration_in_mins(datum, city), month, hour, day_of_week,
+                     type_of_user(datum, city)), timestamp)
+
+    def add_records(self, city, records):
+        """
+        Normalizes the raw trip dictionaries of a city and adds them to its
+        summary. Returns the number of records added. A record that cannot be
+        normalized, whatever the error, is counted as rejected.
+        """
+        if city not in self.summaries:
+            self.summaries[city] = TripSummary()
+            self.decoders[city] = StartTimeDecoder(city)
+            self.rejected[city] = 0
+        add = self.summaries[city].add
+        normalize = self.normalize
+        add_rolling = self.rolling.add
+
+        added = 0
+        for datum in records:
+            try:
+                trip, timestamp = normalize(datum, city)
+            except Exception:
+                self.rejected[city] += 1
+                continue
+            add(trip)
+            add_rolling(city, timestamp, trip.duration, trip.user_type)
+            added += 1
+        return added
+
+    def city_stats(self, city):
+        """
+        Returns a dictionary of the current statistics of a city, with None
+        for the ratios and means that have no trips to be taken over.
+        """
+        summary = self.summaries[city]
+
+        def ratio(total, count):
+            return total/count if count else None
+
+        return {'n_subscribers': summary.n_subscribers,
+                'n_customers': summary.n_customers,
+                'n_total': summary.n_total,
+                'subs_ratio': ratio(summary.n_subscribers, summary.n_total),
+                'cust_ratio': ratio(summary.n_customers, summary.n_total),
+                'mean_trip_length': ratio(summary.trip_length, summary.n_total),
+                'mean_subs_trip_length': ratio(summary.subs_trip_length,
+                                               summary.n_subscribers),
+                'mean_cust_trip_length': ratio(summary.cust_trip_length,
+                                               summary.n_customers),
+                'long_trip': summary.long_trip,
+                'rejected': self.rejected[city]}
+
+    def stats(self):
+        """
+        Returns the statistics of every city that trips were posted for.
+        """
+        return {city: self.city_stats(city) for city in sorted(self.summaries)}
+
+
+class IngestServer(object):
+    """
+    asyncio HTTP service ingesting raw trip batches into TripAggregates.
+
+        POST /trips/<city>   queue a csv or JSON batch, answered with 202
+        GET  /stats          statistics of every city, the queue length and the
+                             number of batches dropped by a failure
+        GET  /stats/<city>   statistics of one city
+        GET  /rolling/<city> counts and mean durations of its recent trips
+
+    port=0 listens on a free port, available as `port` once started.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, queue_batches=QUEUE_BATCHES,
+                 enqueue_timeout=ENQUEUE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.enqueue_timeout = enqueue_timeout
+        self.aggregates = TripAggregates()
+        self.queue = asyncio.Queue(queue_batches)
+        self.server = None
+        self.aggregator = None
+        self.failed_batches = 0
+
+    async def start(self):
+        self.aggregator = asyncio.ensure_future(self.aggregate())
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """
+        Stops accepting requests, aggregates the batches already queued and
+        stops the aggregation.
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        # a stopped aggregation would never take the batches left
+        if not self.aggregator.done():
+            await self.queue.join()
+        self.aggregator.cancel()
+        try:
+            await self.aggregator
+        except asyncio.CancelledError:
+            pass
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def aggregate(self):
+        """
+        Adds the queued batches to the aggregates, a slice at a time so that
+        stats requests are answered in between. A batch failing to aggregate
+        is reported on stderr and the rest of it dropped, and the aggregation
+        goes on with the next batch.
+        """
+        while True:
+            city, records = await self.queue.get()
+            try:
+                for start in range(0, len(records), AGGREGATE_SLICE):
+                    self.aggregates.add_records(city, records[start:start + AGGREGATE_SLICE])
+                    await asyncio.sleep(0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.failed_batches += 1
+                print('dropped a batch of {} {} trips: {!r}'.format(len(records), city, error),
+                      file=sys.stderr)
+            finally:
+                self.queue.task_done()
+
+    async def ingest(self, city, body, content_type):
+        """
+        Parses a posted batch in a worker thread and queues it for the
+        aggregation, waiting for room in the queue for up to enqueue_timeout
+        seconds. Returns the number of records queued.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            records = await loop.run_in_executor(None, parse_batch, city, body, content_type)
+        except ValueError as error:
+            raise HTTPError(400, str(error))
+
+        if records:
+            try:
+                await asyncio.wait_for(self.queue.put((city, records)), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPError(503, 'ingestion queue full, retry later')
+        return len(records)
+
+    def stats(self, city=None):
+        if city is None:
+            return {'cities': self.aggregates.stats(), 'queued_batches': self.queue.qsize(),
+                    'failed_batches': self.failed_batches}
+        if city not in self.aggregates.summaries:
+            raise HTTPError(404, 'no trips ingested for {!r}'.format(city))
+        return self.aggregates.city_stats(city)
+
+    async def route(self, method, path, body, content_type):
+        """
+        Answers a request, returning its status code and JSON document.
+        """
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        if parts[:1] == ['trips'] and len(parts) == 2:
+            if method != 'POST':
+                raise HTTPError(405, 'trips are posted')
+            return (202, {'queued': await self.ingest(parts[1], body, content_type)})
+        if parts[:1] == ['stats'] and len(parts) <= 2:
+            if method != 'GET':
+                raise HTTPError(405, 'stats are read with GET')
+            return (200, self.stats(parts[1] if len(parts) == 2 else None))
+        if parts[:1] == ['rolling'] and len(parts) == 2:
+            if method != 'GET':
+                raise HTTPError(405, 'rolling metrics are read with GET')
+            if parts[1] not in self.aggregates.summaries:
+                raise HTTPError(404, 'no trips ingested for {!r}'.format(parts[1]))
+            return (200, self.aggregates.rolling.snapshot(parts[1]))
+        raise HTTPError(404, 'no such resource {!r}'.format(path))
+
+    async def handle(self, reader, writer):
+        """
+        Serves the HTTP/1.1 requests of one connection, keeping it open
+        between requests unless the client asks to close it.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                except ValueError:
+                    await self.respond(writer, 400, {'error': 'malformed request line'}, True)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                close = headers.get('connection', '').lower() == 'close'
+
+                try:
+                    body = await self.read_body(reader, method, headers)
+                except HTTPError as error:
+                    # the unread body of a refused request would be taken
+                    # for the next request, so close the connection
+                    await self.respond(writer, error.status, {'error': str(error)}, True)
+                    break
+                try:
+                    status, document = await self.route(method, path, body,
+                                                        headers.get('content-type', ''))
+                except HTTPError as error:
+                    status, document = error.status, {'error': str(error)}
+                await self.respond(writer, status, document, close)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_body(self, reader, method, headers):
+        if method != 'POST':
+            return b''
+        if 'content-length' not in headers:
+            raise HTTPError(411, 'batches need a Content-Length')
+        value = headers['content-length'].strip()
+        # only plain digits, so no sign, underscore or other int() spelling
+        if not value or value.strip('0123456789'):
+            raise HTTPError(400, 'malformed Content-Length')
+        length = int(value)
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, 'batches hold at most {} bytes'.format(MAX_BODY_BYTES))
+        return await reader.readexactly(length)
+
+    async def respond(self, writer, status, document, close):
+        body = json.dumps(document).encode('utf-8')
+        head = ['HTTP/1.1 {} {}'.format(status, REASONS[status]),
+                'Content-Type: application/json',
+                'Content-Length: {}'.format(len(body))]
+        if status == 503:
+            head.append('Retry-After: 1')
+        if close:
+            head.append('Connection: close')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Runs the ingestion service until it is interrupted.
+    """
+    asyncio.run(IngestServer(host, port).serve_forever())
@@ -0,0 +1,287 @@
+"""
+Per-stage instrumentation of the condense pipeline.
+
+When instrumentation is enabled, `condense_data` (python engine) times every
+stage of the loop it runs anyway separately: reading and parsing the csv
+rows, decoding the start time, converting the duration, mapping the user
+type and writing the condensed rows. The batched csv path is timed a batch
+at a time, each stage over the whole batch, and the row by row path of the
+binary formats and accumulators is timed row by row. It records the
+cumulative time and call count of each stage, the rows per second and the
+bytes read and written, prints progress lines during long runs, and at the
+end of each run writes a JSON report and a Prometheus text exposition file
+(suitable for the node exporter's textfile collector) to the report
+directory. Each report describes that run alone, so the Prometheus file
+holds gauges of the last run rather than counters.
+
+When it is disabled, which is the default, `condense_data` checks this once
+per run and takes the same path untimed, so there is no per-row cost.
+
+    from bikeshare import instrument
+    instrument.enable(report_dir='./data/reports', progress_every=100000)
+
+Setting the BIKESHARE_INSTRUMENT environment variable to a report directory
+enables it at import time.
+"""
+
+import io
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+# stages of the condense row loop, in order
+STAGES = ('csv_read', 'time_of_trip', 'duration_in_mins', 'type_of_user', 'write')
+
+DEFAULT_PROGRESS_EVERY = 100000
+
+# configuration while enabled, None while disabled
+_config = None
+
+
+def enable(report_dir=None, progress_every=DEFAULT_PROGRESS_EVERY,
+           progress_stream=None):
+    """
+    Turns instrumentation on. Reports are written to report_dir if given,
+    and a progress line is printed to progress_stream (stderr by default)
+    every progress_every rows unless it is None.
+    """
+    global _config
+    _config = {'report_dir': report_dir, 'progress_every': progress_every,
+               'progress_stream': progress_stream}
+
+
+def disable():
+    """
+    Turns instrumentation off.
+    """
+    global _config
+    _config = None
+
+
+def is_enabled():
+    return _config is not None
+
+
+class CountingReader(io.RawIOBase):
+    """
+    Raw binary stream counting the bytes read from an underlying file.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.raw.readinto(buffer)
+        if count:
+            self.bytes_read += count
+        return count
+
+    def close(self):
+        self.raw.close()
+        super(CountingReader, self).close()
+
+
+class RunStats(object):
+    """
+    Measurements of one instrumented condense run.
+    """
+
+    def __init__(self, city, in_file, out_file):
+        self.city = city
+        self.in_file = in_file
+        self.out_file = out_file
+        self.in_size = os.path.getsize(in_file)
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.stage_calls = dict.fromkeys(STAGES, 0)
+        self.rows = 0
+        self.bytes_written = 0
+        self.counter = None
+        self.scanner = None
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        config = _config or {}
+        self.progress_every = config.get('progress_every')
+        self.progress_stream = config.get('progress_stream')
+
+    @property
+    def bytes_read(self):
+        if self.scanner is not None:
+            return self.scanner.position
+        return self.counter.bytes_read if self.counter is not None else 0
+
+    def watch_scanner(self, scanner):
+        """
+        Counts the bytes of the input as far as the RawScanner has scanned.
+        """
+        self.scanner = scanner
+
+    def open_input(self):
+        """
+        Opens the input file for reading text like `open_text` does, counting
+        the bytes read from disk, before any decompression.
+        """
+        from bikeshare.compression import open_text
+
+        def count(raw):
+            self.counter = CountingReader(raw)
+            return self.counter
+
+        return open_text(self.in_file, wrap_raw=count)
+
+    def add_row(self, read, decode, duration, user_type, write):
+        """
+        Records the seconds spent in each stage for one row.
+        """
+        seconds = self.stage_seconds
+        seconds['csv_read'] += read
+        seconds['time_of_trip'] += decode
+        seconds['duration_in_mins'] += duration
+        seconds['type_of_user'] += user_type
+        seconds['write'] += write
+        self.rows += 1
+        if self.progress_every and self.rows % self.progress_every == 0:
+            self.progress()
+
+    def add_batch(self, n_rows, read, decode, duration, user_type, write):
+        """
+        Records the seconds spent in each stage for a batch of n_rows rows.
+        """
+        seconds = self.stage_seconds
+        seconds['csv_read'] += read
+        seconds['time_of_trip'] += decode
+        seconds['duration_in_mins'] += duration
+        seconds['type_of_user'] += user_type
+        seconds['write'] += write
+        previous = self.rows
+        self.rows += n_rows
+        if self.progress_every and self.rows // self.progress_every > previous // self.progress_every:
+            self.progress()
+
+    def progress(self):
+        """
+        Prints a progress line with the rows so far, the rows per second and
+        the share of the input read.
+        """
+        elapsed = time.perf_counter() - self.started
+        share = self.bytes_read / self.in_size if self.in_size else 1.0
+        print('[{}] {:,} rows, {:.1%} of input, {:,.0f} rows/s'.format(
+            self.city, self.rows, share, self.rows / elapsed if elapsed else 0.0),
+            file=self.progress_stream or sys.stderr)
+
+    def finish(self):
+        """
+        Closes the measurements once the output file is written.
+        """
+        self.seconds = time.perf_counter() - self.started
+        for stage in STAGES:
+            self.stage_calls[stage] = self.rows
+        # the last read finds the end of the file
+        self.stage_calls['csv_read'] += 1
+        if os.path.isdir(self.out_file):
+            from bikeshare.partition import partition_files
+
+            self.bytes_written = sum(os.path.getsize(path) for _, _, path
+                                     in partition_files(self.out_file, [self.city]))
+        elif os.path.isfile(self.out_file):
+            self.bytes_written = os.path.getsize(self.out_file)
+
+    def report(self):
+        """
+        Returns the measurements as a JSON-serializable dictionary.
+        """
+        stages = {}
+        for stage in STAGES:
+            calls = self.stage_calls[stage]
+            seconds = self.stage_seconds[stage]
+            stages[stage] = {'calls': calls, 'seconds': seconds,
+                             'us_per_call': seconds / calls * 1e6 if calls else 0.0,
+                             'share': seconds / self.seconds if self.seconds else 0.0}
+        return {'city': self.city, 'in_file': self.in_file,
+                'out_file': self.out_file, 'started_at': self.started_at,
+                'seconds': self.seconds, 'rows': self.rows,
+                'rows_per_sec': self.rows / self.seconds if self.seconds else 0.0,
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written, 'stages': stages}
+
+    def prometheus(self):
+        """
+        Returns the measurements in the Prometheus text exposition format.
+        """
+        city = self.city.replace('\\', '\\\\').replace('"', '\\"')
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('{}{{{}}} {!r}'.format(name, labels, value))
+
+        stage_labels = [('city="{}",stage="{}"'.format(city, stage), stage)
+                        for stage in STAGES]
+        metric('bikeshare_condense_stage_seconds', 'gauge',
+               'Seconds spent in each condense stage in the last run.',
+               [(labels, float(self.stage_seconds[stage])) for labels, stage in stage_labels])
+        metric('bikeshare_condense_stage_calls', 'gauge',
+               'Calls of each condense stage in the last run.',
+               [(labels, self.stage_calls[stage]) for labels, stage in stage_labels])
+
+        city_labels = 'city="{}"'.format(city)
+        metric('bikeshare_condense_rows', 'gauge',
+               'Trips condensed in the last run.', [(city_labels, self.rows)])
+        metric('bikeshare_condense_bytes_read', 'gauge',
+               'Bytes of raw input read in the last run.', [(city_labels, self.bytes_read)])
+        metric('bikeshare_condense_bytes_written', 'gauge',
+               'Bytes of summary output written in the last run.',
+               [(city_labels, self.bytes_written)])
+        metric('bikeshare_condense_run_seconds', 'gauge',
+               'Wall-clock seconds of the last run.', [(city_labels, float(self.seconds))])
+        metric('bikeshare_condense_rows_per_second', 'gauge',
+               'Trips condensed per second in the last run.',
+               [(city_labels, float(self.report()['rows_per_sec']))])
+        metric('bikeshare_condense_last_run_timestamp_seconds', 'gauge',
+               'Unix time at which the last run started.',
+               [(city_labels, float(self.started_at))])
+        return '\n'.join(lines) + '\n'
+
+    def write_reports(self, report_dir):
+        """
+        Writes condense-<city>.json and condense-<city>.prom to report_dir,
+        replacing the files of the previous run atomically.
+        """
+        os.makedirs(report_dir, exist_ok=True)
+        name = 'condense-{}'.format(self.city)
+        for suffix, text in (('.json', json.dumps(self.report(), indent=1) + '\n'),
+                             ('.prom', self.prometheus())):
+            path = os.path.join(report_dir, name + suffix)
+            with open(path + '.tmp', 'w') as f_out:
+                f_out.write(text)
+            os.replace(path + '.tmp', path)
+
+
+@contextmanager
+def condense_run(city, in_file, out_file):
+    """
+    Context manager around one condense run. Yields a RunStats while
+    instrumentation is enabled, or None, and writes the reports on exit.
+    """
+    if _config is None:
+        yield None
+        return
+
+    run = RunStats(city, in_file, out_file)
+    yield run
+    run.finish()
+    if _config is not None and _config.get('report_dir'):
+        run.write_reports(_config['report_dir'])
+
+
+if os.environ.get('BIKESHARE_INSTRUMENT'):
+    enable(report_dir=os.environ['BIKESHARE_INSTRUMENT'])
@@ -0,0 +1,307 @@
+"""
+Parallel condensing of the raw city trip files with a process pool.
+
+Every city file is split into byte ranges of whole records after its header
+row. Each range is scanned out of a memory map of the file by a worker
+process with bikeshare/scanner.py and condensed into the text of the
+matching *-2016-Summary.csv rows, and the chunks are written back in order
+behind a single header, so the output is byte for byte the same as the one
+written by `condense_data`.
+
+The ranges only end at line breaks outside quoted fields, so a quoted field
+spanning several lines is condensed by a single worker, as `condense_data`
+reads it. An empty input gets a summary with the header row only.
+
+gzip inputs written in blocks by bikeshare/compression.py are split on
+their member boundaries instead: each worker inflates and condenses a group
+of members, and the lines cut in two at the group edges are put back
+together and condensed while the chunks are written. If one of those edges
+falls inside a quoted field, the file is condensed again as a whole. Other
+compressed inputs are condensed whole by a single worker, alongside the
+other cities.
+"""
+
+import csv
+import io
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from bikeshare.compression import detect_compression, gzip_members, open_text
+from bikeshare.scanner import RawScanner
+from bikeshare.schema import get_schema
+from bikeshare.trips import OUT_COLNAMES, condense_data, write_condensed_rows
+
+
+# bytes of raw input handed to a worker at a time
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+
+# typical size ratio of the raw csv text to its gzip compressed form, used to
+# group compressed members into chunks of about chunk_bytes of text
+GZIP_RATIO = 4
+
+
+def split_ranges(in_file, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Splits the data rows of a csv file into byte ranges of whole records of
+    roughly chunk_bytes each. Returns the column names of the header row, or
+    None for an empty file, and the list of (start, end) offsets.
+    """
+    with RawScanner(in_file) as scanner:
+        return (scanner.fieldnames, scanner.split_ranges(chunk_bytes))
+
+
+def read_fieldnames(header):
+    """
+    Decodes the raw header line of a csv file into its column names, or
+    returns None for an empty file.
+    """
+    text = io.TextIOWrapper(io.BytesIO(header))
+    return next(csv.reader(text), None)
+
+
+def condense_range(in_file, start, end, fieldnames, city):
+    """
+    Condenses the raw trips stored between the byte offsets start and end of
+    in_file and returns the text of the condensed rows. The worker maps the
+    file and scans its own range of it.
+    """
+    f_out = io.StringIO()
+    with RawScanner(in_file) as scanner:
+        write_condensed_rows(scanner.rows(start, end), f_out, city, fieldnames = fieldnames)
+
+    return f_out.getvalue()
+
+
+def condense_bytes(data, fieldnames, city):
+    """
+    Condenses the raw trips in the bytes data, made of whole lines without a
+    header, and returns the text of the condensed rows.
+    """
+    # decode the same way as open(in_file, 'r') does in condense_data
+    f_chunk = io.TextIOWrapper(io.BytesIO(data))
+    f_out = io.StringIO()
+
+    trip_reader = csv.reader(f_chunk)
+    write_condensed_rows(trip_reader, f_out, city, fieldnames = fieldnames)
+
+    return f_out.getvalue()
+
+
+def group_members(members, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Groups consecutive gzip members into lists holding about chunk_bytes of
+    decompressed text each.
+    """
+    groups = []
+    group = []
+    group_bytes = 0
+    for start, end in members:
+        group.append((start, end))
+        group_bytes += end - start
+        if group_bytes * GZIP_RATIO >= chunk_bytes:
+            groups.append(group)
+            group = []
+            group_bytes = 0
+    if group:
+        groups.append(group)
+    return groups
+
+
+def inflate_members(f_in, members):
+    """
+    Returns the decompressed content of the given members of the open gzip
+    file f_in.
+    """
+    parts = []
+    for start, end in members:
+        f_in.seek(start)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        parts.append(decompressor.decompress(f_in.read(end - start)))
+        if not decompressor.eof:
+            raise ValueError('truncated gzip member at offset {}'.format(start))
+    return b''.join(parts)
+
+
+def gzip_header(in_file, members):
+    """
+    Returns the raw header line of a gzip file given by its members.
+    """
+    data = b''
+    with open(in_file, 'rb') as f_in:
+        for member in members:
+            data += inflate_members(f_in, [member])
+            if b'\n' in data:
+                break
+    return data[:data.find(b'\n') + 1] if b'\n' in data else data
+
+
+def record_breaks(data):
+    """
+    Returns the offsets of the first and the last line break of data that
+    end records, taking the first line break to end one, and the number of
+    quotes before the first, or None if there is no line break at all. The
+    last one is the last line break with an even number of quotes between
+    it and the first.
+    """
+    first = data.find(b'\n')
+    if first < 0:
+        return None
+    head_quotes = data.count(b'"', 0, first)
+
+    last = data.rfind(b'\n')
+    quotes = data.count(b'"', first, last)
+    while quotes % 2:
+        end = data.rfind(b'\n', 0, last)
+        quotes -= data.count(b'"', end, last)
+        last = end
+    return (first, last, head_quotes)
+
+
+def condense_members(in_file, members, fieldnames, city):
+    """
+    Inflates the given members of a gzip file and condenses the whole
+    records in them, taking the first line break to end a record.
+
+    Returns a tuple of the bytes before the first record break, the text of
+    the condensed rows, the bytes after the last record break, the number of
+    quotes in the members and the parity of the quotes before the first
+    record break, which tells whether the members start inside a quoted
+    field if that line break does end a record. The text is None if there is
+    no line break at all, and the error raised while condensing if any, to
+    be raised once the line break is known to end a record.
+    """
+    with open(in_file, 'rb') as f_in:
+        data = inflate_members(f_in, members)
+
+    quotes = data.count(b'"')
+    breaks = record_breaks(data)
+    if breaks is None:
+        return (data, None, b'', quotes, None)
+    first, last, head_quotes = breaks
+    try:
+        text = condense_bytes(data[first + 1:last + 1], fieldnames, city)
+    except Exception as error:
+        text = error
+    return (data[:first + 1], text, data[last + 1:], quotes, head_quotes % 2)
+
+
+def write_member_chunks(f_out, futures, fieldnames, city):
+    """
+    Writes the results of `condense_members` in order to f_out, condensing
+    the records that span two member groups. The first line of the file is
+    the header and is skipped. Returns False, and stops, if the first line
+    break of a group turns out to be inside a quoted field, since its rows
+    are then wrong.
+    """
+    pending = b''
+    seen_header = False
+    # quotes in the file before the current group
+    quotes = 0
+    for future in futures:
+        head, text, tail, group_quotes, start_inside = future.result()
+        if text is None:
+            pending += head
+            quotes += group_quotes
+            continue
+        if quotes % 2 != start_inside:
+            return False
+        if isinstance(text, Exception):
+            raise text
+        quotes += group_quotes
+        if seen_header:
+            f_out.write(condense_bytes(pending + head, fieldnames, city))
+        seen_header = True
+        f_out.write(text)
+        pending = tail
+    if pending and seen_header:
+        f_out.write(condense_bytes(pending, fieldnames, city))
+    return True
+
+
+def check_fieldnames(fieldnames, city):
+    """
+    Raises the ValueError `condense_data` raises for a header row lacking the
+    columns of the city, before any worker starts. None stands for an empty
+    file, which is fine.
+    """
+    if fieldnames is not None:
+        get_schema(city).compile(fieldnames)
+
+
+def header_text():
+    """
+    Returns the header row of the condensed summary files.
+    """
+    f_out = io.StringIO()
+    csv.DictWriter(f_out, fieldnames = OUT_COLNAMES).writeheader()
+    return f_out.getvalue()
+
+
+def condense_cities(city_info, workers=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    This function condenses the files of several cities at the same time.
+    city_info maps each city to a dictionary with its 'in_file' and
+    'out_file', as in the notebook. The work is spread over `workers`
+    processes (all CPUs by default), with each input split into chunks of
+    roughly chunk_bytes. Inputs and outputs may be compressed as for
+    `condense_data`.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # submit every chunk of every city before collecting any of them, so
+        # that the small cities run alongside the large ones
+        pending = []
+        for city, filenames in city_info.items():
+            in_file = filenames['in_file']
+            compression = detect_compression(in_file)
+            members = gzip_members(in_file) if compression == 'gzip' else None
+
+            if compression is None:
+                fieldnames, ranges = split_ranges(in_file, chunk_bytes)
+                check_fieldnames(fieldnames, city)
+                futures = [executor.submit(condense_range, in_file,
+                                           start, end, fieldnames, city)
+                           for start, end in ranges]
+                pending.append(('ranges', city, in_file, filenames['out_file'], fieldnames,
+                                futures))
+            elif members:
+                fieldnames = read_fieldnames(gzip_header(in_file, members))
+                check_fieldnames(fieldnames, city)
+                if fieldnames is None:
+                    # nothing but the header row to write
+                    pending.append(('ranges', city, in_file, filenames['out_file'], None, []))
+                    continue
+                futures = [executor.submit(condense_members, in_file, group, fieldnames, city)
+                           for group in group_members(members, chunk_bytes)]
+                pending.append(('members', city, in_file, filenames['out_file'], fieldnames,
+                                futures))
+            else:
+                future = executor.submit(condense_data, in_file, filenames['out_file'], city)
+                pending.append(('file', city, in_file, filenames['out_file'], None, [future]))
+
+        # stitch the chunks of each city back together in order
+        for kind, city, in_file, out_file, fieldnames, futures in pending:
+            if kind == 'file':
+                futures[0].result()
+                continue
+            whole = True
+            with open_text(out_file, 'w') as f_out:
+                f_out.write(header_text())
+                if kind == 'members':
+                    whole = write_member_chunks(f_out, futures, fieldnames, city)
+                else:
+                    for future in futures:
+                        f_out.write(future.result())
+            if not whole:
+                # a quoted field spans two member groups
+                condense_data(in_file, out_file, city)
+
+
+def condense_data_parallel(in_file, out_file, city, workers=None,
+                           chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Parallel version of `condense_data` for a single file: takes full data
+    from the specified input file and writes the condensed data to the
+    specified output file using `workers` processes.
+    """
+    condense_cities({city: {'in_file': in_file, 'out_file': out_file}},
+                    workers=workers, chunk_bytes=chunk_bytes)
@@ -0,0 +1,213 @@
+"""
+Parquet format for the condensed trip summaries.
+
+A Parquet summary holds the same five fields as a *-2016-Summary.csv file,
+with the narrowest types that fit them:
+
+- duration: float64 minutes, the exact values written to the csv file
+- month, hour: uint8
+- day_of_week, user_type: dictionary encoded strings with int8 indices
+
+The trips are written month by month, so every row group holds the trips of
+a single month and its min/max statistics on the month column name it.
+Within a month the trips keep the order of the raw file. A reader asking for
+some months only reads the row groups whose statistics overlap them, and
+only the column chunks it asks for:
+
+    load_summary_frame('./data/Washington-2016-Summary.parquet',
+                       columns=['duration', 'user_type'], months=[6, 7, 8])
+
+The readers of summary files that go through the trips one by one, like
+`summarize_trips`, `read_trips` and the histograms and sketches, stream the
+columns they need out of a Parquet summary with `iter_parquet_columns`,
+which needs pyarrow but not pandas.
+
+pyarrow is imported when a Parquet summary is written or read, never by
+the other formats.
+"""
+
+from array import array
+
+from bikeshare.columnar import CATEGORICAL_COLUMNS, COLUMN_TYPES, NUMPY_DTYPES
+from bikeshare.trips import OUT_COLNAMES
+
+
+MAGIC = b'PAR1'
+
+# most trips in one row group; a month with more trips gets several
+ROW_GROUP_ROWS = 1 << 20
+
+COMPRESSION = 'snappy'
+
+# trips converted to Python values at a time when a Parquet summary is
+# streamed
+BATCH_ROWS = 65536
+
+
+def is_parquet(filename):
+    """
+    Returns True if the given summary file is in the Parquet format.
+    """
+    with open(filename, 'rb') as f_in:
+        return f_in.read(len(MAGIC)) == MAGIC
+
+
+def parquet_schema():
+    """
+    Returns the pyarrow schema of a Parquet summary.
+    """
+    import pyarrow as pa
+
+    return pa.schema([('duration', pa.float64()),
+                      ('month', pa.uint8()),
+                      ('hour', pa.uint8()),
+                      ('day_of_week', pa.dictionary(pa.int8(), pa.string())),
+                      ('user_type', pa.dictionary(pa.int8(), pa.string()))])
+
+
+class ParquetWriter(object):
+    """
+    Collects condensed data points month by month and writes them to a
+    Parquet summary file.
+
+    Like the ColumnarWriter, it offers the `writeheader` and `writerow`
+    methods of the csv DictWriter object, so it can be handed to
+    `condense_rows` in place of one, and `write_frame` for the vectorized
+    engine. The row groups are written out when the writer is closed.
+    """
+
+    def __init__(self, f_out):
+        self.f_out = f_out
+        # typed columns of the trips of each month, by month
+        self.months = {}
+        self.categories = {name: {} for name in CATEGORICAL_COLUMNS}
+
+    def _month_columns(self, month):
+        if month not in self.months:
+            self.months[month] = {name: array(COLUMN_TYPES[name]) for name in OUT_COLNAMES}
+        return self.months[month]
+
+    def writeheader(self):
+        # the schema is written together with the row groups in `close`
+        pass
+
+    def writerow(self, new_point):
+        columns = self._month_columns(new_point['month'])
+        for name in OUT_COLNAMES:
+            value = new_point[name]
+            if name in self.categories:
+                codes = self.categories[name]
+                value = codes.setdefault(value, len(codes))
+            columns[name].append(value)
+
+    def write_frame(self, frame):
+        """
+        Appends every row of a pandas DataFrame holding the summary columns.
+        """
+        for name in CATEGORICAL_COLUMNS:
+            codes = self.categories[name]
+            for value in frame[name].unique():
+                codes.setdefault(value, len(codes))
+
+        for month, month_frame in frame.groupby('month', sort=False):
+            columns = self._month_columns(int(month))
+            for name in OUT_COLNAMES:
+                values = month_frame[name]
+                if name in self.categories:
+                    values = values.map(self.categories[name])
+                column = columns[name]
+                column.frombytes(values.to_numpy(dtype=NUMPY_DTYPES[column.typecode]).tobytes())
+
+    def close(self):
+        """
+        Writes the trips of every month, in order of month, as row groups of
+        at most ROW_GROUP_ROWS trips.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = parquet_schema()
+        dictionaries = {}
+        for name, codes in self.categories.items():
+            dictionaries[name] = pa.array(sorted(codes, key=codes.get), type=pa.string())
+
+        writer = pq.ParquetWriter(self.f_out, schema, compression=COMPRESSION,
+                                  use_dictionary=list(CATEGORICAL_COLUMNS),
+                                  write_statistics=True)
+        try:
+            for month in sorted(self.months):
+                columns = self.months[month]
+                n_rows = len(columns['duration'])
+                arrays = []
+                for field in schema:
+                    value_type = field.type.index_type if field.name in dictionaries else field.type
+                    # the array buffers are handed to arrow without a copy
+                    values = pa.Array.from_buffers(value_type, n_rows,
+                                                   [None, pa.py_buffer(columns[field.name])])
+                    if field.name in dictionaries:
+                        values = pa.DictionaryArray.from_arrays(values, dictionaries[field.name])
+                    arrays.append(values)
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema),
+                                   row_group_size=ROW_GROUP_ROWS)
+        finally:
+            writer.close()
+
+
+def month_row_groups(metadata, months):
+    """
+    Returns the indices of the row groups of a Parquet file (given by its
+    metadata) whose month statistics overlap the given months. Row groups
+    without statistics are always kept.
+    """
+    months = set(months)
+    column = metadata.schema.names.index('month')
+    groups = []
+    for index in range(metadata.num_row_groups):
+        statistics = metadata.row_group(index).column(column).statistics
+        if statistics is None or not statistics.has_min_max or any(
+                statistics.min <= month <= statistics.max for month in months):
+            groups.append(index)
+    return groups
+
+
+def iter_parquet_columns(filename, columns, batch_rows=BATCH_ROWS):
+    """
+    Yields the values of the given columns of a Parquet summary as lists of
+    Python values, batch_rows trips at a time, with day_of_week and
+    user_type as strings. Only those columns are read.
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(filename)
+    for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=list(columns)):
+        yield [batch.column(batch.schema.get_field_index(name)).to_pylist()
+               for name in columns]
+
+
+def read_parquet_frame(filename, columns=None, months=None, days=None):
+    """
+    Loads a Parquet summary into a pandas DataFrame with the same dtypes as
+    `pd.read_csv` gives for the csv summary, keeping the trips of the given
+    months and days. Only the given columns are read, and if months is given
+    only the row groups that may hold those months.
+    """
+    import pyarrow.parquet as pq
+
+    from bikeshare.columnar import needed_columns, select_frame
+
+    parquet_file = pq.ParquetFile(filename)
+    if months is None:
+        groups = range(parquet_file.metadata.num_row_groups)
+    else:
+        groups = month_row_groups(parquet_file.metadata, months)
+    table = parquet_file.read_row_groups(list(groups),
+                                         columns=needed_columns(columns, months, days))
+
+    frame = table.to_pandas()
+    for name in frame.columns:
+        if name in CATEGORICAL_COLUMNS:
+            # the string dtype read_csv gives, object before pandas 3
+            frame[name] = frame[name].astype(str)
+        elif name != 'duration':
+            frame[name] = frame[name].astype('int64')
+    return select_frame(frame, columns, months, days)
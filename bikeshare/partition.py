@@ -0,0 +1,234 @@
+"""
+Partitioned layout of the condensed trip summaries.
+
+A partitioned summary is a directory holding one directory per city and in
+it one summary file per month, named after the month:
+
+    summaries/NYC/01.csv
+    summaries/NYC/02.csv
+    ...
+    summaries/Washington/12.csv
+
+Every partition is an ordinary csv (possibly compressed), columnar or
+Parquet summary file with the trips of one month in the order of the raw
+file, so each reader of summary files can read it on its own.
+`condense_data(..., partitioned=True)` writes the partitions of a city
+directly, and `partition_files` selects those of some cities and months by
+their names alone, so a question about March opens a single file per city
+whatever the size of the other months. Weekdays are spread over every
+month, so a weekday filter is applied to the trips of the selected
+partitions instead.
+
+    number_of_trips('./data/summaries', cities=['NYC'], months=[3])
+    load_summary_frame('./data/summaries', months=[6, 7, 8], days=['Saturday', 'Sunday'])
+"""
+
+import csv
+import os
+import re
+from itertools import islice
+
+from bikeshare.compression import SUFFIXES, open_text
+from bikeshare.trips import OUT_COLNAMES, binary_writer, check_uncompressed_binary
+
+
+# file suffix of the partitions of each summary format
+FORMAT_SUFFIXES = {'csv': '.csv', 'columnar': '.bsum', 'parquet': '.parquet'}
+
+# file suffix of each compression of csv partitions
+COMPRESSION_SUFFIXES = {compression: suffix for suffix, compression in SUFFIXES.items()}
+
+# name of a partition file: the two digit month, the format suffix and the
+# compression suffix if any
+PARTITION_NAME = re.compile(r'^(\d\d)\.(csv|bsum|parquet)(\.gz|\.bz2|\.xz)?$')
+
+# condensed data points grouped by month before they are written
+BATCH_ROWS = 16384
+
+
+def partition_name(month, out_format='csv', compression=None):
+    """
+    Returns the file name of the partition of a month.
+    """
+    if out_format not in FORMAT_SUFFIXES:
+        raise ValueError('unknown summary format {!r}'.format(out_format))
+    name = '{:02d}{}'.format(month, FORMAT_SUFFIXES[out_format])
+    if compression is not None:
+        name += COMPRESSION_SUFFIXES[compression]
+    return name
+
+
+def partition_month(name):
+    """
+    Returns the month of a partition file name, or None if the name is not
+    that of a partition.
+    """
+    match = PARTITION_NAME.match(name)
+    return int(match.group(1)) if match else None
+
+
+def is_partitioned(filename):
+    """
+    Returns True if filename is the root directory of a partitioned summary.
+    """
+    return os.path.isdir(filename)
+
+
+def partition_files(root, cities=None, months=None):
+    """
+    Returns a (city, month, path) tuple for each partition of the summary in
+    root that belongs to one of the given cities and months (every city or
+    month if None), sorted by city and month. Only the directories of the
+    selected cities are listed, and no partition is opened.
+    """
+    if cities is None:
+        cities = sorted(name for name in os.listdir(root)
+                        if os.path.isdir(os.path.join(root, name)))
+    if months is not None:
+        months = set(months)
+
+    partitions = []
+    for city in cities:
+        city_dir = os.path.join(root, city)
+        if not os.path.isdir(city_dir):
+            continue
+        for name in os.listdir(city_dir):
+            month = partition_month(name)
+            if month is not None and (months is None or month in months):
+                partitions.append((city, month, os.path.join(city_dir, name)))
+    partitions.sort()
+    return partitions
+
+
+class PartitionedWriter(object):
+    """
+    Writes condensed data points to the partition of their month, in the
+    directory of a city under root.
+
+    Like the ColumnarWriter, it offers the `writeheader` and `writerow`
+    methods of the csv DictWriter object, so it can be handed to
+    `condense_rows` in place of one, and `write_frame` for the vectorized
+    engine. Partitions are created as their first trip arrives; the
+    partitions a previous run left in the city directory are removed first.
+    """
+
+    def __init__(self, root, city, out_format='csv', compression=None):
+        if compression == 'infer':
+            compression = None
+        if out_format not in FORMAT_SUFFIXES:
+            raise ValueError('unknown summary format {!r}'.format(out_format))
+        if out_format != 'csv':
+            check_uncompressed_binary(root, compression, out_format)
+
+        self.city_dir = os.path.join(root, city)
+        self.out_format = out_format
+        self.compression = compression
+        # open file and writer of each month
+        self.files = {}
+        self.writers = {}
+
+        os.makedirs(self.city_dir, exist_ok=True)
+        for name in os.listdir(self.city_dir):
+            if partition_month(name) is not None:
+                os.remove(os.path.join(self.city_dir, name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _writer(self, month):
+        writer = self.writers.get(month)
+        if writer is None:
+            path = os.path.join(self.city_dir,
+                                partition_name(month, self.out_format, self.compression))
+            if self.out_format == 'csv':
+                f_out = open_text(path, 'w', self.compression)
+                writer = csv.writer(f_out)
+                writer.writerow(OUT_COLNAMES)
+            else:
+                f_out = open(path, 'wb')
+                writer = binary_writer(self.out_format, f_out)
+            self.files[month] = f_out
+            self.writers[month] = writer
+        return writer
+
+    def writeheader(self):
+        # every partition gets its header when it is created
+        pass
+
+    def writerow(self, new_point):
+        writer = self._writer(new_point['month'])
+        if self.out_format == 'csv':
+            writer.writerow([new_point[name] for name in OUT_COLNAMES])
+        else:
+            writer.writerow(new_point)
+
+    def write_points(self, points, batch_rows=BATCH_ROWS):
+        """
+        Writes the condensed csv rows of `condensed_points`, grouping
+        batch_rows of them at a time by month.
+        """
+        if self.out_format != 'csv':
+            raise ValueError('only csv partitions are written from condensed rows')
+        points = iter(points)
+        while True:
+            batch = list(islice(points, batch_rows))
+            if not batch:
+                break
+            by_month = {}
+            for point in batch:
+                by_month.setdefault(point[1], []).append(point)
+            for month, month_points in by_month.items():
+                self._writer(month).writerows(month_points)
+
+    def write_frame(self, frame):
+        """
+        Appends every row of a pandas DataFrame holding the summary columns.
+        """
+        for month, month_frame in frame.groupby('month', sort=False):
+            writer = self._writer(int(month))
+            if self.out_format == 'csv':
+                from bikeshare.vectorized import format_csv_rows
+
+                self.files[int(month)].write(format_csv_rows(month_frame))
+            else:
+                writer.write_frame(month_frame)
+
+    def close(self):
+        """
+        Writes out and closes every partition.
+        """
+        for month in sorted(self.writers):
+            if self.out_format != 'csv':
+                self.writers[month].close()
+            self.files[month].close()
+        self.files = {}
+        self.writers = {}
+
+
+def load_partitions_frame(root, columns=None, cities=None, months=None, days=None):
+    """
+    Loads the partitions of the selected cities and months of a partitioned
+    summary into a single pandas DataFrame, keeping the trips of the given
+    days. Besides the summary columns, the frame has a 'city' column naming
+    the city of each trip, which columns may also select.
+    """
+    import pandas as pd
+
+    from bikeshare.columnar import load_summary_frame
+
+    if columns is None:
+        columns = OUT_COLNAMES + ['city']
+    # the month column stands in when only the city is asked for
+    file_columns = [name for name in columns if name != 'city'] or ['month']
+
+    frames = []
+    for city, _, path in partition_files(root, cities, months):
+        # a partition holds a single month, so only the days are filtered
+        frame = load_summary_frame(path, file_columns, days=days)
+        frames.append(frame.assign(city=city))
+    if not frames:
+        return pd.DataFrame(columns=list(columns))
+    return pd.concat(frames, ignore_index=True)[list(columns)]
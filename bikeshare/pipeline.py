@@ -0,0 +1,148 @@
+"""
+Streaming pipeline of typed trip records.
+
+A source yields each condensed trip of a summary file (csv, columnar or
+Parquet) as a `Trip` namedtuple with typed fields. Stages are functions taking an iterable
+of trips and returning another, built with `where` and `select` and chained
+with `pipeline`. Sinks are objects with an `add(trip)` method and a `result()`
+method; `run` feeds one lazy stream to several sinks at once, so a number of
+analyses share a single pass over the file and memory stays constant
+whatever its size.
+
+    trips = pipeline(read_trips(filename), where(month=7))
+    summary, by_day = run(trips, TripSummary(), GroupCount('day_of_week'))
+"""
+
+import csv
+from collections import namedtuple
+
+from bikeshare.columnar import ColumnarSummary, is_columnar
+from bikeshare.compression import open_text
+from bikeshare.parquet import is_parquet, iter_parquet_columns
+from bikeshare.stats import TripSummary
+from bikeshare.trips import OUT_COLNAMES
+
+
+# one condensed trip; duration is a float, month and hour are ints
+Trip = namedtuple('Trip', OUT_COLNAMES)
+
+
+def read_trips(filename):
+    """
+    Source yielding every trip of a summary file in any format as a Trip.
+    The trips of a Parquet summary come month by month.
+    """
+    if is_parquet(filename):
+        for columns in iter_parquet_columns(filename, OUT_COLNAMES):
+            for values in zip(*columns):
+                yield Trip(*values)
+        return
+
+    if is_columnar(filename):
+        with ColumnarSummary(filename) as summary:
+            days = summary.categories['day_of_week']
+            user_types = summary.categories['user_type']
+            for duration, month, hour, day, user in zip(
+                    summary.duration, summary.month, summary.hour,
+                    summary.day_of_week, summary.user_type):
+                yield Trip(duration, month, hour, days[day], user_types[user])
+        return
+
+    with open_text(filename) as f_in:
+        reader = csv.reader(f_in)
+        header = next(reader)
+        columns = [header.index(name) for name in OUT_COLNAMES]
+        duration, month, hour, day, user = columns
+        for row in reader:
+            if row:
+                yield Trip(float(row[duration]), int(row[month]), int(row[hour]),
+                           row[day], row[user])
+
+
+def where(predicate=None, **criteria):
+    """
+    Returns a stage keeping the trips for which predicate(trip) is true and
+    whose fields equal the given keyword values, e.g. where(user_type='Customer').
+    A keyword value that is a list, tuple or set matches any of its items.
+    """
+    checks = []
+    for name, value in criteria.items():
+        if name not in Trip._fields:
+            raise ValueError('unknown trip field {!r}'.format(name))
+        index = Trip._fields.index(name)
+        if isinstance(value, (list, tuple, set, frozenset)):
+            checks.append((index, frozenset(value), True))
+        else:
+            checks.append((index, value, False))
+
+    def stage(trips):
+        for trip in trips:
+            if all((trip[index] in value) if many else (trip[index] == value)
+                   for index, value, many in checks) \
+                    and (predicate is None or predicate(trip)):
+                yield trip
+    return stage
+
+
+def select(func):
+    """
+    Returns a stage replacing every trip with func(trip), e.g. to convert
+    durations with select(lambda trip: trip._replace(duration=trip.duration/60)).
+    """
+    def stage(trips):
+        for trip in trips:
+            yield func(trip)
+    return stage
+
+
+def pipeline(source, *stages):
+    """
+    Chains the stages onto the source and returns the resulting lazy stream.
+    """
+    trips = source
+    for stage in stages:
+        trips = stage(trips)
+    return trips
+
+
+class GroupCount(object):
+    """
+    Sink counting trips and summing their durations by one or more fields,
+    e.g. GroupCount('month', 'user_type') for the rides by month pivot.
+    """
+
+    def __init__(self, *fields):
+        if not fields:
+            raise ValueError('GroupCount needs at least one field')
+        self.fields = fields
+        self.indexes = [Trip._fields.index(name) for name in fields]
+        self.counts = {}
+        self.durations = {}
+
+    def add(self, trip):
+        if len(self.indexes) == 1:
+            key = trip[self.indexes[0]]
+        else:
+            key = tuple(trip[index] for index in self.indexes)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.durations[key] = self.durations.get(key, 0) + trip.duration
+
+    def result(self):
+        """
+        Returns a dictionary mapping each group to its (count, total duration,
+        mean duration).
+        """
+        return {key: (count, self.durations[key], self.durations[key]/count)
+                for key, count in self.counts.items()}
+
+
+def run(trips, *sinks):
+    """
+    Feeds every trip of the stream to each sink in a single pass and returns
+    the list of their results.
+    """
+    adds = [sink.add for sink in sinks]
+    for trip in trips:
+        for add in adds:
+            add(trip)
+    return [sink.result() for sink in sinks]
@@ -0,0 +1,167 @@
+"""
+Registry of the raw trip file layouts of each city.
+
+A CitySchema declares the columns a city's raw files keep the duration,
+start time and user type in, the start time format, the unit of the
+durations and how its user types map onto 'Subscriber'/'Customer'. The
+helper functions and both condense engines read every city through its
+schema, so adding a city is a matter of registering one:
+
+    register_schema(CitySchema('Boston', duration_column='tripduration',
+                               duration_unit='seconds',
+                               start_column='starttime',
+                               time_format='%Y-%m-%d %H:%M:%S',
+                               user_type_column='usertype'))
+
+Once the header row of a file is known, `compile` resolves the columns into
+positions, giving a RowExtractor that works on the plain lists of
+`csv.reader` instead of a dictionary per row.
+
+As in the original helpers, a city without a schema of its own is read like
+Washington.
+"""
+
+from bikeshare.timeparse import StartTimeDecoder
+
+
+# duration units of the raw files, with the number of units per minute
+DURATION_UNITS = {'seconds': 60, 'milliseconds': 1000*60}
+
+# city whose schema is used for cities without one
+DEFAULT_CITY = 'Washington'
+
+
+class UserTypeMap(dict):
+    """
+    Mapping of a city's raw user types onto the condensed ones, raising a
+    ValueError for a raw user type it does not know.
+    """
+
+    def __missing__(self, user_type):
+        raise ValueError('unknown member type {!r}'.format(user_type))
+
+
+class CitySchema(object):
+    """
+    Layout of the raw trip files of one city. user_types maps the raw user
+    types onto 'Subscriber' and 'Customer'; when it is None the raw values
+    are kept as they are.
+    """
+
+    def __init__(self, name, duration_column, duration_unit, start_column,
+                 time_format, user_type_column, user_types=None):
+        if duration_unit not in DURATION_UNITS:
+            raise ValueError('unknown duration unit {!r}'.format(duration_unit))
+        # StartTimeDecoder splits the date from the clock at the space and
+        # reads the hour up to the first colon
+        if ' %H:' not in time_format:
+            raise ValueError('start time format {!r} must be a date, a space and '
+                             'a clock starting with %H:'.format(time_format))
+        self.name = name
+        self.duration_column = duration_column
+        self.duration_unit = duration_unit
+        self.start_column = start_column
+        self.time_format = time_format
+        self.user_type_column = user_type_column
+        self.user_types = UserTypeMap(user_types) if user_types is not None else None
+
+    def __repr__(self):
+        return 'CitySchema({!r})'.format(self.name)
+
+    @property
+    def per_minute(self):
+        return DURATION_UNITS[self.duration_unit]
+
+    @property
+    def columns(self):
+        """
+        The raw columns read by the condense step, in summary order.
+        """
+        return [self.duration_column, self.start_column, self.user_type_column]
+
+    def duration(self, text):
+        """
+        Returns a raw duration as a number of minutes.
+        """
+        return int(text)/self.per_minute
+
+    def user_type(self, text):
+        """
+        Returns the condensed user type of a raw user type.
+        """
+        if self.user_types is None:
+            return text
+        return self.user_types[text]
+
+    def compile(self, fieldnames):
+        """
+        Resolves the columns of the schema in the header row fieldnames and
+        returns the RowExtractor for rows with that header.
+        """
+        positions = []
+        for column in self.columns:
+            if column not in fieldnames:
+                raise ValueError('{} files need a {!r} column'.format(self.name, column))
+            positions.append(list(fieldnames).index(column))
+        return RowExtractor(self, *positions)
+
+
+class RowExtractor(object):
+    """
+    Positional reader of the condensed fields of raw csv rows, as compiled by
+    `CitySchema.compile`. Calling it on a row returns the
+    (duration, month, hour, day_of_week, user_type) tuple of the trip.
+    """
+
+    def __init__(self, schema, duration_index, start_index, user_type_index):
+        self.schema = schema
+        self.duration_index = duration_index
+        self.start_index = start_index
+        self.user_type_index = user_type_index
+        self.start_time = StartTimeDecoder(schema.name, schema=schema).decode
+        self.duration = schema.duration
+        self.user_type = schema.user_type
+
+    def __call__(self, row):
+        month, hour, day_of_week = self.start_time(row[self.start_index])
+        return (self.duration(row[self.duration_index]), month, hour, day_of_week,
+                self.user_type(row[self.user_type_index]))
+
+
+# registered schemas by city name
+SCHEMAS = {}
+
+
+def register_schema(schema):
+    """
+    Adds a city schema to the registry, replacing any schema of the same
+    city, and returns it.
+    """
+    SCHEMAS[schema.name] = schema
+    return schema
+
+
+def get_schema(city):
+    """
+    Returns the schema of a city, or Washington's for an unregistered city.
+    """
+    schema = SCHEMAS.get(city)
+    if schema is None:
+        schema = SCHEMAS[DEFAULT_CITY]
+    return schema
+
+
+register_schema(CitySchema('NYC', duration_column='tripduration', duration_unit='seconds',
+                           start_column='starttime', time_format='%m/%d/%Y %H:%M:%S',
+                           user_type_column='usertype'))
+register_schema(CitySchema('Chicago', duration_column='tripduration', duration_unit='seconds',
+                           start_column='starttime', time_format='%m/%d/%Y %H:%M',
+                           user_type_column='usertype'))
+register_schema(CitySchema('Washington', duration_column='Duration (ms)',
+                           duration_unit='milliseconds', start_column='Start date',
+                           time_format='%m/%d/%Y %H:%M', user_type_column='Member Type',
+                           user_types={'Registered': 'Subscriber', 'Casual': 'Customer'}))
+# the Bay Area Bike Share files of the notebook's examples folder
+register_schema(CitySchema('BayArea', duration_column='Duration', duration_unit='seconds',
+                           start_column='Start Date', time_format='%m/%d/%Y %H:%M',
+                           user_type_column='Subscriber Type'))
@@ -0,0 +1,330 @@
+"""
+Approximate trip duration quantiles with mergeable sketches.
+
+Sorting every duration to find a median or p99 does not scale to hundreds of
+millions of trips. A DurationSketch instead counts durations in buckets whose
+bounds grow geometrically (the DDSketch scheme): bucket i holds the values
+in (gamma**(i-1), gamma**i] with gamma = (1 + a) / (1 - a), and reports them
+as 2 * gamma**i / (gamma + 1). Every quantile it returns is therefore within
+a relative error `a` (relative_accuracy, 1% by default) of the exact
+quantile, whatever the data, as long as no buckets had to be collapsed.
+
+Sketches are merged by adding bucket counts, so partial sketches from
+chunks, processes or cities combine without losing the guarantee. With 1%
+accuracy, durations from one second to a month fit in under 700 buckets.
+If a sketch grows past max_buckets, its lowest buckets are collapsed, which
+only affects the accuracy of the lowest quantiles.
+
+DurationSketches keeps one sketch per (month, user_type) of a city so that
+quantiles can be queried per city, user type and month and rolled up. It
+can be filled by `condense_data` and saved as a small JSON file next to the
+summary.
+"""
+
+import csv
+import json
+import math
+import os
+
+from bikeshare.columnar import ColumnarSummary, is_columnar
+from bikeshare.compression import open_text
+from bikeshare.parquet import is_parquet, iter_parquet_columns
+
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BUCKETS = 2048
+FORMAT_VERSION = 1
+
+# the quantiles operations asks for
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class DurationSketch(object):
+    """
+    Relative-error quantile sketch of positive durations.
+    """
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY,
+                 max_buckets=DEFAULT_MAX_BUCKETS):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative_accuracy must be between 0 and 1')
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.collapsed = False
+
+    def bucket_of(self, duration):
+        """
+        Returns the index of the bucket holding a positive duration.
+        """
+        return math.ceil(math.log(duration) / self.log_gamma)
+
+    def add(self, duration, count=1):
+        """
+        Adds a duration, count times. Durations of zero or less are counted
+        separately and reported as the minimum.
+        """
+        if duration > 0:
+            index = self.bucket_of(duration)
+            buckets = self.buckets
+            if index in buckets:
+                buckets[index] += count
+            else:
+                buckets[index] = count
+                if len(buckets) > self.max_buckets:
+                    self._collapse()
+        else:
+            self.zero_count += count
+        self.count += count
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+
+    def update(self, durations):
+        """
+        Adds every duration of an iterable.
+        """
+        for duration in durations:
+            self.add(duration)
+
+    def _collapse(self):
+        # fold the two lowest buckets together until the sketch fits again
+        indexes = sorted(self.buckets)
+        while len(indexes) > self.max_buckets:
+            lowest = indexes.pop(0)
+            self.buckets[indexes[0]] += self.buckets.pop(lowest)
+        self.collapsed = True
+
+    def merge(self, other):
+        """
+        Adds the counts of another sketch with the same accuracy.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('only sketches with the same accuracy can be merged')
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.collapsed = self.collapsed or other.collapsed
+        return self
+
+    def quantile(self, q):
+        """
+        Returns the approximate q-quantile (0 <= q <= 1) of the durations, the
+        value of rank floor(q * (count - 1)) in sorted order, or None if the
+        sketch is empty.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError('quantile must be between 0 and 1')
+        if self.count == 0:
+            return None
+
+        rank = int(q * (self.count - 1))
+        if rank < self.zero_count:
+            return self.min
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                # the exact extremes are known, so never report past them
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def quantiles(self, qs=DEFAULT_QUANTILES):
+        """
+        Returns a dictionary of the approximate quantiles for each q in qs.
+        """
+        return {q: self.quantile(q) for q in qs}
+
+    def to_dict(self):
+        """
+        Returns the sketch as a JSON-serializable dictionary, with the bucket
+        counts stored densely from the lowest bucket.
+        """
+        lowest = min(self.buckets) if self.buckets else 0
+        counts = [0] * ((max(self.buckets) - lowest + 1) if self.buckets else 0)
+        for index, count in self.buckets.items():
+            counts[index - lowest] = count
+        return {'relative_accuracy': self.relative_accuracy,
+                'max_buckets': self.max_buckets,
+                'count': self.count, 'zero_count': self.zero_count,
+                'min': self.min if self.count else None,
+                'max': self.max if self.count else None,
+                'collapsed': self.collapsed,
+                'lowest': lowest, 'counts': counts}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds a sketch from the dictionary made by `to_dict`.
+        """
+        sketch = cls(data['relative_accuracy'], data['max_buckets'])
+        sketch.buckets = {data['lowest'] + offset: count
+                          for offset, count in enumerate(data['counts']) if count}
+        sketch.count = data['count']
+        sketch.zero_count = data['zero_count']
+        if sketch.count:
+            sketch.min = data['min']
+            sketch.max = data['max']
+        sketch.collapsed = data['collapsed']
+        return sketch
+
+
+class DurationSketches(object):
+    """
+    One DurationSketch per (month, user_type) of a city's trips.
+
+    It offers `writerow`, so `condense_rows` can fill it while condensing,
+    and `query` merges the sketches matching a month and/or user type.
+    """
+
+    def __init__(self, city=None, relative_accuracy=DEFAULT_RELATIVE_ACCURACY,
+                 max_buckets=DEFAULT_MAX_BUCKETS):
+        self.city = city
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.sketches = {}
+
+    def sketch(self, month, user_type):
+        """
+        Returns the sketch of a (month, user_type) cell, creating it if needed.
+        """
+        key = (month, user_type)
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = DurationSketch(self.relative_accuracy,
+                                                         self.max_buckets)
+        return sketch
+
+    def add(self, duration, month, user_type):
+        self.sketch(month, user_type).add(duration)
+
+    def writerow(self, new_point):
+        """
+        Adds a condensed data point, as written by `condense_rows`.
+        """
+        self.sketch(new_point['month'], new_point['user_type']).add(new_point['duration'])
+
+    def add_frame(self, frame):
+        """
+        Adds every row of a pandas DataFrame holding the summary columns.
+        """
+        import numpy as np
+
+        positive = frame[frame['duration'] > 0]
+        buckets = np.ceil(np.log(positive['duration'].to_numpy(dtype=np.float64))
+                          / math.log((1 + self.relative_accuracy) / (1 - self.relative_accuracy)))
+        grouped = positive.assign(bucket=buckets.astype(np.int64)).groupby(
+            ['month', 'user_type', 'bucket'])['duration'].agg(['count', 'min', 'max'])
+        for (month, user_type, index), row in grouped.iterrows():
+            sketch = self.sketch(int(month), user_type)
+            sketch.buckets[int(index)] = sketch.buckets.get(int(index), 0) + int(row['count'])
+            sketch.count += int(row['count'])
+            sketch.min = min(sketch.min, float(row['min']))
+            sketch.max = max(sketch.max, float(row['max']))
+        for sketch in self.sketches.values():
+            if len(sketch.buckets) > sketch.max_buckets:
+                sketch._collapse()
+
+        for row in frame[frame['duration'] <= 0].itertuples(index=False):
+            self.sketch(int(row.month), row.user_type).add(row.duration)
+
+    def add_summary(self, filename):
+        """
+        Adds every trip of a csv, columnar or Parquet summary file.
+        """
+        if is_columnar(filename):
+            with ColumnarSummary(filename) as summary:
+                names = summary.categories['user_type']
+                for duration, month, code in zip(summary.duration, summary.month,
+                                                 summary.user_type):
+                    self.sketch(month, names[code]).add(duration)
+            return
+        if is_parquet(filename):
+            for durations, months, user_types in iter_parquet_columns(
+                    filename, ['duration', 'month', 'user_type']):
+                for duration, month, user_type in zip(durations, months, user_types):
+                    self.sketch(month, user_type).add(duration)
+            return
+
+        with open_text(filename) as f_in:
+            reader = csv.reader(f_in)
+            header = next(reader)
+            duration_col = header.index('duration')
+            month_col = header.index('month')
+            user_type_col = header.index('user_type')
+            for row in reader:
+                if row:
+                    self.sketch(int(row[month_col]), row[user_type_col]).add(
+                        float(row[duration_col]))
+
+    def merge(self, other):
+        """
+        Adds the sketches of another set, e.g. of another chunk of the file.
+        """
+        for (month, user_type), sketch in other.sketches.items():
+            self.sketch(month, user_type).merge(sketch)
+        return self
+
+    def query(self, month=None, user_type=None):
+        """
+        Returns one DurationSketch merging the cells of the given month(s)
+        and user type(s); None matches all of them.
+        """
+        months = None if month is None else set(month if isinstance(month, (list, tuple, set, range)) else [month])
+        user_types = None if user_type is None else set(
+            user_type if isinstance(user_type, (list, tuple, set)) else [user_type])
+
+        merged = DurationSketch(self.relative_accuracy, self.max_buckets)
+        for (cell_month, cell_user_type), sketch in self.sketches.items():
+            if ((months is None or cell_month in months)
+                    and (user_types is None or cell_user_type in user_types)):
+                merged.merge(sketch)
+        return merged
+
+    def save(self, filename):
+        """
+        Writes the sketches to a JSON file.
+        """
+        data = {'version': FORMAT_VERSION, 'city': self.city,
+                'relative_accuracy': self.relative_accuracy,
+                'max_buckets': self.max_buckets,
+                'sketches': [{'month': month, 'user_type': user_type,
+                              'sketch': sketch.to_dict()}
+                             for (month, user_type), sketch in sorted(self.sketches.items())]}
+        with open(filename, 'w') as f_out:
+            json.dump(data, f_out, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads sketches written by `save`.
+        """
+        with open(filename, 'r') as f_in:
+            data = json.load(f_in)
+        if data['version'] != FORMAT_VERSION:
+            raise ValueError('unsupported sketch file version {}'.format(data['version']))
+        sketches = cls(data['city'], data['relative_accuracy'], data['max_buckets'])
+        for cell in data['sketches']:
+            sketches.sketches[(cell['month'], cell['user_type'])] = \
+                DurationSketch.from_dict(cell['sketch'])
+        return sketches
+
+
+def sketch_path(summary_file):
+    """
+    Returns the path of the sketch file kept next to a summary file.
+    """
+    return os.path.splitext(summary_file)[0] + '.sketch.json'
@@ -0,0 +1,329 @@
+"""
+Summary statistics over the condensed trip data.
+
+`summarize_trips` makes a single pass over a summary file and collects every
+count and duration total the analysis needs. `number_of_trips`,
+`travel_length` and `rides_by_usertype` are views over its result.
+
+Summary files can be in either the csv format or the columnar binary format
+of bikeshare/columnar.py. Columnar files are memory mapped and aggregated a
+column at a time instead of parsing text rows. csv summaries may be gzip, bz2
+or xz compressed.
+
+Every function also takes the root directory of a partitioned summary
+(bikeshare/partition.py), and optional cities, months and days (weekday
+names) filters. Only the partitions of the selected cities and months are
+opened, and the weekday filter is applied to their trips.
+"""
+
+import csv
+import os
+from itertools import compress
+
+from bikeshare.columnar import ColumnarSummary, is_columnar
+from bikeshare.compression import open_text
+from bikeshare.parquet import is_parquet, iter_parquet_columns
+
+
+# trips longer than this many minutes count as long trips
+LONG_TRIP_MINUTES = 30
+
+# translation table swapping the 0 and 1 flags of a user type mask
+INVERT_MASK = bytes([1, 0]) + bytes(254)
+
+
+class TripSummary(object):
+    """
+    Counts and duration totals of the trips in one summary file.
+
+    Trips by any user type other than 'Subscriber' count as customer trips.
+    Every total is accumulated in file order, so the derived values are the
+    same as those of the original per-function scans.
+    """
+
+    def __init__(self, n_subscribers=0, subs_trip_length=0, n_customers=0,
+                 cust_trip_length=0, trip_length=0, long_trip=0):
+        self.n_subscribers = n_subscribers
+        self.subs_trip_length = subs_trip_length
+        self.n_customers = n_customers
+        self.cust_trip_length = cust_trip_length
+        self.trip_length = trip_length
+        self.long_trip = long_trip
+
+    def add(self, trip):
+        """
+        Adds a single trip with `duration` and `user_type` attributes, so that
+        the summary can be used as a sink of bikeshare/pipeline.py.
+        """
+        duration = trip.duration
+        self.trip_length += duration
+        if duration > LONG_TRIP_MINUTES:
+            self.long_trip += 1
+
+        if trip.user_type == 'Subscriber':
+            self.n_subscribers += 1
+            self.subs_trip_length += duration
+        else:
+            self.n_customers += 1
+            self.cust_trip_length += duration
+
+    def result(self):
+        return self
+
+    def merge(self, other):
+        """
+        Adds the counts and totals of another TripSummary to this one.
+        """
+        self.n_subscribers += other.n_subscribers
+        self.subs_trip_length += other.subs_trip_length
+        self.n_customers += other.n_customers
+        self.cust_trip_length += other.cust_trip_length
+        self.trip_length += other.trip_length
+        self.long_trip += other.long_trip
+        return self
+
+    def __repr__(self):
+        return ('TripSummary(n_subscribers={}, n_customers={}, trip_length={}, '
+                'long_trip={})'.format(self.n_subscribers, self.n_customers,
+                                       self.trip_length, self.long_trip))
+
+    @property
+    def n_total(self):
+        return self.n_subscribers + self.n_customers
+
+    @property
+    def short_trip(self):
+        return self.n_total - self.long_trip
+
+    @property
+    def subs_ratio(self):
+        return self.n_subscribers/self.n_total
+
+    @property
+    def cust_ratio(self):
+        return self.n_customers/self.n_total
+
+    @property
+    def mean_trip_length(self):
+        return self.trip_length/self.n_total
+
+    @property
+    def mean_subs_trip_length(self):
+        return self.subs_trip_length/self.n_subscribers
+
+    @property
+    def mean_cust_trip_length(self):
+        return self.cust_trip_length/self.n_customers
+
+    def trip_counts(self):
+        """
+        Returns the tuple reported by `number_of_trips`.
+        """
+        n_subs_ratio = '{0:.2%}'.format(self.subs_ratio)
+        n_cust_ratio = '{0:.2%}'.format(self.cust_ratio)
+        return (self.n_subscribers, self.n_customers, self.n_total,
+                n_subs_ratio, n_cust_ratio)
+
+    def trip_lengths(self):
+        """
+        Returns the tuple reported by `travel_length`.
+        """
+        average_trip = round(self.mean_trip_length, 0)
+        short_trip_pct = '{0:.2%}'.format(self.short_trip/self.n_total)
+        long_trip_pct = '{0:.2%}'.format(self.long_trip/self.n_total)
+        return (average_trip, short_trip_pct, long_trip_pct)
+
+    def user_type_lengths(self):
+        """
+        Returns the tuple reported by `rides_by_usertype`.
+        """
+        avg_sub_trip = round(self.mean_subs_trip_length, 2)
+        avg_cust_trip = round(self.mean_cust_trip_length, 2)
+        return (avg_sub_trip, avg_cust_trip, self.n_subscribers,
+                self.subs_trip_length, self.n_customers, self.cust_trip_length)
+
+
+def user_type_mask(summary, user_type):
+    """
+    Returns a bytes object holding 1 for every trip of the columnar summary
+    made by the given user type and 0 for every other trip.
+    """
+    code = summary.code_of('user_type', user_type)
+    table = bytearray(256)
+    if code is not None:
+        table[code] = 1
+    return summary.user_type.tobytes().translate(table)
+
+
+def summarize_columnar(filename):
+    """
+    Aggregates a columnar summary file one column at a time.
+    """
+    with ColumnarSummary(filename) as summary:
+        subscriber = user_type_mask(summary, 'Subscriber')
+        customer = subscriber.translate(INVERT_MASK)
+        n_subscribers = subscriber.count(1)
+
+        return TripSummary(
+            n_subscribers=n_subscribers,
+            subs_trip_length=sum(compress(summary.duration, subscriber)),
+            n_customers=len(summary) - n_subscribers,
+            cust_trip_length=sum(compress(summary.duration, customer)),
+            trip_length=sum(summary.duration),
+            long_trip=sum(1 for duration in summary.duration
+                          if duration > LONG_TRIP_MINUTES))
+
+
+def summarize_parquet(filename):
+    """
+    Aggregates a Parquet summary file, reading only its duration and
+    user_type columns.
+    """
+    n_subscribers = 0
+    subs_trip_length = 0
+    n_customers = 0
+    cust_trip_length = 0
+    trip_length = 0
+    long_trip = 0
+
+    for durations, user_types in iter_parquet_columns(filename, ['duration', 'user_type']):
+        for duration, user_type in zip(durations, user_types):
+            trip_length += duration
+            if duration > LONG_TRIP_MINUTES:
+                long_trip += 1
+
+            if user_type == 'Subscriber':
+                n_subscribers += 1
+                subs_trip_length += duration
+            else:
+                n_customers += 1
+                cust_trip_length += duration
+
+    return TripSummary(n_subscribers, subs_trip_length, n_customers,
+                       cust_trip_length, trip_length, long_trip)
+
+
+def summarize_csv(filename):
+    """
+    Aggregates a csv summary file in a single pass over its rows.
+    """
+    n_subscribers = 0
+    subs_trip_length = 0
+    n_customers = 0
+    cust_trip_length = 0
+    trip_length = 0
+    long_trip = 0
+
+    with open_text(filename) as f_in:
+        # set up csv reader object and find the columns we need
+        reader = csv.reader(f_in)
+        header = next(reader)
+        duration_col = header.index('duration')
+        user_type_col = header.index('user_type')
+
+        for row in reader:
+            if not row:
+                continue
+            duration = float(row[duration_col])
+            trip_length += duration
+            if duration > LONG_TRIP_MINUTES:
+                long_trip += 1
+
+            if row[user_type_col] == 'Subscriber':
+                n_subscribers += 1
+                subs_trip_length += duration
+            else:
+                n_customers += 1
+                cust_trip_length += duration
+
+    return TripSummary(n_subscribers, subs_trip_length, n_customers,
+                       cust_trip_length, trip_length, long_trip)
+
+
+def summarize_filtered(filename, months=None, days=None):
+    """
+    Aggregates the trips of a summary file in any format that were made in
+    one of the given months and on one of the given days.
+    """
+    from bikeshare.pipeline import read_trips
+
+    summary = TripSummary()
+    for trip in read_trips(filename):
+        if ((months is None or trip.month in months) and
+                (days is None or trip.day_of_week in days)):
+            summary.add(trip)
+    return summary
+
+
+def summarize_file(filename, months=None, days=None):
+    """
+    Aggregates a single summary file, going through the trips one by one
+    only when they have to be filtered.
+    """
+    if months is not None or days is not None:
+        return summarize_filtered(filename, months, days)
+    if is_columnar(filename):
+        return summarize_columnar(filename)
+    if is_parquet(filename):
+        return summarize_parquet(filename)
+    return summarize_csv(filename)
+
+
+def summarize_partitions(root, cities=None, months=None, days=None):
+    """
+    Aggregates the partitions of the selected cities and months of a
+    partitioned summary, one partition at a time.
+    """
+    from bikeshare.partition import partition_files
+
+    summary = TripSummary()
+    for _, _, path in partition_files(root, cities, months):
+        # a partition holds a single month, so only the days are filtered
+        summary.merge(summarize_file(path, days=days))
+    return summary
+
+
+def summarize_trips(filename, cities=None, months=None, days=None):
+    """
+    This function reads in a file with trip data once and returns a
+    TripSummary with the counts by user type, the total trip length overall
+    and by user type, and the number of long trips.
+
+    filename may be a summary file or the root directory of a partitioned
+    summary, of which only the partitions of the given cities and months
+    are read. months and days filter the trips of a summary file as well;
+    cities only selects partitions.
+    """
+    if months is not None:
+        months = set(months)
+    if days is not None:
+        days = set(days)
+    if os.path.isdir(filename):
+        return summarize_partitions(filename, cities, months, days)
+    return summarize_file(filename, months, days)
+
+
+def number_of_trips(filename, cities=None, months=None, days=None):
+    """
+    This function reads in a file with trip data and reports the number of
+    trips made by subscribers, customers, and total overall.
+    """
+    return summarize_trips(filename, cities, months, days).trip_counts()
+
+
+def travel_length(filename, cities=None, months=None, days=None):
+    """
+    This function reads in a file with trip data and reports the average trip
+    length in minutes and the share of trips up to and longer than 30
+    minutes.
+    """
+    return summarize_trips(filename, cities, months, days).trip_lengths()
+
+
+def rides_by_usertype(filename, cities=None, months=None, days=None):
+    """
+    This function reads in a file with trip data and reports the average trip
+    length of subscribers and customers, with the number of trips and the
+    total trip length behind each average.
+    """
+    return summarize_trips(filename, cities, months, days).user_type_lengths()
@@ -0,0 +1,306 @@
+"""
+SQLite store of the condensed trips.
+
+A TripStore keeps the trips of any number of summary files in one local
+SQLite file, so that ad-hoc SQL and the statistics of the analysis run
+against indexed tables instead of parsing the csv summaries again:
+
+    with TripStore('./data/trips.db') as store:
+        store.load_summary('./data/NYC-2016-Summary.csv', 'NYC')
+        store.number_of_trips('NYC')
+        store.pivot('NYC', 'month', columns='user_type')
+
+Summaries are bulk loaded with `executemany` in chunks of LOAD_CHUNK_ROWS
+trips, each in a transaction of its own, with the database in WAL mode.
+The chunks go to a staging table, and a last transaction swaps the staged
+trips in for the city's previous ones together with its `summaries` row, so
+that a load failing halfway leaves the previous trips of the city in place
+and none of the new ones. The trips table is indexed on (city, month,
+user_type) and (city, day_of_week, hour): every question is about one city,
+and then filters and groups on the columns of the month or the weekday
+questions, and replacing the trips of a city finds them by the same
+indexes. Both indexes end with the duration, so the statistics and pivots
+of a city are answered from an index without reading the table.
+
+`number_of_trips`, `travel_length` and `rides_by_usertype` give the same
+tuples as the functions of bikeshare/stats.py, and `query` and `rollup`
+the same CubeStats as a TripCube. SQLite adds up durations in its own
+order, so totals can differ from a pass over the summary file in the last
+bits of a float.
+"""
+
+import sqlite3
+import time
+from itertools import chain, islice
+
+from bikeshare.cube import DIMENSIONS, CubeStats, as_set
+from bikeshare.stats import LONG_TRIP_MINUTES, TripSummary
+
+
+# trips inserted per executemany call and per transaction
+LOAD_CHUNK_ROWS = 50000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trips (
+    city TEXT NOT NULL,
+    duration REAL NOT NULL,
+    month INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    day_of_week TEXT NOT NULL,
+    user_type TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trips_staging (
+    city TEXT NOT NULL,
+    duration REAL NOT NULL,
+    month INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    day_of_week TEXT NOT NULL,
+    user_type TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    city TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    n_rows INTEGER NOT NULL,
+    loaded_at REAL NOT NULL
+);
+"""
+
+# the indexes of earlier stores did not lead with the city and are dropped
+INDEXES = """
+DROP INDEX IF EXISTS trips_month_user_type;
+DROP INDEX IF EXISTS trips_day_of_week_hour;
+CREATE INDEX IF NOT EXISTS trips_city_month_user_type ON trips (city, month, user_type, duration);
+CREATE INDEX IF NOT EXISTS trips_city_day_of_week_hour ON trips (city, day_of_week, hour, duration);
+"""
+
+TRIP_COLUMNS = 'city, duration, month, hour, day_of_week, user_type'
+
+STAGE_TRIP = ('INSERT INTO trips_staging (duration, month, hour, day_of_week, user_type, city) '
+              'VALUES (?, ?, ?, ?, ?, ?)')
+
+# SQL aggregate of each pivot aggfunc
+AGGREGATES = {'count': 'COUNT(*)', 'sum': 'TOTAL(duration)', 'mean': 'AVG(duration)'}
+
+
+def where_clause(city, filters):
+    """
+    Returns the WHERE clause and its parameters selecting the trips of a
+    city (every city if None) that match the keyword filters, each of which
+    is a single value or a sequence of values of a cube dimension.
+    """
+    conditions = []
+    parameters = []
+    if city is not None:
+        conditions.append('city = ?')
+        parameters.append(city)
+    for name, values in filters.items():
+        if name not in DIMENSIONS:
+            raise ValueError('unknown trip dimension {!r}'.format(name))
+        values = sorted(as_set(values))
+        conditions.append('{} IN ({})'.format(name, ', '.join('?' * len(values))))
+        parameters.extend(values)
+    if not conditions:
+        return ('', parameters)
+    return (' WHERE ' + ' AND '.join(conditions), parameters)
+
+
+class TripStore(object):
+    """
+    Condensed trips of several cities in a SQLite database file. Use as a
+    context manager or call `close` when done.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        # transactions are begun and committed explicitly
+        self.connection = sqlite3.connect(filename, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        # WAL keeps the database consistent without a sync at every commit
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def __repr__(self):
+        return 'TripStore({!r})'.format(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def load_trips(self, trips, city, source='', chunk_rows=LOAD_CHUNK_ROWS):
+        """
+        Replaces the trips of a city by the given ones, each a sequence of
+        (duration, month, hour, day_of_week, user_type). Returns the number
+        of trips loaded. If the load fails, the city keeps its previous trips.
+        """
+        execute = self.connection.execute
+        # staged trips of a load that was interrupted before
+        self._clear_staging(city)
+
+        try:
+            n_rows = 0
+            rows = (tuple(trip) + (city,) for trip in trips)
+            while True:
+                chunk = list(islice(rows, chunk_rows))
+                if not chunk:
+                    break
+                execute('BEGIN')
+                try:
+                    self.connection.executemany(STAGE_TRIP, chunk)
+                except BaseException:
+                    execute('ROLLBACK')
+                    raise
+                execute('COMMIT')
+                n_rows += len(chunk)
+
+            execute('BEGIN')
+            try:
+                execute('DELETE FROM trips WHERE city = ?', (city,))
+                execute('INSERT INTO trips ({0}) SELECT {0} FROM trips_staging '
+                        'WHERE city = ?'.format(TRIP_COLUMNS), (city,))
+                execute('DELETE FROM trips_staging WHERE city = ?', (city,))
+                execute('DELETE FROM summaries WHERE city = ?', (city,))
+                execute('INSERT INTO summaries (city, source, n_rows, loaded_at) '
+                        'VALUES (?, ?, ?, ?)', (city, source, n_rows, time.time()))
+            except BaseException:
+                execute('ROLLBACK')
+                raise
+            execute('COMMIT')
+        except BaseException:
+            self._clear_staging(city)
+            raise
+
+        # the indexes are built once the first trips are in, and kept up to
+        # date by later loads
+        self.connection.executescript(INDEXES)
+        return n_rows
+
+    def _clear_staging(self, city):
+        execute = self.connection.execute
+        execute('BEGIN')
+        execute('DELETE FROM trips_staging WHERE city = ?', (city,))
+        execute('COMMIT')
+
+    def load_summary(self, filename, city, chunk_rows=LOAD_CHUNK_ROWS):
+        """
+        Replaces the trips of a city by those of a csv or columnar summary
+        file, or of the csv or columnar partitions of the city if filename is
+        a partitioned summary. Returns the number of trips loaded.
+        """
+        from bikeshare.partition import is_partitioned, partition_files
+        from bikeshare.pipeline import read_trips
+
+        if is_partitioned(filename):
+            trips = chain.from_iterable(read_trips(path) for _, _, path
+                                        in partition_files(filename, [city]))
+        else:
+            trips = read_trips(filename)
+        return self.load_trips(trips, city, filename, chunk_rows)
+
+    def cities(self):
+        """
+        Returns the cities loaded, in alphabetical order.
+        """
+        return [city for city, in self.connection.execute(
+            'SELECT city FROM summaries ORDER BY city')]
+
+    def execute(self, sql, parameters=()):
+        """
+        Runs an ad-hoc SQL statement and returns its rows as a list.
+        """
+        return self.connection.execute(sql, parameters).fetchall()
+
+    def summarize(self, city=None, **filters):
+        """
+        Returns the TripSummary of the trips of a city (every city if None)
+        matching the keyword filters, from a single aggregate query.
+        """
+        where, parameters = where_clause(city, filters)
+        sql = ("SELECT COALESCE(SUM(user_type = 'Subscriber'), 0), "
+               "TOTAL(CASE WHEN user_type = 'Subscriber' THEN duration END), "
+               "COALESCE(SUM(user_type != 'Subscriber'), 0), "
+               "TOTAL(CASE WHEN user_type != 'Subscriber' THEN duration END), "
+               "TOTAL(duration), COALESCE(SUM(duration > ?), 0) FROM trips" + where)
+        row = self.connection.execute(sql, [LONG_TRIP_MINUTES] + parameters).fetchone()
+        return TripSummary(*row)
+
+    def number_of_trips(self, city=None, **filters):
+        """
+        Reports the number of trips made by subscribers, customers, and total
+        overall, as `number_of_trips` does for a summary file.
+        """
+        return self.summarize(city, **filters).trip_counts()
+
+    def travel_length(self, city=None, **filters):
+        """
+        Reports the average trip length and the share of trips up to and
+        longer than 30 minutes, as `travel_length` does for a summary file.
+        """
+        return self.summarize(city, **filters).trip_lengths()
+
+    def rides_by_usertype(self, city=None, **filters):
+        """
+        Reports the average trip length of subscribers and customers, as
+        `rides_by_usertype` does for a summary file.
+        """
+        return self.summarize(city, **filters).user_type_lengths()
+
+    def query(self, city=None, **filters):
+        """
+        Returns the CubeStats of the trips of a city (every city if None)
+        matching the keyword filters, like `TripCube.query`.
+        """
+        where, parameters = where_clause(city, filters)
+        sql = ('SELECT COUNT(*), TOTAL(duration), TOTAL(duration * duration) FROM trips'
+               + where)
+        return CubeStats(*self.connection.execute(sql, parameters).fetchone())
+
+    def rollup(self, city, *by, **filters):
+        """
+        Returns a dictionary mapping each value (or tuple of values) of the
+        dimensions named in `by` to the CubeStats of the matching trips of a
+        city (every city if None), like `TripCube.rollup`.
+        """
+        for name in by:
+            if name not in DIMENSIONS:
+                raise ValueError('unknown trip dimension {!r}'.format(name))
+        if not by:
+            return {(): self.query(city, **filters)}
+        where, parameters = where_clause(city, filters)
+        columns = ', '.join(by)
+        sql = ('SELECT {0}, COUNT(*), TOTAL(duration), TOTAL(duration * duration) '
+               'FROM trips{1} GROUP BY {0}'.format(columns, where))
+        groups = {}
+        for row in self.connection.execute(sql, parameters):
+            key = row[0] if len(by) == 1 else tuple(row[:len(by)])
+            groups[key] = CubeStats(*row[len(by):])
+        return groups
+
+    def pivot(self, city, index, columns=None, aggfunc='count', **filters):
+        """
+        Returns a pandas DataFrame of the count, sum or mean (aggfunc) of the
+        durations of the trips of a city grouped by the index dimension, and
+        spread over the values of the columns dimension if given, e.g.
+        pivot('Washington', 'month', columns='user_type') for the rides by
+        month of the analysis. Only the grouped rows leave SQLite.
+        """
+        import pandas as pd
+
+        if aggfunc not in AGGREGATES:
+            raise ValueError('unknown pivot aggfunc {!r}'.format(aggfunc))
+        by = [index] if columns is None else [index, columns]
+        for name in by:
+            if name not in DIMENSIONS:
+                raise ValueError('unknown trip dimension {!r}'.format(name))
+        where, parameters = where_clause(city, filters)
+        sql = 'SELECT {0}, {1} FROM trips{2} GROUP BY {0}'.format(
+            ', '.join(by), AGGREGATES[aggfunc], where)
+        frame = pd.DataFrame(self.connection.execute(sql, parameters).fetchall(),
+                             columns=by + [aggfunc])
+        if columns is None:
+            return frame.set_index(index)
+        return frame.pivot(index=index, columns=columns, values=aggfunc)
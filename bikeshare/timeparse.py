@@ -0,0 +1,105 @@
+"""
+Fast start time decoding for the raw city trip files.
+
+`time_of_trip` parses every timestamp with `datetime.strptime` and then
+formats it three times with `strftime` only to turn the strings back into
+numbers. The month and day of the week only depend on the date part of the
+timestamp, and a year of trips only has 366 distinct dates, so the decoder
+below parses each date once and memoizes it in a bounded cache. The hour is
+read straight from the clock part of the timestamp. `timestamp` reads the
+whole start time as a number of seconds the same way, for the event time
+windows of bikeshare/window.py, and `decode_timestamp` gives both from a
+single pass over the timestamp.
+"""
+
+from datetime import date, datetime
+from functools import lru_cache
+
+
+# weekday names indexed by Monday=0, as strftime("%A") spells them
+DAY_NAMES = [date(2016, 1, 4 + day).strftime("%A") for day in range(7)]
+
+# number of distinct dates kept per decoder, enough for several years of trips
+DEFAULT_CACHE_SIZE = 4096
+
+# origin of the start time stamps, which are in the local time of each city
+EPOCH = datetime(1970, 1, 1)
+
+
+class StartTimeDecoder(object):
+    """
+    Decodes the start time of a trip from a given city into the
+    (month, hour, day_of_week) tuple returned by `time_of_trip`.
+
+    The decoder is called with the trip dictionary (datum), or `decode` can be
+    called with the raw timestamp string. Parsed dates are memoized in a
+    bounded LRU cache of `cache_size` entries. The start time column and
+    format come from the city's schema in bikeshare/schema.py, unless a
+    CitySchema is passed as schema.
+    """
+
+    def __init__(self, city, cache_size=DEFAULT_CACHE_SIZE, schema=None):
+        if schema is None:
+            # the schema registry builds decoders itself, so import it lazily
+            from bikeshare.schema import get_schema
+
+            schema = get_schema(city)
+        self.city = city
+        self.column, self.time_format = schema.start_column, schema.time_format
+        self.date_format = self.time_format.split(' ')[0]
+        self._decode_date = lru_cache(maxsize=cache_size)(self._parse_date)
+
+    def _parse_date(self, date_text):
+        """
+        Parses the date part of a timestamp and returns its month, the name
+        of the day of the week and the number of seconds from EPOCH to the
+        start of that day.
+        """
+        startdate = datetime.strptime(date_text, self.date_format)
+        return (startdate.month, startdate.strftime("%A"), (startdate - EPOCH).days * 86400)
+
+    def decode(self, text):
+        """
+        Takes as input a raw start time string and returns the month, hour,
+        and day of the week in which the trip was made.
+        """
+        date_text, _, clock = text.partition(' ')
+        month, day_of_week, _ = self._decode_date(date_text)
+
+        # the hour is everything up to the first colon of the clock part
+        hour = int(clock[:clock.index(':')])
+        if not 0 <= hour <= 23:
+            raise ValueError('hour out of range in start time {!r}'.format(text))
+
+        return (month, hour, day_of_week)
+
+    def timestamp(self, text):
+        """
+        Takes as input a raw start time string and returns it as a number of
+        seconds since EPOCH, in the local time of the city.
+        """
+        return self.decode_timestamp(text)[1]
+
+    def decode_timestamp(self, text):
+        """
+        Takes as input a raw start time string and returns both the (month,
+        hour, day_of_week) tuple of `decode` and the number of seconds of
+        `timestamp`, parsing the string once.
+        """
+        date_text, _, clock = text.partition(' ')
+        month, day_of_week, day_seconds = self._decode_date(date_text)
+        fields = clock.split(':')
+        hour, minute = int(fields[0]), int(fields[1])
+        second = int(fields[2]) if len(fields) > 2 else 0
+        if not (0 <= hour <= 23 and 0 <= minute <= 59 and 0 <= second <= 61):
+            raise ValueError('clock out of range in start time {!r}'.format(text))
+        return ((month, hour, day_of_week), day_seconds + hour * 3600 + minute * 60 + second)
+
+    def __call__(self, datum):
+        return self.decode(datum[self.column])
+
+    def cache_info(self):
+        """
+        Returns the hit and miss statistics of the date cache.
+        """
+        return self._decode_date.cache_info()
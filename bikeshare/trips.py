@@ -0,0 +1,503 @@
+"""
+Helpers for reading the raw city trip files and condensing them into the
+*-2016-Summary.csv files used by the rest of the analysis.
+
+These are the helper functions from the Bike_Share_Analysis notebook, kept in
+a module so that they can be imported and benchmarked outside of it.
+"""
+
+import csv # read and write csv files
+import importlib
+import time
+from itertools import islice
+from datetime import datetime # operations to parse dates
+
+from bikeshare import instrument
+from bikeshare.compression import detect_compression, open_text, suffix_compression
+from bikeshare.scanner import RawScanner
+from bikeshare.schema import get_schema
+
+
+# column names of the condensed summary files
+OUT_COLNAMES = ['duration', 'month', 'hour', 'day_of_week', 'user_type']
+
+# binary summary formats, with the module and the class of their writer
+BINARY_WRITERS = {'columnar': ('bikeshare.columnar', 'ColumnarWriter'),
+                  'parquet': ('bikeshare.parquet', 'ParquetWriter')}
+
+# condensed rows formatted at a time before a single write to the output file
+BATCH_ROWS = 16384
+
+# formatted durations kept per city, enough for the common durations in whole
+# seconds, while durations in milliseconds soon stop being cached
+DURATION_CACHE_SIZE = 1 << 13
+
+
+def print_first_point(filename):
+    """
+    This function prints and returns the first data point (second row) from
+    a csv file that includes a header row. The file may be gzip, bz2 or xz
+    compressed.
+    """
+    # print city name for reference
+    city = filename.split('-')[0].split('/')[-1]
+    print('\nCity: {}'.format(city))
+
+    # use to print data structures like dictionaries in a nicer way than the
+    # base print function. pprint imports slowly, so only load it here.
+    from pprint import pprint
+
+    with open_text(filename) as f_in:
+        trip_reader = csv.DictReader(f_in)
+        first_trip = next(trip_reader)
+        pprint(first_trip)
+
+    # output city name and first trip for later testing
+    return (city, first_trip)
+
+
+def duration_in_mins(datum, city):
+    """
+    Takes as input a dictionary containing info about a single trip (datum) and
+    its origin city (city) and returns the trip duration in units of minutes.
+
+    Washington is in terms of milliseconds while Chicago and NYC are in terms
+    of seconds; the column and unit of each city come from its schema in
+    bikeshare/schema.py.
+    """
+    schema = get_schema(city)
+    duration = schema.duration(datum[schema.duration_column])
+
+    return duration
+
+
+def time_of_trip(datum, city):
+    """
+    Takes as input a dictionary containing info about a single trip (datum) and
+    its origin city (city) and returns the month, hour, and day of the week in
+    which the trip was made.
+
+    NYC includes seconds, while Washington and Chicago do not. This is the
+    reference implementation; `condense_data` uses the cached
+    `StartTimeDecoder` which returns the same values.
+    """
+    schema = get_schema(city)
+    startdate = datetime.strptime(datum[schema.start_column], schema.time_format)
+
+    month = int(startdate.strftime("%m"))
+    hour = int(startdate.strftime("%H"))
+    day_of_week = startdate.strftime("%A")
+
+    return (month, hour, day_of_week)
+
+
+def type_of_user(datum, city):
+    """
+    Takes as input a dictionary containing info about a single trip (datum) and
+    its origin city (city) and returns the type of system user that made the
+    trip.
+
+    Washington has different category names compared to Chicago and NYC, so
+    they are converted to match through its schema's user type mapping.
+    """
+    schema = get_schema(city)
+    user_type = schema.user_type(datum[schema.user_type_column])
+
+    return user_type
+
+
+def compile_rows(trip_reader, city, fieldnames=None):
+    """
+    Takes as input a csv reader of raw trips (trip_reader) from the given city
+    and returns an iterator over its data rows with the RowExtractor compiled
+    for its header. The header is the first row unless fieldnames is given.
+    The extractor is None for a file without a header row.
+    """
+    rows = iter(trip_reader)
+    if fieldnames is None:
+        fieldnames = next(rows, None)
+        if fieldnames is None:
+            return (rows, None)
+    return (rows, get_schema(city).compile(fieldnames))
+
+
+def condense_rows(trip_reader, trip_writer, city, fieldnames=None, run=None):
+    """
+    Takes as input a csv reader of raw trips (trip_reader) from the given city
+    and writes the condensed data point for each of them with the csv
+    DictWriter object (trip_writer). The header is the first row read unless
+    fieldnames is given, as with csv.DictReader.
+
+    If run is an instrument.RunStats, every stage of the loop is timed into it.
+    """
+    rows, extract = compile_rows(trip_reader, city, fieldnames)
+    if extract is None:
+        return
+    if run is not None:
+        return condense_rows_instrumented(rows, trip_writer, extract, run)
+
+    # collect data from and process each row
+    for row in rows:
+        # blank lines are skipped, like csv.DictReader does
+        if not row:
+            continue
+        duration, month, hour, day_of_week, user_type = extract(row)
+
+        # set up a dictionary to hold the values for the cleaned and trimmed
+        # data point
+        new_point = {}
+        new_point['duration'] = duration
+        new_point['month'] = month
+        new_point['hour'] = hour
+        new_point['day_of_week'] = day_of_week
+        new_point['user_type'] = user_type
+
+        trip_writer.writerow(new_point)
+
+
+def condense_rows_instrumented(rows, trip_writer, extract, run):
+    """
+    Same as `condense_rows` over the data rows of a csv reader with their
+    compiled RowExtractor (extract), timing the csv read, start time decoding,
+    duration, user type and write stages of every row into run.
+    """
+    start_time, duration, user_type = extract.start_time, extract.duration, extract.user_type
+    start_index = extract.start_index
+    duration_index = extract.duration_index
+    user_type_index = extract.user_type_index
+    clock = time.perf_counter
+
+    while True:
+        t_start = clock()
+        row = next(rows, None)
+        t_read = clock()
+        if not row:
+            run.stage_seconds['csv_read'] += t_read - t_start
+            if row is None:
+                break
+            continue
+
+        new_point = {}
+        month, hour, day_of_week = start_time(row[start_index])
+        t_decode = clock()
+        new_point['duration'] = duration(row[duration_index])
+        t_duration = clock()
+        new_point['month'] = month
+        new_point['hour'] = hour
+        new_point['day_of_week'] = day_of_week
+        new_point['user_type'] = user_type(row[user_type_index])
+        t_user_type = clock()
+
+        trip_writer.writerow(new_point)
+        t_write = clock()
+
+        run.add_row(t_read - t_start, t_decode - t_read, t_duration - t_decode,
+                    t_user_type - t_duration, t_write - t_user_type)
+
+
+class DurationFormatter(object):
+    """
+    Formats raw durations in units of which there are per_minute in a minute
+    exactly as the csv writer formats the value of `duration_in_mins`.
+
+    Raw durations repeat a lot (NYC and Chicago count whole seconds), so the
+    formatted text is memoized by the raw text in a dictionary of up to
+    `cache_size` entries, which skips the int parsing, the division and the
+    float formatting for every repeated value. Once the dictionary is full
+    the duration is returned as a float for the csv writer to format.
+    """
+
+    def __init__(self, per_minute, cache_size=DURATION_CACHE_SIZE):
+        self.per_minute = per_minute
+        self.cache_size = cache_size
+        self.cache = {}
+
+    def __call__(self, text):
+        formatted = self.cache.get(text)
+        if formatted is None:
+            duration = int(text)/self.per_minute
+            if len(self.cache) >= self.cache_size:
+                # leave mostly distinct durations to the csv writer to format
+                return duration
+            formatted = self.cache[text] = repr(duration)
+        return formatted
+
+
+class BatchSink(object):
+    """
+    Write target of a csv writer collecting the formatted rows in a list, so
+    that a whole batch goes to the output file in one write.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.write = self.parts.append
+
+    def flush_to(self, f_out):
+        """
+        Writes the collected text to f_out and returns whether there was any.
+        """
+        if not self.parts:
+            return False
+        f_out.write(''.join(self.parts))
+        self.parts.clear()
+        return True
+
+
+def condensed_points(trip_reader, city, fieldnames=None):
+    """
+    Takes as input a csv reader of raw trips (trip_reader) from the given city
+    and yields the condensed data point of each of them as a tuple in the
+    order of OUT_COLNAMES, for a positional csv writer: the duration is
+    either its formatted text or a float left to the writer to format. The
+    header is the first row read unless fieldnames is given.
+    """
+    rows, extract = compile_rows(trip_reader, city, fieldnames)
+    if extract is None:
+        return
+
+    start_time = extract.start_time
+    start_index = extract.start_index
+    duration = DurationFormatter(extract.schema.per_minute)
+    duration_index = extract.duration_index
+    user_types = extract.schema.user_types
+    user_type_index = extract.user_type_index
+
+    for row in rows:
+        # blank lines are skipped, like csv.DictReader does
+        if not row:
+            continue
+        month, hour, day_of_week = start_time(row[start_index])
+        user_type = row[user_type_index]
+        if user_types is not None:
+            user_type = user_types[user_type]
+        yield (duration(row[duration_index]), month, hour, day_of_week, user_type)
+
+
+def write_condensed_rows(trip_reader, f_out, city, fieldnames=None,
+                         batch_rows=BATCH_ROWS, run=None):
+    """
+    Takes as input a csv reader of raw trips (trip_reader) from the given city
+    and writes the condensed csv row of each of them to the text file f_out,
+    the same text `condense_rows` writes through a DictWriter. The header is
+    the first row read unless fieldnames is given.
+
+    Fields are taken from the raw rows by position, each condensed row is a
+    tuple from `condensed_points` handed to a positional csv writer, rows
+    are formatted batch_rows at a time and every batch is written to f_out
+    at once. If run is an instrument.RunStats, every stage of each batch is
+    timed into it.
+    """
+    sink = BatchSink()
+    writerows = csv.writer(sink).writerows
+    if run is not None:
+        def write_batch(new_points):
+            writerows(new_points)
+            sink.flush_to(f_out)
+
+        write_condensed_batches_instrumented(trip_reader, write_batch, city, run,
+                                             fieldnames, batch_rows)
+        return
+    new_points = condensed_points(trip_reader, city, fieldnames)
+    while True:
+        writerows(islice(new_points, batch_rows))
+        if not sink.flush_to(f_out):
+            break
+
+
+def write_condensed_batches_instrumented(trip_reader, write_batch, city, run,
+                                         fieldnames=None, batch_rows=BATCH_ROWS):
+    """
+    Same as `condensed_points` handing the data points to write_batch a list
+    of batch_rows at a time, timing the csv read, start time decoding,
+    duration, user type and write stages of each batch into run. Every stage
+    goes over the whole batch, so the clock is read five times per batch
+    instead of per row.
+    """
+    rows, extract = compile_rows(trip_reader, city, fieldnames)
+    if extract is None:
+        return
+
+    start_time = extract.start_time
+    start_index = extract.start_index
+    duration = DurationFormatter(extract.schema.per_minute)
+    duration_index = extract.duration_index
+    user_types = extract.schema.user_types
+    user_type_index = extract.user_type_index
+    clock = time.perf_counter
+
+    while True:
+        t_start = clock()
+        batch = list(islice(rows, batch_rows))
+        if not batch:
+            run.stage_seconds['csv_read'] += clock() - t_start
+            break
+        # blank lines are skipped, like csv.DictReader does
+        batch = [row for row in batch if row]
+        t_read = clock()
+        start_times = [start_time(row[start_index]) for row in batch]
+        t_decode = clock()
+        durations = [duration(row[duration_index]) for row in batch]
+        t_duration = clock()
+        if user_types is None:
+            users = [row[user_type_index] for row in batch]
+        else:
+            users = [user_types[row[user_type_index]] for row in batch]
+        t_user_type = clock()
+
+        write_batch([(trip_duration, month, hour, day_of_week, user_type)
+                     for trip_duration, (month, hour, day_of_week), user_type
+                     in zip(durations, start_times, users)])
+        t_write = clock()
+
+        run.add_batch(len(batch), t_read - t_start, t_decode - t_read, t_duration - t_decode,
+                      t_user_type - t_duration, t_write - t_user_type)
+
+
+class TeeWriter(object):
+    """
+    Writer passing every condensed data point on to several writers, e.g. a
+    csv DictWriter and a TripCube.
+    """
+
+    def __init__(self, *writers):
+        self.writers = [writer for writer in writers if writer is not None]
+
+    def writerow(self, new_point):
+        for writer in self.writers:
+            writer.writerow(new_point)
+
+
+def check_uncompressed_binary(out_file, compression, out_format):
+    """
+    Raises a ValueError if a columnar or Parquet summary was asked to be
+    compressed: columnar summaries are memory mapped by their readers, and
+    Parquet summaries compress their own column chunks.
+    """
+    if compression == 'infer':
+        compression = suffix_compression(out_file)
+    if compression is not None:
+        raise ValueError('{} summaries cannot be compressed'.format(out_format))
+
+
+def binary_writer(out_format, f_out):
+    """
+    Returns the writer of a binary summary format for the output file
+    f_out, importing its module on first use.
+    """
+    module, name = BINARY_WRITERS[out_format]
+    return getattr(importlib.import_module(module), name)(f_out)
+
+
+def condense_data(in_file, out_file, city, out_format='csv', engine='python',
+                  cube_file=None, sketch_file=None, compression='infer',
+                  partitioned=False, index_file=None):
+    """
+    This function takes full data from the specified input file
+    and writes the condensed data to a specified output file. The city
+    argument determines how the input file will be parsed.
+
+    out_format selects between the 'csv' summary, the 'columnar' binary
+    summary described in bikeshare/columnar.py and the 'parquet' summary of
+    bikeshare/parquet.py. engine='pandas' condenses
+    whole columns at a time with bikeshare/vectorized.py instead of going
+    through the helper functions row by row. If cube_file is given, the
+    TripCube of bikeshare/cube.py is filled along the way and saved there,
+    and likewise the duration quantile sketches of bikeshare/sketch.py for
+    sketch_file and the bitmap index of bikeshare/bitmap.py for index_file.
+
+    The input file may be gzip, bz2 or xz compressed; it is decompressed
+    while it is read. A csv summary is compressed with the given compression
+    ('gzip', 'bz2', 'xz' or None), by default the one its suffix names, as
+    in bikeshare/compression.py.
+
+    If partitioned is True, out_file is the root directory of a partitioned
+    summary instead (see bikeshare/partition.py): the trips of each month are
+    written to their own summary file in the directory of the city, and a
+    csv summary is only compressed if a compression is given.
+
+    The python engine reads uncompressed inputs through the memory-mapped
+    scanner of bikeshare/scanner.py. While bikeshare/instrument.py is
+    enabled, it times each stage of the same loop and writes a report at the
+    end of the run.
+    """
+    # accumulators filled alongside the summary, with the file each is saved to
+    accumulators = []
+    if cube_file is not None:
+        from bikeshare.cube import TripCube
+
+        accumulators.append((TripCube(city), cube_file))
+    if sketch_file is not None:
+        from bikeshare.sketch import DurationSketches
+
+        accumulators.append((DurationSketches(city), sketch_file))
+    if index_file is not None:
+        from bikeshare.bitmap import BitmapIndex
+
+        accumulators.append((BitmapIndex(city), index_file))
+    extra_writers = [accumulator for accumulator, _ in accumulators]
+
+    if engine == 'pandas':
+        from bikeshare.vectorized import condense_data_vectorized
+
+        condense_data_vectorized(in_file, out_file, city, out_format=out_format,
+                                 accumulators=extra_writers, compression=compression,
+                                 partitioned=partitioned)
+    elif engine != 'python':
+        raise ValueError('unknown condense engine {!r}'.format(engine))
+    elif out_format != 'csv' and out_format not in BINARY_WRITERS:
+        raise ValueError('unknown summary format {!r}'.format(out_format))
+    else:
+        with instrument.condense_run(city, in_file, out_file) as run:
+            if detect_compression(in_file) is None:
+                with RawScanner(in_file) as scanner:
+                    if run is not None:
+                        run.watch_scanner(scanner)
+                    condense_file(scanner.reader(), out_file, city, out_format,
+                                  extra_writers, run, compression, partitioned)
+            else:
+                f_in = run.open_input() if run is not None else open_text(in_file)
+                with f_in:
+                    condense_file(csv.reader(f_in), out_file, city, out_format,
+                                  extra_writers, run, compression, partitioned)
+
+    for accumulator, filename in accumulators:
+        accumulator.save(filename)
+
+
+def condense_file(trip_reader, out_file, city, out_format, extra_writers, run,
+                  compression='infer', partitioned=False):
+    """
+    Condenses the raw trips of the csv reader trip_reader into out_file, or
+    into the partitions of the city under out_file, with the python engine.
+    """
+    if partitioned:
+        from bikeshare.partition import PartitionedWriter
+
+        with PartitionedWriter(out_file, city, out_format, compression) as trip_writer:
+            if out_format == 'csv' and not extra_writers and run is None:
+                trip_writer.write_points(condensed_points(trip_reader, city))
+            elif out_format == 'csv' and not extra_writers:
+                write_condensed_batches_instrumented(trip_reader, trip_writer.write_points,
+                                                     city, run)
+            else:
+                condense_rows(trip_reader, TeeWriter(trip_writer, *extra_writers),
+                              city, run=run)
+    elif out_format in BINARY_WRITERS:
+        check_uncompressed_binary(out_file, compression, out_format)
+        with open(out_file, 'wb') as f_out:
+            trip_writer = binary_writer(out_format, f_out)
+            condense_rows(trip_reader, TeeWriter(trip_writer, *extra_writers),
+                          city, run=run)
+            trip_writer.close()
+    else:
+        with open_text(out_file, 'w', compression) as f_out:
+            # set up csv DictWriter object - writer requires column names for
+            # the first row as the "fieldnames" argument
+            trip_writer = csv.DictWriter(f_out, fieldnames = OUT_COLNAMES)
+            trip_writer.writeheader()
+
+            if extra_writers:
+                condense_rows(trip_reader, TeeWriter(trip_writer, *extra_writers), city, run=run)
+            else:
+                write_condensed_rows(trip_reader, f_out, city, run=run)
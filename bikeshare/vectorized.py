@@ -0,0 +1,215 @@
+"""
+Vectorized pandas/NumPy engine for condensing the raw city trip files.
+
+Instead of building a dictionary for every trip and calling the helper
+functions on it, the raw file is read in chunks of whole columns, restricted
+to the three columns the summary needs, and every field is derived with
+column operations. The output is the same as that of the per-row helpers:
+
+- durations are divided by the same int constants, so the float values are
+  identical, and they are written with the same repr as the csv module uses
+- the date part of the start times is parsed with the explicit per-city
+  format in one `pd.to_datetime` call over the distinct dates, and the hour
+  is read from the clock part with byte arithmetic, like StartTimeDecoder
+- weekday names are the strftime("%A") names of the helpers
+- user types go through the city schema's mapping, so Washington's
+  'Registered'/'Casual' member types become 'Subscriber'/'Customer'
+"""
+
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+
+from bikeshare.compression import detect_compression, open_text
+from bikeshare.schema import get_schema
+from bikeshare.timeparse import DAY_NAMES
+from bikeshare.trips import (BINARY_WRITERS, OUT_COLNAMES, binary_writer,
+                             check_uncompressed_binary)
+
+# raw rows handled at a time, which bounds the memory used on full files
+DEFAULT_CHUNK_ROWS = 1000000
+
+SPACE, COLON, ZERO = ord(' '), ord(':'), ord('0')
+
+
+def city_columns(city):
+    """
+    Returns the duration, start time and user type columns of the city's raw
+    files, its start time format and its duration units per minute.
+    """
+    schema = get_schema(city)
+    return (schema.duration_column, schema.start_column, schema.user_type_column,
+            schema.time_format, schema.per_minute)
+
+
+def read_raw_chunks(in_file, city, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Returns an iterator of DataFrames of up to chunk_rows raw trips from
+    in_file, holding only the duration, start time and user type columns of
+    the city. A compressed in_file is decompressed by the background thread
+    of `open_text` while pandas parses it.
+    """
+    duration_col, time_col, user_type_col, _, _ = city_columns(city)
+
+    if detect_compression(in_file) is None:
+        f_in = None
+        source = in_file
+    else:
+        f_in = source = open_text(in_file)
+
+    try:
+        # keep empty user types as '' like csv.DictReader does
+        yield from pd.read_csv(source, usecols=[duration_col, time_col, user_type_col],
+                               dtype={duration_col: 'int64', time_col: str,
+                                      user_type_col: str},
+                               keep_default_na=False, chunksize=chunk_rows)
+    finally:
+        if f_in is not None:
+            f_in.close()
+
+
+def decode_start_times(start_times, time_format):
+    """
+    Takes as input a Series of raw start time strings in the given format and
+    returns NumPy arrays of the month, hour and weekday name of each.
+    """
+    raw = np.asarray(start_times.to_numpy(dtype=object).astype(str), dtype='S')
+    width = raw.dtype.itemsize
+    chars = raw.view(np.uint8).reshape(len(raw), width)
+    rows = np.arange(len(raw))
+
+    space = np.argmax(chars == SPACE, axis=1)
+    colon = np.argmax(chars == COLON, axis=1)
+    if len(raw) and ((chars[rows, space] != SPACE).any() or (colon <= space + 1).any()
+                     or (colon > space + 3).any()):
+        raise ValueError('start times do not match {!r}'.format(time_format))
+
+    # the month and weekday only depend on the date part, so parse each
+    # distinct date once with the explicit format
+    dates = chars.copy()
+    dates[np.arange(width) >= space[:, None]] = 0
+    date_codes, distinct_dates = pd.factorize(dates.view('S{}'.format(width)).ravel())
+    startdate = pd.to_datetime(pd.Series(distinct_dates).str.decode('ascii'),
+                               format=time_format.split(' ')[0])
+    month = startdate.dt.month.to_numpy()[date_codes]
+    day_of_week = np.array(DAY_NAMES, dtype=object)[startdate.dt.weekday.to_numpy()][date_codes]
+
+    # the hour is the one or two digits between the space and the colon
+    first = chars[rows, space + 1].astype(np.int64) - ZERO
+    second = chars[rows, np.minimum(space + 2, width - 1)].astype(np.int64) - ZERO
+    two_digits = colon - space == 3
+    hour = np.where(two_digits, first * 10 + second, first)
+    if ((first < 0) | (first > 9) | (two_digits & ((second < 0) | (second > 9)))
+            | (hour > 23)).any():
+        raise ValueError('start times do not match {!r}'.format(time_format))
+
+    return (month, hour, day_of_week)
+
+
+def condense_frame(raw, city):
+    """
+    Takes as input a DataFrame of raw trips from the given city and returns
+    the condensed DataFrame with the summary columns.
+    """
+    duration_col, time_col, user_type_col, time_format, per_minute = city_columns(city)
+    month, hour, day_of_week = decode_start_times(raw[time_col], time_format)
+
+    user_type = raw[user_type_col]
+    user_types = get_schema(city).user_types
+    if user_types is not None:
+        user_type = user_type.map(dict(user_types))
+        if user_type.isna().any():
+            unknown = raw[user_type_col][user_type.isna()].iloc[0]
+            raise ValueError('unknown member type {!r}'.format(unknown))
+
+    return pd.DataFrame({'duration': raw[duration_col].to_numpy() / per_minute,
+                         'month': month,
+                         'hour': hour,
+                         'day_of_week': day_of_week,
+                         'user_type': user_type.to_numpy(dtype=object)},
+                        columns=OUT_COLNAMES)
+
+
+def format_csv_rows(frame):
+    """
+    Returns the text of the condensed rows of frame exactly as csv.DictWriter
+    writes them.
+
+    Both the durations and the (month, hour, day_of_week, user_type)
+    combinations repeat a lot, so each distinct value is formatted once by
+    the csv module and the lines are assembled by indexing.
+    """
+    duration_codes, durations = pd.factorize(frame['duration'])
+    duration_text = np.array([repr(duration) + ',' for duration in durations.tolist()],
+                             dtype=object)
+
+    # pack the month, hour and the codes of the two string columns into one
+    # integer per row, and format the first row of each distinct packed key
+    day_codes, days = pd.factorize(frame['day_of_week'])
+    user_codes, user_types = pd.factorize(frame['user_type'])
+    packed = frame['month'].to_numpy(dtype=np.int64) * 24 + frame['hour'].to_numpy(dtype=np.int64)
+    packed = (packed * max(len(days), 1) + day_codes) * max(len(user_types), 1) + user_codes
+    key_codes, distinct_keys = pd.factorize(packed)
+
+    first_rows = np.empty(len(distinct_keys), dtype=np.int64)
+    first_rows[key_codes[::-1]] = np.arange(len(key_codes))[::-1]
+    f_keys = io.StringIO()
+    csv.writer(f_keys).writerows(frame[OUT_COLNAMES[1:]].iloc[first_rows].values.tolist())
+    key_text = np.array(f_keys.getvalue().splitlines(True), dtype=object)
+    if len(key_text) != len(distinct_keys):
+        raise ValueError('summary values must not contain line breaks')
+
+    return ''.join((duration_text[duration_codes] + key_text[key_codes]).tolist())
+
+
+def add_to_accumulators(frames, accumulators):
+    """
+    Passes the condensed frames through, adding each of them to every
+    accumulator (such as a TripCube) with its `add_frame` method.
+    """
+    for frame in frames:
+        for accumulator in accumulators:
+            accumulator.add_frame(frame)
+        yield frame
+
+
+def condense_data_vectorized(in_file, out_file, city, out_format='csv',
+                             chunk_rows=DEFAULT_CHUNK_ROWS, accumulators=(),
+                             compression='infer', partitioned=False):
+    """
+    Vectorized version of `condense_data`: takes full data from the specified
+    input file and writes the condensed data to a specified output file in
+    the 'csv', 'columnar' or 'parquet' format, compressing a csv summary as
+    `condense_data` does, or to the partitions of the city under out_file if
+    partitioned is True. Every chunk is also added to each of the
+    accumulators, such as a TripCube or DurationSketches.
+    """
+    chunks = (condense_frame(raw, city)
+              for raw in read_raw_chunks(in_file, city, chunk_rows))
+    if accumulators:
+        chunks = add_to_accumulators(chunks, accumulators)
+
+    if partitioned:
+        from bikeshare.partition import PartitionedWriter
+
+        with PartitionedWriter(out_file, city, out_format, compression) as trip_writer:
+            for frame in chunks:
+                trip_writer.write_frame(frame)
+        return
+    elif out_format in BINARY_WRITERS:
+        check_uncompressed_binary(out_file, compression, out_format)
+        with open(out_file, 'wb') as f_out:
+            trip_writer = binary_writer(out_format, f_out)
+            for frame in chunks:
+                trip_writer.write_frame(frame)
+            trip_writer.close()
+        return
+    elif out_format != 'csv':
+        raise ValueError('unknown summary format {!r}'.format(out_format))
+
+    with open_text(out_file, 'w', compression) as f_out:
+        csv.DictWriter(f_out, fieldnames = OUT_COLNAMES).writeheader()
+        for frame in chunks:
+            f_out.write(format_csv_rows(frame))
@@ -0,0 +1,246 @@
+"""
+Rolling trip metrics over sliding windows of event time.
+
+`number_of_trips` and `travel_length` answer for a whole year of trips.
+Dispatch rather needs the trips of the last 15 minutes or the last hour by
+user type, and their mean duration. A SlidingWindow keeps those for one
+window length in a ring of buckets of bucket_seconds each:
+
+- adding a trip updates its bucket and the running totals of the window;
+- when event time moves into a new bucket, the buckets falling out of the
+  window are subtracted from the totals and cleared for reuse;
+- a query reads the running totals, whatever the number of trips.
+
+Both the update and the query take constant time for a given window and
+number of user types. Event time is the end time of the trips, their start
+time as read by `StartTimeDecoder.timestamp` plus their duration, since a
+trip is only reported once it is over: keyed on start time, every trip
+longer than the lateness would arrive too late. Trips may still arrive
+somewhat out of order: a trip up to lateness_seconds older than the latest
+one seen is still counted in its own bucket, as long as that bucket is
+still in the window. Older trips are dropped and counted in `dropped`.
+
+Between trips, event time follows the wall clock: a query first moves the
+window on by the time passed since the latest trip arrived, so that the
+"last 15 minutes" empty out while the feed is paused.
+
+Durations are kept as whole milliseconds, so that subtracting expired
+buckets never leaves rounding errors in the totals.
+
+    metrics = RollingMetrics()
+    metrics.add_trip(datum, 'NYC')
+    metrics.snapshot('NYC')[900]['by_user_type']['Customer']['count']
+"""
+
+import time
+
+from bikeshare.timeparse import StartTimeDecoder
+from bikeshare.trips import duration_in_mins, type_of_user
+
+
+# the window lengths of RollingMetrics, 15 minutes and one hour
+DEFAULT_WINDOWS = (15 * 60, 60 * 60)
+
+DEFAULT_BUCKET_SECONDS = 60
+
+# how much older than the latest trip seen a trip may be and still be counted
+DEFAULT_LATENESS_SECONDS = 5 * 60
+
+# durations are kept in milliseconds, of which there are this many in a minute
+DURATION_SCALE = 60 * 1000
+
+
+class SlidingWindow(object):
+    """
+    Trip counts and durations by user type over the last window_seconds of
+    event time, up to the bucket of the latest trip seen, or later by the
+    time clock (a function returning seconds) says has passed since.
+    """
+
+    def __init__(self, window_seconds, bucket_seconds=DEFAULT_BUCKET_SECONDS,
+                 lateness_seconds=DEFAULT_LATENESS_SECONDS, clock=time.monotonic):
+        if bucket_seconds <= 0 or window_seconds <= 0 or window_seconds % bucket_seconds:
+            raise ValueError('the window must be a whole positive number of buckets')
+        if lateness_seconds < 0:
+            raise ValueError('lateness_seconds must not be negative')
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.lateness_seconds = lateness_seconds
+        self.n_buckets = window_seconds // bucket_seconds
+        self.clock = clock
+
+        # bucket number of the latest bucket, time of the latest trip and the
+        # clock reading when event time last moved
+        self.head = None
+        self.latest = None
+        self.latest_at = None
+        # ring of counts and of duration totals of each user type
+        self.counts = {}
+        self.durations = {}
+        # running totals of the window, by user type and overall
+        self.type_counts = {}
+        self.type_durations = {}
+        self.n_total = 0
+        self.duration_total = 0
+        self.dropped = 0
+
+    def __repr__(self):
+        return 'SlidingWindow({}s, n_total={})'.format(self.window_seconds, self.n_total)
+
+    def advance(self, timestamp):
+        """
+        Moves event time up to timestamp, expiring the buckets that fall out
+        of the window. Earlier timestamps leave the window as it is.
+        """
+        if self.latest is not None and timestamp <= self.latest:
+            return
+        self.latest = timestamp
+        self.latest_at = self.clock()
+        bucket = int(timestamp // self.bucket_seconds)
+        if self.head is not None and bucket > self.head:
+            # a gap of a whole window or more empties every bucket once
+            first = max(self.head + 1, bucket - self.n_buckets + 1)
+            for number in range(first, bucket + 1):
+                self._expire(number % self.n_buckets)
+        if self.head is None or bucket > self.head:
+            self.head = bucket
+
+    def catch_up(self):
+        """
+        Moves event time on by the clock time passed since it last moved, so
+        that the window keeps sliding while no trips arrive.
+        """
+        if self.latest is not None:
+            self.advance(self.latest + (self.clock() - self.latest_at))
+
+    def _expire(self, position):
+        for user_type, counts in self.counts.items():
+            count = counts[position]
+            if count:
+                durations = self.durations[user_type]
+                self.type_counts[user_type] -= count
+                self.type_durations[user_type] -= durations[position]
+                self.n_total -= count
+                self.duration_total -= durations[position]
+                counts[position] = 0
+                durations[position] = 0
+
+    def add(self, timestamp, duration, user_type):
+        """
+        Adds a trip at the event time timestamp (in seconds), lasting
+        duration minutes. Returns False if the trip came too late to be
+        counted.
+        """
+        if self.latest is not None and timestamp < self.latest - self.lateness_seconds:
+            self.dropped += 1
+            return False
+        self.advance(timestamp)
+        bucket = int(timestamp // self.bucket_seconds)
+        if bucket <= self.head - self.n_buckets:
+            self.dropped += 1
+            return False
+
+        if user_type not in self.counts:
+            self.counts[user_type] = [0] * self.n_buckets
+            self.durations[user_type] = [0] * self.n_buckets
+            self.type_counts[user_type] = 0
+            self.type_durations[user_type] = 0
+        position = bucket % self.n_buckets
+        milliseconds = round(duration * DURATION_SCALE)
+        self.counts[user_type][position] += 1
+        self.durations[user_type][position] += milliseconds
+        self.type_counts[user_type] += 1
+        self.type_durations[user_type] += milliseconds
+        self.n_total += 1
+        self.duration_total += milliseconds
+        return True
+
+    def count(self, user_type=None):
+        """
+        Returns the number of trips in the window, of one user type or all.
+        """
+        self.catch_up()
+        if user_type is None:
+            return self.n_total
+        return self.type_counts.get(user_type, 0)
+
+    def mean_duration(self, user_type=None):
+        """
+        Returns the mean duration in minutes of the trips in the window, of
+        one user type or all, or None if there are none.
+        """
+        self.catch_up()
+        if user_type is None:
+            count, total = self.n_total, self.duration_total
+        else:
+            count = self.type_counts.get(user_type, 0)
+            total = self.type_durations.get(user_type, 0)
+        return total / count / DURATION_SCALE if count else None
+
+    def snapshot(self):
+        """
+        Returns a dictionary of the counts and mean durations of the window.
+        """
+        self.catch_up()
+        return {'window_seconds': self.window_seconds,
+                'window_end': None if self.head is None
+                else (self.head + 1) * self.bucket_seconds,
+                'n_total': self.n_total,
+                'mean_duration': self.mean_duration(),
+                'by_user_type': {user_type: {'count': count,
+                                             'mean_duration': self.mean_duration(user_type)}
+                                 for user_type, count in sorted(self.type_counts.items())},
+                'dropped': self.dropped}
+
+
+class RollingMetrics(object):
+    """
+    SlidingWindows of each of the window lengths windows (in seconds) for
+    every city that trips were added for.
+    """
+
+    def __init__(self, windows=DEFAULT_WINDOWS, bucket_seconds=DEFAULT_BUCKET_SECONDS,
+                 lateness_seconds=DEFAULT_LATENESS_SECONDS, clock=time.monotonic):
+        self.windows = tuple(windows)
+        self.bucket_seconds = bucket_seconds
+        self.lateness_seconds = lateness_seconds
+        self.clock = clock
+        self.cities = {}
+        self.decoders = {}
+
+    def city_windows(self, city):
+        """
+        Returns the SlidingWindows of a city, by window length.
+        """
+        if city not in self.cities:
+            self.cities[city] = {seconds: SlidingWindow(seconds, self.bucket_seconds,
+                                                        self.lateness_seconds, self.clock)
+                                 for seconds in self.windows}
+        return self.cities[city]
+
+    def add(self, city, timestamp, duration, user_type):
+        """
+        Adds a normalized trip of a city, started at timestamp and lasting
+        duration minutes, to each of its windows at its end time.
+        """
+        end = timestamp + duration * 60
+        for window in self.city_windows(city).values():
+            window.add(end, duration, user_type)
+
+    def add_trip(self, datum, city):
+        """
+        Takes as input a dictionary containing info about a single raw trip
+        (datum) and its origin city (city), and adds it to the windows of the
+        city at its end time.
+        """
+        if city not in self.decoders:
+            self.decoders[city] = StartTimeDecoder(city)
+        timestamp = self.decoders[city].timestamp(datum[self.decoders[city].column])
+        self.add(city, timestamp, duration_in_mins(datum, city), type_of_user(datum, city))
+
+    def snapshot(self, city):
+        """
+        Returns the snapshots of the windows of a city, by window length.
+        """
+        return {seconds: window.snapshot()
+                for seconds, window in self.city_windows(city).items()}
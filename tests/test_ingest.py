@@ -0,0 +1,113 @@
+"""
+Tests of the live ingestion service of bikeshare/ingest.py.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+
+import asyncio
+import json
+
+from bikeshare.ingest import IngestServer
+
+
+# seconds the queued batches may take to be aggregated, so that a stalled
+# aggregation fails the test instead of hanging it
+TIMEOUT = 10
+
+GOOD_TRIP = '{"tripduration": "839", "starttime": "1/1/2016 00:09:55", "usertype": "Subscriber"}'
+
+# 1e400 is read as an infinite float, and int(inf) raises an OverflowError in
+# duration_in_mins
+POISONED_TRIP = '{"tripduration": 1e400, "starttime": "1/1/2016 00:10:55", "usertype": "Customer"}'
+
+
+def batch(*trips):
+    return '[{}]'.format(', '.join(trips)).encode('utf-8')
+
+
+async def request(port, method, path, body=b''):
+    """
+    Sends one request to the service and returns its status code and JSON
+    document.
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = ['{} {} HTTP/1.1'.format(method, path), 'Host: 127.0.0.1',
+            'Content-Type: application/json', 'Content-Length: {}'.format(len(body)),
+            'Connection: close']
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return (int(head.split(b' ')[1]), json.loads(body.decode('utf-8')))
+
+
+async def drain(server):
+    """
+    Waits for the aggregation of the queued batches, for at most TIMEOUT
+    seconds.
+    """
+    await asyncio.wait_for(server.queue.join(), TIMEOUT)
+
+
+def run_server(scenario):
+    """
+    Runs the coroutine function scenario with a started IngestServer and
+    closes the server afterwards.
+    """
+    async def main():
+        server = IngestServer(port=0)
+        await server.start()
+        try:
+            return await scenario(server)
+        finally:
+            await server.close()
+
+    return asyncio.run(main())
+
+
+def test_poisoned_record_is_rejected():
+    async def scenario(server):
+        statuses = []
+        for body in (batch(POISONED_TRIP, GOOD_TRIP), batch(GOOD_TRIP)):
+            status, _ = await request(server.port, 'POST', '/trips/NYC', body)
+            statuses.append(status)
+        await drain(server)
+        assert not server.aggregator.done()
+        status, document = await request(server.port, 'GET', '/stats/NYC')
+        return statuses, status, document
+
+    statuses, status, document = run_server(scenario)
+    assert statuses == [202, 202]
+    assert status == 200
+    assert document['n_total'] == 2
+    assert document['n_subscribers'] == 2
+    assert document['rejected'] == 1
+
+
+def test_failing_batch_is_dropped():
+    async def scenario(server):
+        add_records = server.aggregates.add_records
+        calls = []
+
+        def fail_once(city, records):
+            calls.append(city)
+            if len(calls) == 1:
+                raise RuntimeError('aggregation failed')
+            return add_records(city, records)
+
+        server.aggregates.add_records = fail_once
+        statuses = []
+        for _ in range(3):
+            status, _ = await request(server.port, 'POST', '/trips/NYC', batch(GOOD_TRIP))
+            statuses.append(status)
+        await drain(server)
+        assert not server.aggregator.done()
+        status, document = await request(server.port, 'GET', '/stats')
+        return statuses, status, document
+
+    statuses, status, document = run_server(scenario)
+    assert statuses == [202, 202, 202]
+    assert status == 200
+    assert document['failed_batches'] == 1
+    assert document['cities']['NYC']['n_total'] == 2
@@ -0,0 +1,117 @@
+"""
+Round trip tests of the Parquet summaries of bikeshare/parquet.py, skipped
+where pyarrow is not installed.
+
+Run from the repository root with `python -m pytest tests`.
+"""
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from benchmarks.synthetic import write_city_file
+from bikeshare.histogram import DurationHistogram
+from bikeshare.pipeline import read_trips
+from bikeshare.sketch import DurationSketches
+from bikeshare.stats import summarize_trips
+from bikeshare.store import TripStore
+from bikeshare.trips import condense_data
+
+
+CITY = 'Washington'
+
+EDGES = [0, 5, 10, 15, 30, 60, 120, 1440]
+
+
+@pytest.fixture(scope='module')
+def summaries(tmp_path_factory):
+    """
+    Condenses a synthetic raw file of CITY into a csv and a Parquet summary,
+    and returns their paths.
+    """
+    directory = tmp_path_factory.mktemp('parquet')
+    in_file = write_city_file(CITY, 5000, str(directory))
+    csv_file = str(directory / 'summary.csv')
+    parquet_file = str(directory / 'summary.parquet')
+    condense_data(in_file, csv_file, CITY)
+    condense_data(in_file, parquet_file, CITY, out_format='parquet')
+    return csv_file, parquet_file
+
+
+@pytest.fixture(scope='module')
+def partitioned(tmp_path_factory):
+    """
+    Condenses the same synthetic raw file into a partitioned summary of
+    Parquet partitions, and returns its root.
+    """
+    root = str(tmp_path_factory.mktemp('partitioned'))
+    in_file = write_city_file(CITY, 5000, root)
+    condense_data(in_file, root, CITY, out_format='parquet', partitioned=True)
+    return root
+
+
+def assert_same_summary(summary, expected):
+    assert summary.n_subscribers == expected.n_subscribers
+    assert summary.n_customers == expected.n_customers
+    assert summary.long_trip == expected.long_trip
+    # the trips are added up in another order
+    assert summary.trip_length == pytest.approx(expected.trip_length)
+    assert summary.subs_trip_length == pytest.approx(expected.subs_trip_length)
+
+
+def test_read_trips(summaries):
+    csv_file, parquet_file = summaries
+    # a Parquet summary keeps the order of the raw file within each month
+    expected = sorted(read_trips(csv_file), key=lambda trip: trip.month)
+    assert list(read_trips(parquet_file)) == expected
+
+
+def test_summarize_trips(summaries):
+    csv_file, parquet_file = summaries
+    assert_same_summary(summarize_trips(parquet_file), summarize_trips(csv_file))
+    assert_same_summary(summarize_trips(parquet_file, months=[6, 7], days=['Sunday']),
+                        summarize_trips(csv_file, months=[6, 7], days=['Sunday']))
+
+
+def test_histogram_and_sketches(summaries):
+    histograms = []
+    sketches = []
+    for filename in summaries:
+        histogram = DurationHistogram(EDGES, split_by='user_type')
+        histogram.add_summary(filename)
+        histograms.append(histogram)
+        sketch = DurationSketches(CITY)
+        sketch.add_summary(filename)
+        sketches.append(sketch)
+    for user_type in ('Subscriber', 'Customer'):
+        assert histograms[1].bin_counts(user_type) == histograms[0].bin_counts(user_type)
+    assert sketches[1].query().count == sketches[0].query().count
+
+
+def test_load_summary_frame(summaries):
+    pd = pytest.importorskip('pandas')
+    from bikeshare.columnar import load_summary_frame
+
+    csv_file, parquet_file = summaries
+    expected = load_summary_frame(csv_file, months=[3]).reset_index(drop=True)
+    frame = load_summary_frame(parquet_file, months=[3]).reset_index(drop=True)
+    # read_csv parses the durations to within a few units in the last place
+    pd.testing.assert_frame_equal(frame, expected, check_exact=False)
+
+
+def test_partitioned(summaries, partitioned, tmp_path):
+    csv_file, _ = summaries
+    assert_same_summary(summarize_trips(partitioned), summarize_trips(csv_file))
+    assert_same_summary(summarize_trips(partitioned, cities=[CITY], months=[3]),
+                        summarize_trips(csv_file, months=[3]))
+
+    histograms = []
+    for filename in (csv_file, partitioned):
+        histogram = DurationHistogram(EDGES)
+        histogram.add_summary(filename)
+        histograms.append(histogram)
+    assert histograms[1].bin_counts() == histograms[0].bin_counts()
+
+    with TripStore(str(tmp_path / 'trips.db')) as store:
+        assert store.load_summary(partitioned, CITY) == 5000
+        assert store.cities() == [CITY]